@@ -1,22 +1,32 @@
 import os
 import json
+import mimetypes
 from sqlite3 import Error as Sqlite_error
 
-from flask import Flask, flash, redirect, render_template, request, session
+from flask import Flask, flash, g, redirect, render_template, request, send_from_directory, session
 from flask_session import Session
 from tempfile import mkdtemp
 from werkzeug.exceptions import default_exceptions
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
+try:
+    from werkzeug.utils import safe_join
+except ImportError: # Werkzeug < 2.0
+    from werkzeug.security import safe_join
 
 from backend.Allergy import Allergy
 from backend.IngredientCategory import IngredientCategory
 from backend.Ingredient import Ingredient
 from backend.Recipe import Recipe, Content
 from backend.User import User
-from backend.DBHandler import DBHandler, DBError
-from backend.DBEntry import FoodEncoder
-from helpers import apology, login_required, admin_required, is_content, categories, nl2br, username_valid
+from backend.Principal import Principal, PrincipalStore
+from backend.JSONCache import JSONCache
+from backend.DBHandler import DBHandler, DBError, DEFAULT_DB_PATH
+from backend.DBEntry import FoodEncoder, to_ids
+from backend.MealSuggester import MealSuggester
+from backend import search
+import compression
+from helpers import apology, login_required, admin_required, is_content, categories, nl2br, username_valid, encode_cursor, decode_cursor, static_url
 
 # Configure application
 app = Flask(__name__)
@@ -26,6 +36,7 @@ app.jinja_env.filters["zip"] = zip
 app.jinja_env.filters["nl2br"] = nl2br
 app.jinja_env.filters["is_content"] = is_content
 app.jinja_env.filters["categories"] = categories
+app.jinja_env.globals["static_url"] = static_url
 app.jinja_env.trim_blocks = True
 app.jinja_env.lstrip_blocks = True
 
@@ -38,14 +49,61 @@ app.config["RECIPE_IMG_PATH"] = os.path.join(app.root_path, "static/images/recip
 app.config['MAX_CONTENT_LENGTH'] = 0.5 * 1024 * 1024 # limit max file size to 0.5MB
 
 
-# Ensure responses aren't cached
+# Configure HTTP caching
+STATIC_MAX_AGE = 365 * 24 * 3600 # seconds fingerprinted static files are cached for
+
 @app.after_request
 def after_request(response):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    """Set caching policy of the response unless its route did.
+
+    Static files fingerprinted by static_url() never change under their URL, so they are cached
+    for good. Other static files (e.g. recipe images replaced by admins) are revalidated by their
+    ETag and Last-Modified date on every use. Pages and API responses depend on the session and
+    are not stored.
+    """
+    if request.endpoint == "static":
+        if request.args.get("v") and response.status_code < 400:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, no-cache"
+    elif "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
+    return response
+
+
+# Configure response compression
+COMPRESSION_MIN_SIZE = 1024 # bytes, smaller responses are sent uncompressed
+
+@app.after_request
+def compress(response):
+    """Compress pages and JSON with the content coding negotiated with the client"""
+    return compression.compress_response(response, request.headers.get("Accept-Encoding", ""),
+                                         COMPRESSION_MIN_SIZE)
+
+
+@app.endpoint("static")
+def static(filename):
+    """Send the static file, or its variant compressed ahead of time by compress_static.py that
+    the client accepts
+    """
+    # None for paths outside of the folder, which send_static_file() rejects
+    path = safe_join(app.static_folder, filename)
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    encoding = path and compression.static_encoding(path, accept_encoding)
+    if encoding:
+        response = send_from_directory(app.static_folder,
+                                       filename + compression.STATIC_SUFFIXES[encoding],
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = app.send_static_file(filename)
+    if encoding or compression.has_static_variants(path):
+        response.vary.add("Accept-Encoding")
     return response
 
+
 # Configure session to use filesystem (instead of signed cookies)
 app.config["SESSION_FILE_DIR"] = mkdtemp()
 app.config["SESSION_PERMANENT"] = False
@@ -54,8 +112,82 @@ Session(app)
 
 
 # Configure db access and JSON encoder
-db = DBHandler()
-enc = FoodEncoder(indent = 2)
+ENTITY_CACHE_SIZE = 10000 # max number of catalog objects shared between requests
+ENTITY_CACHE_TTL = 300 # seconds
+DB_PATH = os.environ.get("FOOD_DB_PATH", DEFAULT_DB_PATH)
+db = DBHandler(DB_PATH, cache_size=ENTITY_CACHE_SIZE, cache_ttl=ENTITY_CACHE_TTL)
+db.migrate()
+db.release()
+# Pretty-printed JSON is only worth its size and encoding time when debugging
+enc = FoodEncoder(indent=2) if app.debug else FoodEncoder(separators=(",", ":"))
+
+# Configure admin pages
+ADMIN_PAGE_SIZE = 100 # number of summary rows shown per page
+
+# Configure ingredient name completion
+MAX_COMPLETIONS = 50 # max number of ingredients returned by a single completion request
+DEFAULT_COMPLETIONS = 10
+
+# Configure recipe search
+MAX_SEARCH_RESULTS = 50 # max number of recipes returned by a single search request
+DEFAULT_SEARCH_RESULTS = 20
+
+# Configure meal suggestions
+MAX_SUGGESTIONS = 20 # max number of recipes returned by a single /suggest request
+suggester = MealSuggester(db)
+
+# Load logged in users' principals for authenticated routes
+principals = PrincipalStore(db)
+
+# Configure JSON cache of catalog objects served by /json
+JSON_CACHE_SIZE = 10000 # max number of objects kept in memory
+JSON_CACHE_PERSIST = False # whether the cache is also stored in the DB to survive restarts
+json_cache = JSONCache(db, enc, JSON_CACHE_SIZE, JSON_CACHE_PERSIST)
+# Types of catalog objects served from the cache
+CATALOG_TYPES = {
+    "allergy"            : Allergy,
+    "ingredient_category": IngredientCategory,
+    "ingredient"         : Ingredient,
+    "recipe"             : Recipe,
+}
+MAX_BATCH_OBJECTS = 100 # max number of objects requested by a single /json/batch request
+
+# Configure recipes by available ingredients
+MAX_PANTRY_INGREDIENTS = 200 # max number of ingredients accepted by a single request
+MAX_PANTRY_RESULTS = 50 # max number of recipes returned by a single request
+DEFAULT_PANTRY_RESULTS = 20
+
+
+# Materialize each DB entry at most once per request
+@app.before_request
+def begin_db_scope():
+    db.cache.begin_scope()
+
+
+# Return the DB connection used by the request's thread to the pool
+@app.teardown_request
+def release_db(exception):
+    db.cache.end_scope()
+    db.release()
+
+
+def current_user():
+    """Get Principal of the logged in user. It is loaded at most once per request."""
+    if "principal" not in g:
+        g.principal = principals.get(session)
+    return g.principal
+
+
+# Admin rights may be revoked or the user removed by another worker since the login
+@app.before_request
+def refresh_session_user():
+    if request.endpoint == "static" or session.get("user_id") is None:
+        return
+    user = current_user()
+    if user is None:
+        session.clear()
+    elif session.get("is_admin") != user.is_admin:
+        session["is_admin"] = user.is_admin
 
 
 @app.route("/")
@@ -63,10 +195,9 @@ enc = FoodEncoder(indent = 2)
 def index():
     """Show user's home page"""
 
-    user = User.from_db(db=db, id=session.get("user_id"))
+    user = current_user()
     try:
-        recipe_ids = {m.id for m in user.meals}
-        recipes = [Recipe.from_db(db=db, id=id) for id in recipe_ids]
+        recipes = list(user.meals)
     except AttributeError:
         recipes=[]
 
@@ -81,25 +212,55 @@ def admin_display(obj_type):
     """Show admin page for selected object type"""
     template = obj_type + ".html" if obj_type else "admin.html"
     if obj_type == "allergies":
-        kwargs = {"rows":Allergy.get_summary(db)}
+        kwargs = summary_page(Allergy)
     elif obj_type == "ingredient_categories":
-        kwargs = {"rows":IngredientCategory.get_summary(db)}
+        kwargs = summary_page(IngredientCategory)
     elif obj_type == "ingredients":
-        kwargs = {"rows"      : Ingredient.get_summary(db),
-                  "categories": db.get_rows("ingredient_categories"),
-                  "allergies" : db.get_rows("allergies")}
+        kwargs = summary_page(Ingredient)
+        kwargs.update({"categories": db.get_rows("ingredient_categories"),
+                       "allergies" : db.get_rows("allergies")})
     elif obj_type == "recipes":
-        kwargs = {"rows"       : Recipe.get_summary(db),
-                  "ingredients": db.get_rows("ingredients")}
+        kwargs = summary_page(Recipe)
     elif obj_type == "users":
-        kwargs = {"rows"      : User.get_summary(db),
-                  "allergies" : db.get_rows("allergies")}
+        kwargs = summary_page(User)
+        kwargs.update({"allergies" : db.get_rows("allergies")})
     else:
         kwargs = {}
 
     return render_template(template, **kwargs)
 
 
+def summary_page(cls):
+    """Return dictionary of template arguments for a page of the class summary selected by
+    request args:
+    sort: "name" (default) or "id".
+    desc: sort in descending order if not empty.
+    q: show only entries with names containing it.
+    after: cursor of the page to show, as given in 'next_page'. The first page by default.
+    """
+    name_sort = request.args.get("sort", "name") != "id"
+    descending = bool(request.args.get("desc"))
+    name_filter = request.args.get("q", "").strip()
+
+    # Cursor is the summary key of the last row of the previous page
+    after = decode_cursor(request.args.get("after"))
+    if name_sort:
+        after = tuple(after) if isinstance(after, list) and len(after) == 2 else None
+    elif not isinstance(after, int):
+        after = None
+
+    rows, next_after = cls.get_summary_page(db, ADMIN_PAGE_SIZE, name_sort=name_sort,
+                                            name_filter=name_filter, after=after,
+                                            descending=descending)
+
+    page_args = {"sort": "name" if name_sort else "id", "q": name_filter}
+    if descending:
+        page_args["desc"] = 1
+    return {"rows"     : rows,
+            "page_args": page_args,
+            "next_page": encode_cursor(next_after) if next_after is not None else None}
+
+
 @app.route("/admin/<string:obj_type>", methods=["POST"])
 @login_required
 @admin_required
@@ -123,7 +284,7 @@ def admin_write(obj_type):
         category_id = request.form.get("category_id")
         category = IngredientCategory.from_db(db=db, id=category_id)
         allergy_ids = request.form.getlist("allergies")
-        allergies = {Allergy.from_db(db=db, id=id) for id in allergy_ids}
+        allergies = set(Allergy.from_db_many(db=db, ids=allergy_ids).values())
 
         obj = Ingredient(name, category, allergies, db, id)
     elif obj_type == "recipes":
@@ -134,8 +295,9 @@ def admin_write(obj_type):
             form_contents = json.loads(request.form.get("contents"))
         except:
             form_contents = None
+        ingredients = Ingredient.from_db_many(db=db, ids=[fc["ingredient_id"] for fc in form_contents])
         for fc in form_contents:
-            ingredient = Ingredient.from_db(db=db, id=fc["ingredient_id"])
+            ingredient = ingredients.get(int(fc["ingredient_id"]))
             try:
                 amount = float(fc["amount"])
             except KeyError:
@@ -241,19 +403,19 @@ def account(form):
     """Show account settings for GET.
     Write new user settings to  DB for POST.
     """
-    user = User.from_db(db=db, id=session.get("user_id"))
-
     # User reached "/account" route via GET (as by clicking a link or via redirect)
     if request.method == "GET" and not form:
         allergies = db.get_rows("allergies", order_by="name ASC")
-        user_allergies = {x.id for x in user.allergies}
+        user_allergies = current_user().allergy_ids
 
         return render_template("account.html", allergies=allergies, user_allergies=user_allergies)
 
+    user = User.from_db(db=db, id=session.get("user_id"))
+
     # User reached "/account/<form>" route via POST (as by submitting a form via POST)
     if form == "allergies":
         allergy_ids = request.form.getlist("allergies")
-        allergies = {Allergy.from_db(db, id) for id in allergy_ids}
+        allergies = set(Allergy.from_db_many(db, allergy_ids).values())
         user.allergies = allergies
     elif form == "password":
         current_password = request.form.get("current_password")
@@ -415,7 +577,7 @@ def action():
     if not command or not id:
         return("Missing or invalid params")
 
-    user = User.from_db(db=db, id=session.get("user_id"))
+    user = current_user()
 
     d = {
         "add_meal"   : lambda user, id: user.add_meal(id),
@@ -429,6 +591,112 @@ def action():
     return("success")
 
 
+@app.route("/suggest", methods=["GET", "POST"])
+@login_required
+def suggest():
+    """Get JSON list of up to n random recipes suitable for the user. Recipes in user's meal plan
+    and those listed in the comma separated 'exclude' param are not suggested. An empty list means
+    there are no more suitable recipes.
+    """
+    params = request.form if request.method == "POST" else request.args
+    try:
+        n = min(max(int(params.get("n", 1)), 1), MAX_SUGGESTIONS)
+    except ValueError:
+        n = 1
+    exclude = to_ids(params.get("exclude", "").split(","))
+
+    user = current_user()
+    ids = suggester.suggest(user, n, exclude)
+    recipes = Recipe.from_db_many(db, ids)
+
+    response = app.response_class(
+        response=enc.encode_bytes([recipes[id] for id in ids if id in recipes]),
+        mimetype='application/json'
+    )
+
+    return response
+
+
+@app.route("/api/ingredients/complete", methods=["GET"])
+@login_required
+def complete_ingredients():
+    """Get JSON list of ingredients ({"id", "name"}) matching the 'q' param for typeahead inputs.
+    Matching is case insensitive by the beginning of the name or of each of its words. The
+    number of ingredients is capped by the 'limit' param.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_COMPLETIONS)), 1), MAX_COMPLETIONS)
+    except ValueError:
+        limit = DEFAULT_COMPLETIONS
+    ingredients = db.ingredient_index.complete(request.args.get("q", ""), limit)
+
+    response = app.response_class(
+        response=json.dumps(ingredients),
+        mimetype='application/json'
+    )
+
+    return response
+
+
+@app.route("/search", methods=["GET"])
+@login_required
+def search_recipes():
+    """Get JSON list of recipes matching words of the 'q' param in their names, instructions or
+    ingredients, most relevant first. Each recipe has 'id', 'name' and 'snippet' of instructions
+    with matches wrapped in <mark> tags, and 'rank'. If the 'valid' param is not empty, only
+    recipes suitable for the user are included. Paginated by 'limit' and 'offset' params.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_SEARCH_RESULTS)), 1),
+                    MAX_SEARCH_RESULTS)
+        offset = max(int(request.args.get("offset", 0)), 0)
+    except ValueError:
+        return apology("invalid limit or offset", 400)
+
+    valid_ids = None
+    if request.args.get("valid"):
+        valid_ids = current_user().get_valid_recipes_id()
+    results = search.search(db, request.args.get("q", ""), limit, offset, valid_ids)
+
+    response = app.response_class(
+        response=json.dumps(results),
+        mimetype='application/json'
+    )
+
+    return response
+
+
+@app.route("/api/recipes/by_ingredients", methods=["GET"])
+@login_required
+def recipes_by_ingredients():
+    """Get JSON list of recipes that can be cooked mostly from the ingredients listed in the
+    comma separated 'ingredients' param, best covered first. Recipes causing any of the user's
+    allergies are excluded. Each item has the 'recipe', its 'coverage' (share of its ingredients
+    that are listed), the number of 'matched' ingredients and ids of 'missing' ingredients. The
+    number of recipes is capped by the 'limit' param.
+    """
+    try:
+        limit = min(max(int(request.args.get("limit", DEFAULT_PANTRY_RESULTS)), 1),
+                    MAX_PANTRY_RESULTS)
+    except ValueError:
+        return apology("invalid limit", 400)
+    ingredient_ids = to_ids(request.args.get("ingredients", "").split(","))
+    if len(ingredient_ids) > MAX_PANTRY_INGREDIENTS:
+        return apology("too many ingredients", 400)
+
+    results = db.pantry_index.rank(ingredient_ids, limit, current_user().get_valid_recipes_id())
+    recipes = Recipe.from_db_many(db, [result["id"] for result in results])
+    for result in results:
+        result["recipe"] = recipes.get(result.pop("id"))
+
+    response = app.response_class(
+        response=enc.encode_bytes([result for result in results if result["recipe"]]),
+        mimetype='application/json'
+    )
+
+    return response
+
+
 @app.route("/json", methods=["GET", "POST"])
 @login_required
 def get_JSON():
@@ -454,25 +722,97 @@ def get_JSON():
     # Users can access only their own user obj and valid_meals
     user_id = session.get("user_id")
     d = {
-        "allergy"            : lambda db, id: Allergy.from_db(db, id),
-        "ingredient_category": lambda db, id: IngredientCategory.from_db(db, id),
-        "ingredient"         : lambda db, id: Ingredient.from_db(db, id),
-        "recipe"             : lambda db, id: Recipe.from_db(db, id),
         "user"               : lambda db, id: User.from_db(db, id),
-        "valid_meals"        : lambda db, id: User.from_db(db, id).get_valid_recipes_id(),
+        "valid_meals"        : lambda db, id: Principal.from_db(db, id).get_valid_recipes_id(),
     }
-    try:
-        obj = d[obj_type](db, id)
-    except KeyError:
+    if obj_type in CATALOG_TYPES:
+        cached_json = json_cache.get(CATALOG_TYPES[obj_type], id)
+        data = cached_json.data if cached_json else None
+    elif obj_type in d:
+        cached_json = None
+        data = enc.encode_bytes(d[obj_type](db, id))
+    else:
         return("Missing or invalid params")
 
     response = app.response_class(
-        response=enc.encode(obj),
+        response=data if data is not None else enc.encode_bytes(None),
         mimetype='application/json'
     )
+    # Catalog objects are revalidated by their ETag, which changes with any change of the object
+    if cached_json:
+        response.set_etag(cached_json.etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.make_conditional(request)
 
     return response
 
+
+@app.route("/json/batch", methods=["GET", "POST"])
+@login_required
+def get_JSON_batch():
+    """Get JSON reprs of many catalog objects at once.
+
+    Objects are requested as a list of {"obj_type": ..., "id": ...} items under the "objects" key
+    of a JSON body, or as "objects=recipe:1,ingredient:2" in the query string. Responds with
+    {"objects": [...]} listing {"obj_type": ..., "id": ..., "object": ...} items in the requested
+    order, with an "error" instead of the "object" for items that could not be fetched. With
+    "stream=1" the document is sent in chunks rather than assembled first.
+    """
+    if request.method == "POST":
+        body = request.get_json(silent=True)
+        items = body.get("objects") if isinstance(body, dict) else None
+        if not isinstance(items, list) or not all(isinstance(i, dict) for i in items):
+            return apology("invalid objects", 400)
+        items = [(item.get("obj_type"), item.get("id")) for item in items]
+        stream = bool(body.get("stream"))
+    else:
+        items = [tuple(item.partition(":")[::2])
+                 for item in request.args.get("objects", "").split(",") if item]
+        stream = request.args.get("stream") == "1"
+    if len(items) > MAX_BATCH_OBJECTS:
+        return apology("too many objects", 400)
+
+    requested = []
+    ids = {} # obj_type -> list of valid ids requested
+    for obj_type, id in items:
+        obj_type = str(obj_type).lower()
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            id = None
+        requested.append((obj_type, id))
+        if obj_type in CATALOG_TYPES and id and id > 0:
+            ids.setdefault(obj_type, []).append(id)
+
+    # Objects are loaded within the request, a streamed response only splices their JSON
+    found = {}
+    for obj_type, type_ids in ids.items():
+        cached = json_cache.get_many(CATALOG_TYPES[obj_type], type_ids)
+        found.update(((obj_type, id), c.data) for id, c in cached.items())
+
+    def generate():
+        yield b'{"objects":['
+        for i, (obj_type, id) in enumerate(requested):
+            item = {"obj_type": obj_type, "id": id}
+            if obj_type not in CATALOG_TYPES:
+                item["error"] = "unknown obj_type"
+            elif not id or id < 1:
+                item["error"] = "invalid id"
+            elif (obj_type, id) not in found:
+                item["error"] = "not found"
+            if i:
+                yield b','
+            if "error" in item:
+                yield enc.encode_bytes(item)
+            else:
+                yield enc.encode_bytes(item)[:-1] + b',"object":' + found[obj_type, id] + b'}'
+        yield b']}'
+
+    return app.response_class(
+        response=generate() if stream else b"".join(generate()),
+        mimetype='application/json'
+    )
+
 def errorhandler(e):
     """Handle error"""
     return apology(e.name, e.code)
@@ -0,0 +1,179 @@
+import itertools
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections.abc import Set
+
+
+class AllergenIndex(object):
+    """In-memory index of recipes' allergens used to find recipes suitable for a set of allergies.
+
+    Every allergy referenced by an ingredient gets a bit and every recipe with contents gets a mask
+    with the bits of all its allergies from the recipe_allergens table. Recipes are grouped by mask into compact
+    sorted arrays of ids, so finding suitable recipes takes a single mask test per distinct
+    combination of allergens rather than per recipe. Results are RecipeIdSet views of the
+    matching groups' arrays and are cached per allergies mask. Group arrays are never modified in
+    place, so the views stay valid after the index changes.
+
+    The index is loaded on first use and kept up to date incrementally by on_change(), which is
+    registered as a DBHandler listener. Changes made by other processes require refresh().
+    """
+    def __init__(self, db):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler. Used to load recipes' allergens.
+        """
+        self.db = db
+        self.version = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._bits = {} # allergy id -> bit
+        self._masks = {} # recipe id -> allergens mask
+        self._groups = {} # allergens mask -> sorted array of recipe ids
+        self._valid = {} # allergies mask -> RecipeIdSet of suitable recipe ids
+
+    def refresh(self):
+        """(Re)load the whole index from DB"""
+        rows = self.db.c.execute(
+            'SELECT recipes.id, recipe_allergens.allergy_id '
+            'FROM recipes '
+            'LEFT JOIN recipe_allergens ON recipes.id = recipe_allergens.recipe_id '
+            'WHERE EXISTS (SELECT 1 FROM recipe_contents WHERE recipe_id = recipes.id)'
+        ).fetchall()
+
+        with self._lock:
+            self._masks = self._rows_to_masks(rows)
+            self._groups = {}
+            for recipe_id in sorted(self._masks):
+                mask = self._masks[recipe_id]
+                self._groups.setdefault(mask, array("q")).append(recipe_id)
+            self._changed()
+            self._loaded = True
+
+    def mask_of(self, allergy_ids):
+        """Return mask of allergies. Allergies not caused by any ingredient are omitted"""
+        self._ensure_loaded()
+        mask = 0
+        for id in allergy_ids:
+            mask |= self._bits.get(id, 0)
+        return mask
+
+    def valid_recipe_ids(self, allergy_ids):
+        """Return RecipeIdSet of ids of recipes with contents that cause none of the allergies
+
+        :param allergy_ids: An iterable of allergy ids.
+        """
+        user_mask = self.mask_of(allergy_ids)
+        with self._lock:
+            try:
+                return self._valid[user_mask]
+            except KeyError:
+                pass
+            ids = RecipeIdSet([ids for mask, ids in self._groups.items() if not mask & user_mask])
+            self._valid[user_mask] = ids
+            return ids
+
+    def update_recipes(self, recipe_ids):
+        """Reload masks of the recipes from DB"""
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids or not self._loaded:
+            return
+        rows = self.db.select_in(
+            'SELECT recipes.id, recipe_allergens.allergy_id '
+            'FROM recipes '
+            'LEFT JOIN recipe_allergens ON recipes.id = recipe_allergens.recipe_id '
+            'WHERE recipes.id IN ({}) '
+            '  AND EXISTS (SELECT 1 FROM recipe_contents WHERE recipe_id = recipes.id)',
+            recipe_ids
+        )
+        with self._lock:
+            masks = self._rows_to_masks(rows)
+            for recipe_id in recipe_ids:
+                self._move(recipe_id, masks.get(recipe_id))
+            self._changed()
+
+    def update_ingredient(self, ingredient_id):
+        """Reload masks of the recipes containing the ingredient from DB"""
+        if not self._loaded:
+            return
+        rows = self.db.c.execute('SELECT recipe_id FROM recipe_contents WHERE ingredient_id = ?',
+                                 (ingredient_id,)).fetchall()
+        self.update_recipes(row["recipe_id"] for row in rows)
+
+    def on_change(self, obj, action):
+        """DBHandler listener. Update index after a recipe or an ingredient changes in DB"""
+        if obj.table_main == "recipes":
+            self.update_recipes([obj.id])
+        elif obj.table_main == "ingredients" and action == "write":
+            self.update_ingredient(obj.id)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.refresh()
+
+    def _rows_to_masks(self, rows):
+        """Return dictionary of recipe masks built from (recipe_id, allergy_id) rows"""
+        masks = {}
+        for recipe_id, allergy_id in rows:
+            mask = masks.get(recipe_id, 0)
+            if allergy_id is not None:
+                bit = self._bits.get(allergy_id)
+                if bit is None:
+                    bit = self._bits[allergy_id] = 1 << len(self._bits)
+                mask |= bit
+            masks[recipe_id] = mask
+        return masks
+
+    def _move(self, recipe_id, new_mask):
+        """Move recipe to the group of the new mask. None removes it from the index.
+        Affected groups are replaced by modified copies.
+        """
+        old_mask = self._masks.pop(recipe_id, None)
+        if old_mask is not None:
+            group = array("q", self._groups[old_mask])
+            del group[bisect_left(group, recipe_id)]
+            if group:
+                self._groups[old_mask] = group
+            else:
+                del self._groups[old_mask]
+        if new_mask is not None:
+            self._masks[recipe_id] = new_mask
+            group = array("q", self._groups.get(new_mask, ()))
+            insort(group, recipe_id)
+            self._groups[new_mask] = group
+
+    def _changed(self):
+        self._valid = {}
+        self.version += 1
+
+
+class RecipeIdSet(Set):
+    """Immutable set of recipe ids backed by sorted arrays of ids. Iteration and len() work on the
+    arrays directly, a hash set for membership tests is only built on the first such test.
+    """
+    def __init__(self, arrays):
+        """ :param arrays: A list of arrays of unique ids. Must not be modified afterwards."""
+        self._arrays = arrays
+        self._len = sum(len(a) for a in arrays)
+        self._set = None
+
+    @classmethod
+    def _from_iterable(cls, it):
+        # Results of set operations are regular frozensets
+        return frozenset(it)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        return itertools.chain.from_iterable(self._arrays)
+
+    def __contains__(self, id):
+        if self._set is None:
+            self._set = frozenset(self)
+        return id in self._set
+
+    def toJSONifiable(self):
+        return list(self)
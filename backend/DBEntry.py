@@ -1,8 +1,51 @@
+import functools
 import json
-import inspect
+import operator
 import sqlite3
+from collections import namedtuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 import backend.DBHandler
+from backend.LazySet import LazySet
+
+
+SummaryColumn = namedtuple("SummaryColumn", "key expression convert", defaults=(None,))
+SummaryColumn.__doc__ = """Column of a summary table.
+
+key - a string. Name of the column in the summary.
+expression - a string. SQL expression evaluated for each row of the class main table.
+convert - a callable applied to the values read from the DB. Optional.
+"""
+
+SummaryList = namedtuple("SummaryList", "key association value join sort_by",
+                         defaults=(None, None))
+SummaryList.__doc__ = """List column of a summary table.
+
+key - a string. Name of the column in the summary.
+association - a string. Name of the association table (as listed in 'associations') whose rows
+    referencing the entry make up the list.
+value - a string. SQL expression of a list item evaluated for each of the association rows.
+join - a string. JOIN clause joining other tables to the association table. Optional.
+sort_by - a string. Key the list is sorted by when the list items are JSON objects. Optional.
+"""
+
+TrackedCollection = namedtuple("TrackedCollection", "attribute table column key values to_row",
+                               defaults=((), None))
+TrackedCollection.__doc__ = """Collection attribute of an entry stored in an association table,
+whose changes are written by DBEntry.edit_in_db().
+
+attribute - a string. Name of the attribute holding the collection (a set or a LazySet).
+table - a string. Name of the association table.
+column - a string. Foreign key column of the table referencing the entry.
+key - a string. Column of the table identifying an item within the collection.
+values - a tuple of strings. Other columns of the table set from an item. Optional.
+to_row - a callable returning tuple of the key and the values of an item. Defaults to the id
+    of an entry.
+"""
 
 
 class DBEntry(object):
@@ -18,10 +61,48 @@ class DBEntry(object):
             when deleting object in DB. Otherwise, presence of such rows during deletion leads to
             an error.
 
-    Both attributes populated by None values since DBEntry is an abstract and is not stored in DB.
+    :attr summary_columns: A list of SummaryColumn tuples. Columns of the summary table built by
+        get_summary() taken from the main table.
+    :attr summary_lists: A list of SummaryList tuples. Columns of the summary table listing
+        entries of deletable associations (e.g. allergies of a user).
+    :attr tracked_collections: A list of TrackedCollection tuples. Collections of the entry
+        written by edit_in_db().
+
+    :attr embeds: A tuple of DBEntry subclasses whose objects are embedded into objects of this
+        class (e.g. ingredients of a recipe). Used to invalidate cached objects.
+    :attr cacheable: A boolean. Whether objects of this class may be kept in the process-wide
+        entity cache shared between requests.
+    :attr json_fields: A tuple of strings. Attributes making up the JSON representation of an
+        object, in that order.
+
+    Both table attributes populated by None values since DBEntry is an abstract and is not
+    stored in DB.
     """
     table_main = None
     associations = [(None,None, None)]
+    summary_columns = [
+        SummaryColumn("id", "id"),
+        SummaryColumn("name", "name"),
+    ]
+    summary_lists = []
+    tracked_collections = []
+    embeds = ()
+    cacheable = True
+    json_fields = ("name", "id")
+
+    def __init_subclass__(cls, **kwargs):
+        """Build the SQL texts used to load entries of the subclass once so that each of them is
+        prepared once per connection and then reused from sqlite3's statement cache. Compile the
+        subclass' JSON serializer.
+        """
+        super().__init_subclass__(**kwargs)
+        cls.json_serializer = staticmethod(json_serializer(cls.json_fields))
+        if cls.table_main:
+            table_main = to_db_obj_name(cls.table_main)
+            cls.sql_select_by_id = f'SELECT * FROM "{table_main}" WHERE id = ?'
+            cls.sql_select_by_name = f'SELECT * FROM "{table_main}" WHERE name = ?'
+            cls.sql_select_in = f'SELECT * FROM "{table_main}" WHERE id IN ({{}}) ORDER BY id ASC'
+            cls.sql_summary = cls.summary_query()
 
     def __init__(self, name, db=None, id=None):
         """Constructor. Returns functional object.
@@ -41,11 +122,48 @@ class DBEntry(object):
         """Search DB for class object entry by id or name (in that priority) and return
         constructed object. Returns None if id is not found.
         """
+        cached_ids = to_ids([id]) if id else set()
+        if cached_ids:
+            obj = db.cache.get(cls, cached_ids.pop())
+            if obj:
+                return obj
+
         db_attrs = cls.get_db_attrs(db, id, name)
 
         if not db_attrs:
             return None
-        return cls(db=db, **db_attrs)
+        obj = db.cache.get(cls, db_attrs["id"])
+        if not obj:
+            obj = cls.from_db_attrs(db, [db_attrs])[db_attrs["id"]]
+            obj.mark_clean()
+            db.cache.add(obj)
+        return obj
+
+    @classmethod
+    def from_db_many(cls, db, ids):
+        """Search DB for class object entries by ids and return dictionary of constructed objects
+        keyed by id. Ids that are not found are omitted.
+
+        The whole object graph is loaded with a fixed number of queries regardless of the number
+        of objects. Objects present in the DBHandler's entity cache are reused.
+        """
+        objects, missing = db.cache.get_many(cls, to_ids(ids))
+        if missing:
+            loaded = cls.from_db_attrs(db, cls.get_db_attrs_many(db, missing))
+            for obj in loaded.values():
+                obj.mark_clean()
+                db.cache.add(obj)
+            objects.update(loaded)
+
+        return objects
+
+    @classmethod
+    def from_db_attrs(cls, db, attrs_list):
+        """Construct objects from a list of dictionaries returned by get_db_attrs() and return
+        them as a dictionary keyed by id. Subclasses with associated objects load those for all
+        of the entries at once.
+        """
+        return {attrs["id"]: cls(db=db, **attrs) for attrs in attrs_list}
 
     @classmethod
     def exists_in_db(cls, db, id=None, name=None):
@@ -65,28 +183,167 @@ class DBEntry(object):
         """Search DB for entry by id or name (in that priority). Return dictionary of values
         necesary for constructor. Returns None if entry is not found.
 
-        Entry is searched in the table with name defined by the 'table_main' class attribue.
-        DBEntry
+        Entry is searched in the table with name defined by the 'table_main' class attribue
+        with a single query.
         """
-        if not cls.exists_in_db(db, id, name):
-            return None
-
-        table_main = to_db_obj_name(cls.table_main)
-
         if id:
             needle = (id,)
-            query = f'SELECT * FROM "{table_main}" WHERE id = ?'
+            query = cls.sql_select_by_id
         elif name:
             needle = (name,)
-            query = f'SELECT * FROM "{table_main}" WHERE name = ?'
+            query = cls.sql_select_by_name
         else:
             raise ValueError("Must provide at least one of id and name")
         row = db.c.execute(query, needle).fetchone()
 
+        if not row:
+            return None
         db_data = {x: y for x, y in zip(row.keys(), row)}
 
         return db_data
 
+    @classmethod
+    def get_db_attrs_many(cls, db, ids):
+        """Search DB for entries by ids. Return list of dictionaries of values necessary for
+        constructor. Ids that are not found or are not valid integers are omitted.
+        """
+        rows = db.select_in(cls.sql_select_in, to_ids(ids))
+
+        return [{x: y for x, y in zip(row.keys(), row)} for row in rows]
+
+    @classmethod
+    def summary_query(cls):
+        """Return text of the query selecting the summary table of all the class entries (without
+        an ORDER BY clause). Each row of the main table is joined with correlated subqueries:
+        one aggregating each of 'summary_lists' into a JSON array and one summing the number of
+        references from non-deletable associations as 'dependents'. Every subquery is a lookup by
+        the association's foreign key, so the whole summary takes a single pass over the main table.
+        """
+        table_main = to_db_obj_name(cls.table_main)
+        columns = [f'{c.expression} AS "{to_db_obj_name(c.key)}"' for c in cls.summary_columns]
+
+        foreign_keys = {table: column for table, column, _ in cls.associations}
+        for summary_list in cls.summary_lists:
+            table = to_db_obj_name(summary_list.association)
+            column = to_db_obj_name(foreign_keys[summary_list.association])
+            columns.append(
+                f'(SELECT json_group_array({summary_list.value}) FROM "{table}" '
+                f'{summary_list.join or ""} '
+                f'WHERE "{table}"."{column}" = "{table_main}".id) '
+                f'AS "{to_db_obj_name(summary_list.key)}"'
+            )
+
+        counts = [f'(SELECT count(*) FROM "{to_db_obj_name(table)}" '
+                  f'WHERE "{to_db_obj_name(column)}" = "{table_main}".id)'
+                  for table, column, deletable in cls.associations if not deletable]
+        columns.append(f'{" + ".join(counts) or "0"} AS dependents')
+
+        return f'SELECT {", ".join(columns)} FROM "{table_main}"'
+
+    @classmethod
+    def iter_summary(cls, db, name_sort=False, name_filter=None, after=None, limit=None,
+                     descending=False):
+        """Yield rows of the summary table for the class entries as dictionaries, one at a time
+        as they are read from the DB. See get_summary().
+
+        Rows are paginated by key: a page starts right after the row whose sort key is given in
+        'after', so each page costs the same regardless of its position and of the table size.
+
+        :param name_filter: A string. Only entries with names containing it (case insensitive)
+            are included.
+        :param after: Sort key of the last row of the previous page as returned by summary_key().
+        :param limit: An integer. Max number of rows.
+        :param descending: A boolean. If True, rows are sorted in descending order.
+        """
+        where = []
+        params = []
+        if name_filter:
+            where.append("name LIKE ? ESCAPE '\\'")
+            params.append("%{}%".format(escape_like(name_filter)))
+        if after is not None:
+            operator = "<" if descending else ">"
+            if name_sort:
+                # The first condition is redundant but lets SQLite seek the name index
+                where.append(f"name COLLATE NOCASE {operator}= ? "
+                             f"AND (name COLLATE NOCASE, id) {operator} (?, ?)")
+                params.extend([after[0], after[0], after[1]])
+            else:
+                where.append(f"id {operator} ?")
+                params.append(after)
+
+        direction = " DESC" if descending else ""
+        if name_sort:
+            order = f"name COLLATE NOCASE{direction}, id{direction}"
+        else:
+            order = f"id{direction}"
+
+        query = cls.sql_summary
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += f" ORDER BY {order}"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        # Own cursor, so that the DBHandler's one may be used while rows are being consumed
+        cursor = db.conn.cursor()
+        cursor.execute(query, params)
+
+        for db_row in cursor:
+            row = {x: y for x, y in zip(db_row.keys(), db_row)}
+            for column in cls.summary_columns:
+                if column.convert:
+                    row[column.key] = column.convert(row[column.key])
+            for summary_list in cls.summary_lists:
+                items = json.loads(row[summary_list.key])
+                if name_sort:
+                    if summary_list.sort_by:
+                        items.sort(key=lambda x: x[summary_list.sort_by].lower())
+                    else:
+                        items.sort(key=str.lower)
+                row[summary_list.key] = items
+            yield row
+
+    @classmethod
+    def get_summary(cls, db, name_sort=False, **kwargs):
+        """Return summary table for the class entries in DB as dictionary list. Table contains
+        'summary_columns', 'summary_lists' and column:
+        dependents: number of other class entries referencing this id as a foreign key.
+
+        param name_sort: A boolean. If True, summary will be recursively sorted by
+            object name ascending.
+        Other keyword arguments filter and paginate the summary, see iter_summary().
+        """
+        return list(cls.iter_summary(db, name_sort, **kwargs))
+
+    @classmethod
+    def get_summary_page(cls, db, limit, name_sort=False, **kwargs):
+        """Return tuple of a list of at most 'limit' summary rows and the sort key to pass as
+        'after' to get the next page. The key is None if there are no more rows.
+        Arguments are those of iter_summary().
+        """
+        rows = list(cls.iter_summary(db, name_sort, limit=limit + 1, **kwargs))
+        if len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, cls.summary_key(rows[-1], name_sort)
+
+    @staticmethod
+    def summary_key(row, name_sort=False):
+        """Return sort key of a summary row used for pagination"""
+        return (row["name"], row["id"]) if name_sort else row["id"]
+
+    @classmethod
+    def embedded_classes(cls):
+        """Return set of classes whose objects are embedded into objects of this class directly or
+        through other embedded objects.
+        """
+        classes = set()
+        for embedded in cls.embeds:
+            classes.add(embedded)
+            classes |= embedded.embedded_classes()
+        return classes
+
     @property
     def name(self):
         """Get entry's name"""
@@ -121,85 +378,284 @@ class DBEntry(object):
         self._id = value
 
     def write_to_db(self):
-        if not self.id:
-            self.id = self.new_to_db()
-            result = bool(self.id)
-        else:
-            result = bool(self.edit_in_db())
+        """Write the entry to DB, inserting it if it has no id. Only changes since it was loaded
+        or last written are written. Commits unless within a DBHandler.transaction() block.
+        Return True on success.
+        """
+        if self.id and not self.has_changes():
+            return True
+        return bool(self.write_many(self.db, [self]))
 
-        self.db.conn.commit()
+    @classmethod
+    def write_many(cls, db, entries):
+        """Write entries of any DBEntry subclasses to DB in a single transaction, inserting those
+        without id. Return number of affected rows.
+
+        Inserted entries get ids following the largest one of their table, which is safe as the
+        transaction holds the write lock. Statements of all the entries are grouped by their
+        text and each group is run by a single executemany() call, so thousands of entries take
+        a few statements per table. Foreign keys are checked on commit, so entries may
+        reference entries inserted along with them. If the transaction is rolled back, inserted
+        entries lose their ids.
+        """
+        entries = [entry for entry in entries if not entry.id or entry.has_changes()]
+        # Embedded entries are written first, so that triggers see their associations
+        groups = {}
+        for entry in sorted(entries, key=lambda e: len(e.embedded_classes())):
+            groups.setdefault(entry.__class__, []).append(entry)
+
+        rows_affected = 0
+        with db.transaction():
+            try:
+                db.c.execute("PRAGMA defer_foreign_keys = ON;")
+                batches = {}
+                changes = {}
+                for entry_cls, group in groups.items():
+                    next_id = None
+                    changes[entry_cls] = []
+                    for entry in group:
+                        if entry.id:
+                            columns = entry.get_changed_columns()
+                            statements = entry.get_edit_statements(columns)
+                            db.on_rollback(entry.forget_snapshot)
+                        else:
+                            if next_id is None:
+                                next_id = entry_cls.get_next_id(db)
+                            entry.id = next_id
+                            next_id += 1
+                            columns = None
+                            statements = entry.get_insert_statements()
+                            db.on_rollback(functools.partial(entry.forget_snapshot, True))
+                        changes[entry_cls].append(columns)
+                        for query, params in statements:
+                            batches.setdefault(query, []).append(params)
+
+                for query, params in batches.items():
+                    db.c.executemany(query, params)
+                    rows_affected += db.c.rowcount
+                for entry_cls, group in groups.items():
+                    entry_cls.after_write(db, group, changes[entry_cls])
+            finally:
+                for entry in entries:
+                    db.notify_change(entry, "write")
+
+        for entry in entries:
+            entry.mark_clean()
+        return rows_affected
 
-        return result
+    @classmethod
+    def get_next_id(cls, db):
+        """Return the id following the largest one of the class main table"""
+        query = f'SELECT coalesce(max(id), 0) + 1 FROM "{to_db_obj_name(cls.table_main)}"'
+        return db.c.execute(query).fetchone()[0]
 
-    def new_to_db(self):
-        """Write a new entry to the DB. Return id assigned by the DB"""
-        table_main = to_db_obj_name(self.table_main)
-        allergy = (self.name,)
+    @classmethod
+    def after_write(cls, db, entries, changes):
+        """Hook called by write_many() within its transaction after the entries of the class
+        were written. Does nothing by default.
 
-        self.db.c.execute(f'INSERT INTO "{table_main}" (name) VALUES (?)', allergy)
+        :param entries: A list of the written entries.
+        :param changes: A list of dictionaries of the changed main table columns (see
+            get_changed_columns()), one per entry. None for inserted entries.
+        """
 
-        new_row_id = (self.db.c.lastrowid,)
-        self.db.c.execute(f'SELECT id FROM "{table_main}" WHERE rowid = ?', new_row_id)
-        row = self.db.c.fetchone()
+    def get_insert_statements(self):
+        """Return list of (query, params) tuples inserting the entry with its pre-assigned id and
+        its tracked collections
+        """
+        table_main = to_db_obj_name(self.table_main)
+        columns = self.db_columns()
+        names = ", ".join(f'"{to_db_obj_name(c)}"' for c in ["id", *columns])
+        statements = [(f'INSERT INTO "{table_main}" ({names}) '
+                       f'VALUES ({", ".join("?" * (len(columns) + 1))})',
+                       (self.id, *columns.values()))]
+
+        for collection in self.tracked_collections:
+            state = self._collection_snapshot(collection)
+            if isinstance(state, LazySet):
+                state = rows_state(state.rows(), collection)
+            query = collection_queries(collection)[1]
+            statements += [(query, (self.id, k, *v)) for k, v in state.items()]
+
+        return statements
+
+    def get_edit_statements(self, columns):
+        """Return list of (query, params) tuples making the existing DB entry match current
+        object state. Only the given main table columns and the rows of tracked collections that
+        changed since the entry was loaded or last written are written. The collections of
+        entries constructed otherwise are compared with their rows in DB.
+
+        :param columns: A dictionary of main table column values returned by
+            get_changed_columns().
+        """
+        statements = []
+        if columns:
+            assignments = ", ".join(f'"{to_db_obj_name(c)}" = ?' for c in columns)
+            statements.append((f'UPDATE "{to_db_obj_name(self.table_main)}" '
+                               f'SET {assignments} WHERE id = ?',
+                               (*columns.values(), self.id)))
+
+        for collection in self.tracked_collections:
+            states = self.get_collection_states(collection)
+            if not states:
+                continue
+            old, new = states
+            delete, insert, update = collection_queries(collection)
+            # Removing items missing in the new state
+            statements += [(delete, (self.id, k)) for k in old.keys() - new.keys()]
+            # Adding items missing in the old state
+            statements += [(insert, (self.id, k, *new[k])) for k in new.keys() - old.keys()]
+            # Updating items present in both states whose values changed
+            statements += [(update, (*new[k], self.id, k))
+                           for k in new.keys() & old.keys() if new[k] != old[k]]
+
+        return statements
+
+    def db_columns(self):
+        """Return dictionary of values of the entry's main table columns keyed by column name"""
+        return {"name": self.name}
+
+    def mark_clean(self):
+        """Remember current state of the entry as the one stored in DB"""
+        self.__snapshot = (
+            self.db_columns(),
+            {c.attribute: self._collection_snapshot(c) for c in self.tracked_collections}
+        )
+
+    def forget_snapshot(self, inserted=False):
+        """Forget state of the entry stored in DB, e.g. after writing it was rolled back.
+
+        :param inserted: A boolean. If True, the entry was being inserted and loses its id.
+        """
+        self.__snapshot = None
+        if inserted:
+            self.id = None
 
-        return row["id"]
+    def get_changed_columns(self):
+        """Return dictionary of values of the main table columns changed since the entry was
+        loaded or last written. All columns if the state stored in DB is unknown.
+        """
+        columns = self.db_columns()
+        snapshot = getattr(self, "_DBEntry__snapshot", None)
+        if snapshot is None:
+            return columns
+        return {c: v for c, v in columns.items() if snapshot[0].get(c) != v}
+
+    def get_collection_states(self, collection):
+        """Return tuple of the old (as stored in DB) and the new state of the tracked collection
+        as dictionaries of tuples of item values keyed by item keys, or None if the collection
+        is known to be unchanged.
+        """
+        current = getattr(self, collection.attribute)
+        snapshot = getattr(self, "_DBEntry__snapshot", None)
+        if snapshot is None:
+            # The state stored in DB is unknown
+            columns = ", ".join(f'"{to_db_obj_name(c)}"'
+                                for c in (collection.key, *collection.values))
+            query = (f'SELECT {columns} FROM "{to_db_obj_name(collection.table)}" '
+                     f'WHERE "{to_db_obj_name(collection.column)}" = ?')
+            old = rows_state(self.db.c.execute(query, (self.id,)).fetchall(), collection)
+        else:
+            old = snapshot[1][collection.attribute]
+            if isinstance(old, LazySet):
+                if current is old and not current.modified:
+                    return None
+                old = rows_state(old.rows(), collection)
+
+        new = self._collection_snapshot(collection, current)
+        if isinstance(new, LazySet):
+            new = rows_state(new.rows(), collection)
+        return (old, new) if old != new else None
+
+    def has_changes(self):
+        """Return True if the entry changed since it was loaded or last written, or the state
+        stored in DB is unknown.
+        """
+        if getattr(self, "_DBEntry__snapshot", None) is None:
+            return True
+        return bool(self.get_changed_columns()) or any(
+            self.get_collection_states(c) for c in self.tracked_collections)
 
-    def edit_in_db(self):
-        """Edit existing DB entry to match current object state. Return number of affected rows."""
-        table_main = to_db_obj_name(self.table_main)
-        allergy = (self.name, self.id)
-        self.db.c.execute(f'UPDATE "{table_main}" SET name = ? WHERE id = ?', allergy)
-        return self.db.c.rowcount
+    def _collection_snapshot(self, collection, items=None):
+        # Unmodified lazy collections stand for the rows they are (or will be) loaded from
+        items = getattr(self, collection.attribute) if items is None else items
+        if isinstance(items, LazySet) and not items.modified:
+            return items
+        to_row = collection.to_row or (lambda entry: (entry.id,))
+        return {row[0]: tuple(row[1:]) for row in map(to_row, items)}
 
     def remove_from_db(self):
         """Remove entry from DB. Attempting to delete object referenced by an object lower in the
-        hierarchy will lead to an error.
-        """
-        needle = (self.id,)
-        for assoc in self.associations:
-            table = to_db_obj_name(assoc[0])
-            column = to_db_obj_name(assoc[1])
-            deletable = assoc[2]
-            if deletable:
-                query = f'DELETE FROM "{table}" WHERE "{column}" = ?'
+        hierarchy will lead to an error. Commits unless within a DBHandler.transaction() block.
+        """
+        with self.db.transaction():
+            needle = (self.id,)
+            for assoc in self.associations:
+                table = to_db_obj_name(assoc[0])
+                column = to_db_obj_name(assoc[1])
+                deletable = assoc[2]
+                if deletable:
+                    query = f'DELETE FROM "{table}" WHERE "{column}" = ?'
+                    self.db.c.execute(query, needle)
+                else:
+                    query = f'SELECT COUNT(*) as count FROM "{table}" WHERE "{column}" = ?'
+                    references = self.db.c.execute(query, needle).fetchone()["count"]
+                    if references:
+                        msg = (
+                            "Could not delete object. There are still {0} non-deletable "
+                            "references in the {1} table"
+                            ).format(references, table)
+                        raise backend.DBHandler.DBError(msg)
+
+            table_main = to_db_obj_name(self.table_main)
+            query = f'DELETE FROM "{table_main}" WHERE id = ?'
+            try:
                 self.db.c.execute(query, needle)
-            else:
-                query = f'SELECT COUNT(*) as count FROM "{table}" WHERE "{column}" = ?'
-                references = self.db.c.execute(query, needle).fetchone()["count"]
-                if references:
-                    msg = (
-                        "Could not delete object. There are still {0} non-deletable references "
-                        "in the {1} table"
-                        ).format(references, table)
-                    raise backend.DBHandler.DBError(msg)
+            except sqlite3.Error as err:
+                if "FOREIGN KEY constraint failed" in str(err):
+                    raise RuntimeError("Could not delete, one or more dependencies still exist")
+                else:
+                    raise err
 
-        table_main = to_db_obj_name(self.table_main)
-        needle = (self.id,)
-        query = f'DELETE FROM "{table_main}" WHERE id = ?'
-        try:
-            self.db.c.execute(query, needle)
-        except sqlite3.Error as err:
-            if "FOREIGN KEY constraint failed" in str(err):
-                raise RuntimeError("Could not delete, one or more dependencies still exist")
-            else:
-                raise err
-
-        self.db.conn.commit()
+            self.db.notify_change(self, "remove")
 
     def toJSONifiable(self):
-        """Return a JSONifiable dictionary of the object's attributes. Omits name mangled (__attr)
-        attributes and trims underscore from private (_attr) attribute names.
-        """
-        return {x.lstrip("_"): y
-                for x, y in vars(self).items()
-                if not is_mangled(x, self.__class__)
-        }
+        """Return a JSONifiable dictionary of the object's json_fields"""
+        return self.json_serializer(self)
 
 
 class FoodEncoder(json.JSONEncoder):
     """JSON encoder that encodes sets as list and tries to call toJSONifiable() method for other
     classes.
+
+    If orjson is installed, it does the encoding unless the encoder is set to sort keys or to
+    indent by other than 2 spaces. Its output is compact and has non-ASCII characters unescaped,
+    but is otherwise the same.
     """
+    def __init__(self, use_orjson=True, **kwargs):
+        """Constructor. Returns functional object.
+
+        :param use_orjson: A boolean. Whether to use orjson when possible.
+        :param kwargs: Passed to json.JSONEncoder.
+        """
+        super().__init__(**kwargs)
+        self.orjson_option = None
+        if orjson and use_orjson and not self.sort_keys and self.indent in (None, 2):
+            self.orjson_option = orjson.OPT_NON_STR_KEYS
+            if self.indent:
+                self.orjson_option |= orjson.OPT_INDENT_2
+
+    def encode(self, obj):
+        if self.orjson_option is not None:
+            return self.encode_bytes(obj).decode()
+        return super().encode(obj)
+
+    def encode_bytes(self, obj):
+        """Return JSON representation of the object as UTF-8 encoded bytes"""
+        if self.orjson_option is not None:
+            return orjson.dumps(obj, default=self.default, option=self.orjson_option)
+        return super().encode(obj).encode()
+
     def default(self, obj): # pylint: disable=E0202
         if isinstance(obj, (set)):
             return list(obj)
@@ -225,12 +681,54 @@ def validate_name(name):
         return False
     return True
 
-def is_mangled(attr_name, classinfo):
-    classes = inspect.getmro(classinfo)
-    for c in classes:
-        if attr_name.startswith("_" + c.__name__ + "__"):
-            return True
-    return False
+def to_ids(values):
+    """Return set of integer ids from an iterable of ids given as integers or strings. Values
+    that cannot be converted are skipped.
+    """
+    ids = set()
+    for value in values:
+        try:
+            ids.add(int(value))
+        except (TypeError, ValueError):
+            pass
+    return ids
+
+def escape_like(s):
+    """Return string with LIKE pattern wildcards escaped by backslash"""
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def json_serializer(fields):
+    """Return function making a JSONifiable dictionary of the given attributes of an object"""
+    getter = operator.attrgetter(*fields)
+    if len(fields) == 1:
+        return lambda obj: {fields[0]: getter(obj)}
+    return lambda obj: dict(zip(fields, getter(obj)))
+
+def rows_state(rows, collection):
+    """Return state of the TrackedCollection as stored in DB (see
+    DBEntry.get_collection_states()) from rows of its association table
+    """
+    return {row[collection.key]: tuple(row[v] for v in collection.values) for row in rows}
+
+@functools.lru_cache(maxsize=None)
+def collection_queries(collection):
+    """Return tuple of texts of the queries deleting, inserting and updating a row of the
+    TrackedCollection's association table. Parameters are the entry id and the item key (and
+    values), except for the update, whose parameters are the values followed by those two.
+    """
+    table = to_db_obj_name(collection.table)
+    column = to_db_obj_name(collection.column)
+    key = to_db_obj_name(collection.key)
+    values = [to_db_obj_name(v) for v in collection.values]
+
+    names = ", ".join(f'"{c}"' for c in [column, key, *values])
+    delete = f'DELETE FROM "{table}" WHERE "{column}" = ? AND "{key}" = ?'
+    insert = f'INSERT INTO "{table}" ({names}) VALUES ({", ".join("?" * (len(values) + 2))})'
+    update = None
+    if values:
+        assignments = ", ".join(f'"{v}" = ?' for v in values)
+        update = f'UPDATE "{table}" SET {assignments} WHERE "{column}" = ? AND "{key}" = ?'
+    return delete, insert, update
 
 def to_db_obj_name(s):
     """Aliases eponymous function in DBHandler"""
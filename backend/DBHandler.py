@@ -1,19 +1,321 @@
+import functools
+import queue
+import re
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from backend import migrations
+from backend.AllergenIndex import AllergenIndex
+from backend.IngredientIndex import IngredientIndex
+from backend.PantryIndex import PantryIndex
+from backend.EntityCache import EntityCache
 
 DEFAULT_DB_PATH = "backend/food.db"
+DEFAULT_POOL_SIZE = 5
+DEFAULT_POOL_TIMEOUT = 10.0
+
+# PRAGMAs applied to every new connection in that order. WAL lets readers proceed while a write
+# is in progress, busy_timeout makes writers wait for the lock instead of failing right away.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous" : "NORMAL",
+    "cache_size"  : -16000, # negative values are KiB, i.e. ~16MB
+    "mmap_size"   : 64 * 1024 * 1024,
+    "temp_store"  : "MEMORY",
+    "busy_timeout": 5000, # ms
+    "foreign_keys": "ON",
+}
+# Max number of values bound to a single "IN (...)" list, safely below SQLITE_MAX_VARIABLE_NUMBER
+# of older SQLite builds (999)
+MAX_IN_PARAMS = 500
+# Number of prepared statements cached by each connection
+CACHED_STATEMENTS = 256
+DEFAULT_BUSY_RETRIES = 5
+DEFAULT_BUSY_BACKOFF = 0.05 # seconds, doubled after each retry
+
+SQLITE_BUSY = 5
+SQLITE_LOCKED = 6
+SQLITE_BUSY_SNAPSHOT = 517 # extended code: a read transaction can't be upgraded to a write one
+_PRAGMA_NAME_RE = re.compile(r"^[a-z_]+$")
+_PRAGMA_VALUE_RE = re.compile(r"^-?[A-Za-z0-9_]+$")
 
 class DBHandler(object):
-    """Handles storage and retrieval of within a DB"""
-    def __init__(self, db_path=DEFAULT_DB_PATH):
-        """ :param db_path: A string, path to the target DB"""
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
-        self.c = self.conn.cursor()
-        self.c.execute("PRAGMA foreign_keys = ON;")
-        self.conn.commit()
+    """Handles storage and retrieval of within a DB.
+
+    Connections are kept in a pool and handed out per thread: the first use of 'conn' or 'c' in
+    a thread checks a connection out of the pool and the thread keeps it (along with its own
+    cursor) until release() is called. Each thread thus works with its own cursor and the number
+    of open connections never exceeds the pool size.
+    """
+    def __init__(self, db_path=DEFAULT_DB_PATH, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_POOL_TIMEOUT, pragmas=None, busy_retries=DEFAULT_BUSY_RETRIES,
+                 busy_backoff=DEFAULT_BUSY_BACKOFF, cache_size=0, cache_ttl=None,
+                 use_allergen_index=True):
+        """ :param db_path: A string, path to the target DB
+        :param pool_size: An integer. Maximum number of connections opened simultaneously.
+        :param timeout: A number. Seconds to wait for a free connection when all of them are
+            checked out before a DBError is raised. None means wait indefinitely.
+        :param pragmas: A dictionary of PRAGMA names and values overriding DEFAULT_PRAGMAS.
+            A None value leaves the corresponding PRAGMA at SQLite's default.
+        :param busy_retries: An integer. How many times a statement run outside of a transaction
+            or a commit failing with SQLITE_BUSY/SQLITE_LOCKED (after waiting for busy_timeout)
+            is retried. Statements within a transaction are not, as the whole transaction would
+            have to be restarted.
+        :param busy_backoff: A number. Seconds to sleep before the first retry, doubled for
+            every consecutive one.
+        :param cache_size: An integer. Max number of objects kept in the process-wide entity
+            cache shared by all threads. 0 disables it (per scope identity maps still work).
+        :param cache_ttl: A number. Seconds an object stays in the process-wide entity cache.
+            None means until evicted or invalidated.
+        :param use_allergen_index: A boolean. Whether suitable recipes are looked up in the
+            in-memory AllergenIndex rather than queried from the DB every time. The index is only
+            aware of changes made through this handler, so deployments running several processes
+            against one DB should disable it.
+        """
+        self._pool = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if pool_size < 1:
+            raise ValueError("pool_size must be a positive integer")
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+
+        self.cache = EntityCache(cache_size, cache_ttl)
+        self.listeners = [self.cache.on_change]
+        self.use_allergen_index = use_allergen_index
+        self._allergen_index = None
+        self._ingredient_index = None
+        self._pantry_index = None
+
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        for name, value in list(self.pragmas.items()):
+            if value is None:
+                del self.pragmas[name]
+            elif not (_PRAGMA_NAME_RE.match(name) and _PRAGMA_VALUE_RE.match(str(value))):
+                raise ValueError("Invalid PRAGMA: {} = {}".format(name, value))
 
     def __del__(self):
-        self.conn.close()
+        self.close()
+
+    @property
+    def conn(self):
+        """Get connection checked out by the current thread. Checks out one if there is none."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.checkout()
+            self._local.conn = conn
+            self._local.c = conn.cursor()
+        return conn
+
+    @property
+    def c(self):
+        """Get cursor of the connection checked out by the current thread"""
+        self.conn
+        return self._local.c
+
+    @property
+    def allergen_index(self):
+        """Get AllergenIndex of the DB. It is created and subscribed to changes on first access"""
+        if self._allergen_index is None:
+            with self._lock:
+                if self._allergen_index is None:
+                    index = AllergenIndex(self)
+                    self.add_listener(index.on_change)
+                    self._allergen_index = index
+        return self._allergen_index
+
+    @property
+    def ingredient_index(self):
+        """Get IngredientIndex of the DB. It is created and subscribed to changes on first access"""
+        if self._ingredient_index is None:
+            with self._lock:
+                if self._ingredient_index is None:
+                    index = IngredientIndex(self)
+                    self.add_listener(index.on_change)
+                    self._ingredient_index = index
+        return self._ingredient_index
+
+    @property
+    def pantry_index(self):
+        """Get PantryIndex of the DB. It is created and subscribed to changes on first access"""
+        if self._pantry_index is None:
+            with self._lock:
+                if self._pantry_index is None:
+                    index = PantryIndex(self)
+                    self.add_listener(index.on_change)
+                    self._pantry_index = index
+        return self._pantry_index
+
+    def connect(self):
+        """Open and return a new configured connection to the DB"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=RetryingConnection,
+                               cached_statements=CACHED_STATEMENTS)
+        conn.busy_retries = self.busy_retries
+        conn.busy_backoff = self.busy_backoff
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};").fetchall()
+        conn.commit()
+        return conn
+
+    def get_pragmas(self):
+        """Return dictionary of the configured PRAGMAs' values as reported by the current
+        thread's connection.
+        """
+        return {name: self.conn.execute(f"PRAGMA {name};").fetchone()[0]
+                for name in self.pragmas}
+
+    def checkout(self):
+        """Take a connection from the pool, opening a new one if the pool is not full yet.
+        Raises DBError if no connection becomes available within the timeout.
+        """
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._connections) < self.pool_size:
+                conn = self.connect()
+                self._connections.append(conn)
+                return conn
+
+        try:
+            return self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise DBError("Timed out waiting for a free DB connection",
+                          params={"pool_size": self.pool_size, "timeout": self.timeout})
+
+    def release(self):
+        """Return connection checked out by the current thread to the pool. Uncommitted changes
+        are rolled back. Does nothing if the thread holds no connection.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.c.close()
+        self._local.conn = None
+        self._local.c = None
+
+        if conn.in_transaction:
+            conn.rollback()
+        self._pool.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Context manager providing the current thread's connection. The connection is
+        released on exit unless the thread already held it before entering.
+        """
+        held = getattr(self._local, "conn", None) is not None
+        try:
+            yield self.conn
+        finally:
+            if not held:
+                self.release()
+
+    @contextmanager
+    def transaction(self):
+        """Context manager running the enclosed statements as a single unit of work on the
+        current thread's connection.
+
+        The outermost block begins with BEGIN IMMEDIATE (committing a pending implicit
+        transaction first), so it holds the write lock throughout, and commits on exit. Nested
+        blocks are savepoints: an exception rolls back only the statements of the blocks it
+        leaves. Until the outermost block exits, commit() does nothing and change notifications
+        are queued; they are delivered on exit whether the transaction committed or not.
+        """
+        with self.connection() as conn:
+            levels = getattr(self._local, "transaction", None)
+            if levels:
+                # Nested block
+                name = "sp{:d}".format(len(levels))
+                self.c.execute(f"SAVEPOINT {name};")
+                levels.append([])
+                try:
+                    yield self
+                except BaseException:
+                    self.c.execute(f"ROLLBACK TO {name};")
+                    self.c.execute(f"RELEASE {name};")
+                    run_callbacks(levels.pop())
+                    raise
+                self.c.execute(f"RELEASE {name};")
+                callbacks = levels.pop()
+                levels[-1].extend(callbacks)
+                return
+
+            if conn.in_transaction:
+                conn.commit()
+            self.c.execute("BEGIN IMMEDIATE;")
+            levels = self._local.transaction = [[]]
+            notifications = self._local.notifications = []
+            try:
+                yield self
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                run_callbacks(levels.pop())
+                raise
+            finally:
+                self._local.transaction = None
+                self._local.notifications = None
+                delivered = set()
+                for obj, action in notifications:
+                    if (id(obj), action) not in delivered:
+                        delivered.add((id(obj), action))
+                        self.notify_change(obj, action)
+
+    def in_transaction(self):
+        """Return True if the current thread is within a transaction() block"""
+        return bool(getattr(self._local, "transaction", None))
+
+    def on_rollback(self, callback):
+        """Register a callable to be called with no arguments if the statements executed so far
+        in the current transaction() block are rolled back. Does nothing outside of transactions.
+        """
+        levels = getattr(self._local, "transaction", None)
+        if levels:
+            levels[-1].append(callback)
+
+    def commit(self):
+        """Commit the current thread's transaction unless it is a transaction() block, which
+        commits when the outermost block exits.
+        """
+        if not self.in_transaction():
+            self.conn.commit()
+
+    def add_listener(self, callback):
+        """Register a callable to be called as callback(obj, action) whenever a DBEntry is
+        written to or removed from the DB. 'action' is either "write" or "remove".
+        """
+        self.listeners.append(callback)
+
+    def notify_change(self, obj, action):
+        """Notify registered listeners of a change of a DBEntry in the DB. Within a transaction()
+        block, listeners are notified once the outermost block exits.
+        """
+        notifications = getattr(self._local, "notifications", None)
+        if notifications is not None:
+            notifications.append((obj, action))
+            return
+        for callback in self.listeners:
+            callback(obj, action)
+
+    def close(self):
+        """Close all connections opened by the handler"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
 
     def create_schema(self):
         """Create the required schema in an empty DB"""
@@ -84,6 +386,46 @@ class DBHandler(object):
             """)
 
         self.conn.commit()
+        self.migrate()
+
+    def get_schema_version(self):
+        """Return version of the DB schema, i.e. number of the last migration applied"""
+        return self.c.execute("PRAGMA user_version;").fetchone()[0]
+
+    def migrate(self, target=None):
+        """Apply pending migrations in order up to the target version. Each migration runs in its
+        own transaction together with the version bump, so a failed one leaves the DB at the
+        previous version. Return the resulting schema version.
+
+        :param target: An integer. Version to migrate to. Defaults to the latest one.
+        """
+        if target is None:
+            target = migrations.latest_version()
+        version = self.get_schema_version()
+
+        for migration in migrations.MIGRATIONS:
+            if not version < migration.version <= target:
+                continue
+
+            self.conn.commit()
+            self.c.execute("BEGIN IMMEDIATE;")
+            try:
+                for statement in migration.statements:
+                    if callable(statement):
+                        statement(self.c)
+                    else:
+                        self.c.execute(statement)
+                # PRAGMA does not accept parameters, the version is an internal integer
+                self.c.execute("PRAGMA user_version = {:d};".format(migration.version))
+                self.conn.commit()
+            except sqlite3.Error as err:
+                self.conn.rollback()
+                msg = "Migration {} ({}) failed: {}".format(
+                    migration.version, migration.description, err)
+                raise DBError(msg, params={"version": version})
+            version = migration.version
+
+        return version
 
     # # DB object interpolation taken from Martijn Pieters's answer here:
     # # https://stackoverflow.com/a/25387570
@@ -94,19 +436,11 @@ class DBHandler(object):
         :param search_params: kwargs where keys are column names. Values must be exact match,
             joined with AND in the SQL query.
         """
+        query = exists_query(table_name, tuple(search_params.keys()))
+        needle = tuple(search_params.values())
 
-        objects = [to_db_obj_name(table_name)]
-        needle = tuple()
-        for key, value in search_params.items():
-            objects.append(to_db_obj_name(key))
-            needle += (value,)
-
-        query = 'SELECT count(*) FROM "{}" WHERE "{}" = ?'
-        query = query + ' AND "{}" = ?'*(len(needle) - 1)
-
-        self.c.execute(query.format(*objects), needle)
-        rows = self.c.fetchone()
-        if not rows[0]:
+        row = self.c.execute(query, needle).fetchone()
+        if not row:
             return False
 
         return True
@@ -142,6 +476,50 @@ class DBHandler(object):
 
         return rows
 
+    def select_in(self, query, values, params=()):
+        """Return all rows of a query with an "IN ({})" clause for each chunk of the values list.
+        The query is run once per MAX_IN_PARAMS values and the rows are concatenated.
+
+        :param query: A string. SQL query containing a single "{}" placeholder inside an IN clause
+            which is replaced by the bound parameters' placeholders.
+        :param values: An iterable of values to be matched by the IN clause.
+        :param params: A tuple. Additional parameters bound after the IN list values.
+        """
+        values = list(values)
+        rows = []
+        for i in range(0, len(values), MAX_IN_PARAMS):
+            chunk = values[i:i + MAX_IN_PARAMS]
+            chunk_query = query.format(", ".join("?" * len(chunk)))
+            rows += self.c.execute(chunk_query, tuple(chunk) + tuple(params)).fetchall()
+
+        return rows
+
+
+class RetryingCursor(sqlite3.Cursor):
+    """Cursor that retries statements failing because the DB is busy or locked"""
+    def execute(self, *args):
+        return retry_on_busy(self.connection, super().execute, *args)
+
+    def executemany(self, *args):
+        return retry_on_busy(self.connection, super().executemany, *args)
+
+    def executescript(self, *args):
+        return retry_on_busy(self.connection, super().executescript, *args)
+
+
+class RetryingConnection(sqlite3.Connection):
+    """Connection that uses RetryingCursor and retries commits failing because the DB is busy
+    or locked. Retry settings are read from 'busy_retries' and 'busy_backoff' attributes.
+    """
+    busy_retries = DEFAULT_BUSY_RETRIES
+    busy_backoff = DEFAULT_BUSY_BACKOFF
+
+    def cursor(self, factory=RetryingCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        return retry_on_busy(self, super().commit, in_transaction=True)
+
 
 class DBError(Exception):
     def __init__(self, message, params=None):
@@ -149,6 +527,48 @@ class DBError(Exception):
         self.params = params
 
 
+@functools.lru_cache(maxsize=None)
+def exists_query(table_name, columns):
+    """Return text of a query selecting a row from a table where all columns match parameters.
+    Texts are cached per table and set of columns.
+    """
+    query = 'SELECT 1 FROM "{}" WHERE '.format(to_db_obj_name(table_name))
+    query += " AND ".join('"{}" = ?'.format(to_db_obj_name(c)) for c in columns)
+    return query + " LIMIT 1"
+
+def run_callbacks(callbacks):
+    """Call rollback callbacks in the reverse order of registration"""
+    for callback in reversed(callbacks):
+        callback()
+
+def retry_on_busy(conn, func, *args, in_transaction=False):
+    """Call func with args, retrying with exponential backoff while it fails with SQLITE_BUSY or
+    SQLITE_LOCKED. Retry settings are taken from the conn attributes.
+
+    A statement run within an open transaction is not retried: the transaction may hold a read
+    snapshot that can never be upgraded to a write (SQLITE_BUSY_SNAPSHOT), so the caller must
+    restart it as a whole. Neither is SQLITE_BUSY_SNAPSHOT retried anywhere else.
+
+    :param in_transaction: A boolean. Whether func may be retried within a transaction, e.g.
+        COMMIT itself.
+    """
+    retries = conn.busy_retries if in_transaction or not conn.in_transaction else 0
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as err:
+            if (attempt == retries or not is_busy_error(err)
+                    or getattr(err, "sqlite_errorcode", None) == SQLITE_BUSY_SNAPSHOT):
+                raise
+            time.sleep(conn.busy_backoff * 2 ** attempt)
+
+def is_busy_error(err):
+    """Return True if sqlite3 error was caused by the DB being busy or locked"""
+    code = getattr(err, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xff in (SQLITE_BUSY, SQLITE_LOCKED)
+    return "locked" in str(err) or "busy" in str(err)
+
 # DB object interpolation taken from Martijn Pieters's answer here:
 # https://stackoverflow.com/a/25387570
 def to_db_obj_name(s):
@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class LRUCache(object):
+    """Thread-safe mapping that holds at most 'size' items, evicting the least recently used ones.
+    Items older than 'ttl' seconds are treated as missing.
+    """
+    def __init__(self, size, ttl=None):
+        """Constructor. Returns functional object.
+
+        :param size: An integer. Max number of items held. 0 disables the cache.
+        :param ttl: A number. Seconds an item stays valid after being set. None means forever.
+        """
+        self.size = size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Return item stored under the key or default if it is missing or expired"""
+        with self._lock:
+            try:
+                value, expires = self._items[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store item under the key, evicting the least recently used items if full"""
+        if not self.size:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._items[key] = (value, expires)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                evicted_key, (evicted, _) = self._items.popitem(last=False)
+                self.on_evict(evicted_key, evicted)
+
+    def discard(self, key):
+        """Remove item stored under the key if any"""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def discard_where(self, predicate):
+        """Remove all items whose key satisfies the predicate"""
+        with self._lock:
+            for key in [k for k in self._items if predicate(k)]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def on_evict(self, key, value):
+        """Called for each item evicted to free space. Does nothing by default"""
+        pass
+
+
+class EntityCache(object):
+    """Cache of DBEntry objects keyed by (class, id) consulted when loading objects from DB.
+
+    Consists of two levels:
+    identity map - holds every object loaded by the current thread within a scope (e.g. an HTTP
+        request) so that each DB row is materialized at most once per scope and shared.
+        Outside of a scope the identity map is inactive.
+    shared LRU - optional process-wide LRUCache of objects of classes with 'cacheable' set to True.
+
+    Objects of a changed entry and of all the classes embedding its class are invalidated on
+    both levels via on_change().
+    """
+    def __init__(self, size=0, ttl=None):
+        """Constructor. Returns functional object.
+
+        :param size: An integer. Max number of objects in the shared LRU. 0 disables it.
+        :param ttl: A number. Seconds an object stays in the shared LRU. None means forever.
+        """
+        self.shared = LRUCache(size, ttl)
+        self._local = threading.local()
+
+    @property
+    def identity_map(self):
+        """Get identity map dictionary of the current thread's scope or None outside of one"""
+        return getattr(self._local, "identity_map", None)
+
+    def begin_scope(self):
+        """Start a new identity map scope for the current thread"""
+        self._local.identity_map = {}
+
+    def end_scope(self):
+        """Discard identity map of the current thread"""
+        self._local.identity_map = None
+
+    @contextmanager
+    def scope(self):
+        """Context manager running the enclosed block within an identity map scope. Nested
+        scopes share the outermost one.
+        """
+        if self.identity_map is not None:
+            yield
+            return
+        self.begin_scope()
+        try:
+            yield
+        finally:
+            self.end_scope()
+
+    def get(self, cls, id):
+        """Return cached object of the class with the id or None"""
+        key = (cls, id)
+        identity_map = self.identity_map
+        if identity_map is not None:
+            obj = identity_map.get(key)
+            if obj is not None:
+                return obj
+
+        if not cls.cacheable:
+            return None
+        obj = self.shared.get(key)
+        if obj is not None and identity_map is not None:
+            identity_map[key] = obj
+        return obj
+
+    def get_many(self, cls, ids):
+        """Return tuple of a dictionary of cached objects keyed by id and a set of missing ids"""
+        found = {}
+        missing = set()
+        for id in ids:
+            obj = self.get(cls, id)
+            if obj is None:
+                missing.add(id)
+            else:
+                found[id] = obj
+        return found, missing
+
+    def add(self, obj):
+        """Put object to the cache"""
+        key = (obj.__class__, obj.id)
+        identity_map = self.identity_map
+        if identity_map is not None:
+            identity_map[key] = obj
+        if obj.cacheable:
+            self.shared.set(key, obj)
+
+    def on_change(self, obj, action):
+        """Invalidate cached objects affected by object being written to or removed from DB"""
+        changed = obj.__class__
+        def affected(key):
+            cls, id = key
+            return (cls is changed and id == obj.id) or changed in cls.embedded_classes()
+
+        identity_map = self.identity_map
+        if identity_map:
+            for key in [k for k in identity_map if affected(k)]:
+                del identity_map[key]
+        self.shared.discard_where(affected)
+
+    def clear(self):
+        if self.identity_map is not None:
+            self.identity_map.clear()
+        self.shared.clear()
@@ -0,0 +1,119 @@
+import re
+import threading
+from bisect import bisect_left
+
+# Ingredient names are split to tokens at every character that is not a letter or a digit
+TOKEN_SEPARATOR = re.compile(r"[\W_]+")
+
+
+class IngredientIndex(object):
+    """In-memory prefix index of ingredient names used to complete names typed by users.
+
+    Holds two sorted arrays: lowercased names of all ingredients and all the tokens (words) of
+    those names. Names starting with a query are found with a binary search in the former, names
+    with tokens starting with each of the query's tokens (e.g. "pep bla" matches
+    "Black pepper (ground)") are found in the latter.
+
+    The index is built on first use and rebuilt on the first use after an ingredient has been
+    written to or removed from the DB through the handler, see on_change().
+    """
+    def __init__(self, db):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler. Used to load ingredients.
+        """
+        self.db = db
+        self.version = 0 # incremented on every change of ingredients
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._built_version = None
+        self._names = [] # sorted (lowercased name, id) tuples
+        self._tokens = [] # sorted (token, id) tuples
+        self._by_id = {} # id -> name
+
+    def refresh(self):
+        """(Re)build the whole index from DB"""
+        with self._refresh_lock:
+            version = self.version
+            rows = self.db.c.execute('SELECT id, name FROM ingredients').fetchall()
+            self._build(rows, version)
+
+    def _build(self, rows, version):
+        """Build the index arrays from (id, name) rows and swap them in"""
+        names = []
+        tokens = []
+        by_id = {}
+        for id, name in rows:
+            by_id[id] = name
+            names.append((name.lower(), id))
+            tokens.extend((token, id) for token in set(tokenize(name)))
+        names.sort()
+        tokens.sort()
+
+        # Readers always see a consistent set of arrays
+        with self._lock:
+            self._names, self._tokens, self._by_id = names, tokens, by_id
+            self._built_version = version
+
+    def complete(self, query, limit=10):
+        """Return list of up to 'limit' ingredients matching the query as {"id", "name"}
+        dictionaries. Case insensitive. Names starting with the query come first, then names
+        with a token starting with each of the query tokens, both sorted by name.
+
+        :param query: A string. Beginning of an ingredient name or of some of its words.
+        :param limit: An integer. Max number of ingredients returned.
+        """
+        if self._built_version != self.version:
+            self.refresh()
+        with self._lock:
+            names, tokens, by_id = self._names, self._tokens, self._by_id
+
+        prefix = query.strip().lower()
+        query_tokens = tokenize(query)
+        if not prefix or limit < 1:
+            return []
+
+        # Names starting with the query
+        ids = []
+        for name, id in islice_prefix(names, prefix):
+            ids.append(id)
+            if len(ids) == limit:
+                return [{"id": id, "name": by_id[id]} for id in ids]
+
+        # Names with tokens matching all of the query tokens. Candidates are taken from the
+        # longest query token as it's likely to have the fewest matches.
+        if query_tokens:
+            found = set(ids)
+            first = max(query_tokens, key=len)
+            matches = []
+            for _, id in islice_prefix(tokens, first):
+                if id in found:
+                    continue
+                found.add(id)
+                name_tokens = tokenize(by_id[id])
+                if all(any(t.startswith(q) for t in name_tokens) for q in query_tokens):
+                    matches.append(id)
+            matches.sort(key=lambda id: by_id[id].lower())
+            ids.extend(matches[:limit - len(ids)])
+
+        return [{"id": id, "name": by_id[id]} for id in ids]
+
+    def on_change(self, obj, action):
+        """DBHandler listener. Mark index stale after an ingredient changes in DB"""
+        if obj.table_main == "ingredients":
+            # Listeners run in the request threads, concurrent bumps must not be lost
+            with self._lock:
+                self.version += 1
+
+
+def tokenize(s):
+    """Return list of lowercased tokens of a string"""
+    return [token for token in TOKEN_SEPARATOR.split(s.lower()) if token]
+
+
+def islice_prefix(array, prefix):
+    """Yield items of a sorted array of (key, value) tuples whose keys start with the prefix"""
+    i = bisect_left(array, (prefix,))
+    while i < len(array) and array[i][0].startswith(prefix):
+        yield array[i]
+        i += 1
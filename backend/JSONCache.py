@@ -0,0 +1,197 @@
+import copy
+import os
+import threading
+from collections import namedtuple
+
+from backend.DBEntry import DBEntry
+from backend.EntityCache import LRUCache
+
+CachedJSON = namedtuple("CachedJSON", "data etag")
+CachedJSON.__doc__ = """JSON of an object returned by JSONCache.
+
+data - bytes. UTF-8 encoded JSON.
+etag - a string. Strong entity tag of the data: the process epoch and a version number that
+    changes whenever the object is encoded anew, e.g. after a change invalidated it.
+"""
+
+class JSONCache(object):
+    """Cache of JSON representations of DBEntry objects (e.g. full recipe graphs) as encoded
+    bytes keyed by (table, id), so that serving a hot object is a dictionary lookup.
+
+    While an object is encoded, every DBEntry of its graph (the object itself, ingredients of a
+    recipe, their categories and allergies, etc.) is recorded as its dependency. A change of any
+    entry reported to on_change(), which is registered as a DBHandler listener, invalidates
+    exactly the cached objects depending on it. Each encoding gets a new version number, which
+    makes up the entity tag of the data along with the process epoch.
+
+    The cache is an in-process LRUCache, optionally backed by the 'json_cache' table (with the
+    dependencies in 'json_cache_deps') so that it survives restarts. Like the other in-memory
+    indexes, it is kept up to date with changes made by the process itself only; a persisted
+    cache must be cleared after the DB is edited by other means.
+    """
+    def __init__(self, db, encoder, size=10000, persist=False):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler. The cache subscribes to its changes.
+        :param encoder: A FoodEncoder used to encode objects.
+        :param size: An integer. Max number of objects held in memory. 0 disables the in-memory
+            cache.
+        :param persist: A boolean. Whether encoded objects are also stored in the DB.
+        """
+        self.db = db
+        self.encoder = encoder
+        self.persist = persist
+        self.epoch = os.urandom(4).hex()
+        self.hits = 0
+        self.misses = 0
+        self._cache = LRUCache(size)
+        self._cache.on_evict = self._forget
+        self._deps = {}       # cache key -> frozenset of keys of its dependencies
+        self._dependents = {} # dependency key -> set of cache keys depending on it
+        self._changes = 0     # number of on_change() calls, tells if a load may be outdated
+        self._version = 0     # version number of the latest encoding
+        self._lock = threading.RLock()
+        db.add_listener(self.on_change)
+
+    def get(self, cls, id):
+        """Return CachedJSON of the object of the DBEntry subclass with the id or None if there
+        is no such object in the DB. The class must be 'cacheable'.
+        """
+        return self.get_many(cls, [id]).get(id)
+
+    def get_many(self, cls, ids):
+        """Return dictionary of CachedJSON of the objects of the DBEntry subclass keyed by id.
+        Ids of objects missing in the DB are omitted. Objects that are not cached are loaded
+        with a single from_db_many() call. The class must be 'cacheable'.
+
+        :param ids: An iterable of integer ids.
+        """
+        result = {}
+        missing = []
+        for id in ids:
+            cached = self._cache.get((cls.table_main, id))
+            if cached is not None:
+                result[id] = cached
+            elif id not in missing:
+                missing.append(id)
+        self.hits += len(result)
+        self.misses += len(missing)
+        if not missing:
+            return result
+
+        changes = self._changes
+        encoded = {} # id -> (data, deps)
+        stored = set()
+        if self.persist:
+            for id in missing:
+                data, deps = self._load((cls.table_main, id))
+                if data is not None:
+                    encoded[id] = (data, deps)
+                    stored.add(id)
+        objects = cls.from_db_many(self.db, [id for id in missing if id not in encoded])
+        for id, obj in objects.items():
+            encoded[id] = self.encode(obj)
+
+        with self._lock:
+            # Objects may have been loaded before a change that was reported meanwhile
+            current = changes == self._changes
+            for id, (data, deps) in encoded.items():
+                self._version += 1
+                result[id] = CachedJSON(data, "{}-{}".format(self.epoch, self._version))
+                if current:
+                    self._add((cls.table_main, id), result[id], deps)
+        if current and self.persist:
+            self._store([((cls.table_main, id), data, deps)
+                         for id, (data, deps) in encoded.items() if id not in stored])
+        return result
+
+    def encode(self, obj):
+        """Return tuple of JSON of the object as bytes and frozenset of (table, id) keys of the
+        DBEntry objects in its graph
+        """
+        deps = set()
+        def default(o):
+            if isinstance(o, DBEntry):
+                deps.add((o.table_main, o.id))
+            return self.encoder.default(o)
+
+        # Encoders call their 'default' attribute, so a copy with the hook set is enough
+        encoder = copy.copy(self.encoder)
+        encoder.default = default
+        return encoder.encode_bytes(obj), frozenset(deps)
+
+    def on_change(self, obj, action):
+        """DBHandler listener. Invalidate cached objects whose graphs contain the changed entry"""
+        # Graphs of cacheable objects consist of cacheable entries only
+        if not getattr(obj, "cacheable", False):
+            return
+        key = (obj.table_main, obj.id)
+        with self._lock:
+            self._changes += 1
+            for cache_key in self._dependents.get(key, set()) | {key}:
+                self._cache.discard(cache_key)
+                self._forget(cache_key)
+        if self.persist:
+            self._invalidate_stored(key)
+
+    def clear(self):
+        """Remove all cached objects including those stored in the DB"""
+        with self._lock:
+            self._changes += 1
+            self._cache.clear()
+            self._deps.clear()
+            self._dependents.clear()
+        if self.persist:
+            with self.db.transaction():
+                self.db.c.execute('DELETE FROM json_cache')
+                self.db.c.execute('DELETE FROM json_cache_deps')
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _add(self, key, cached, deps):
+        self._forget(key)
+        self._cache.set(key, cached)
+        if self._cache.size:
+            self._deps[key] = deps
+            for dep in deps:
+                self._dependents.setdefault(dep, set()).add(key)
+
+    def _forget(self, key, cached=None):
+        """Drop dependencies of the cache key. Also called by the LRUCache on eviction."""
+        with self._lock:
+            for dep in self._deps.pop(key, ()):
+                dependents = self._dependents.get(dep)
+                if dependents is not None:
+                    dependents.discard(key)
+                    if not dependents:
+                        del self._dependents[dep]
+
+    def _load(self, key):
+        row = self.db.c.execute('SELECT data FROM json_cache WHERE obj_type = ? AND id = ?',
+                                key).fetchone()
+        if not row:
+            return None, None
+        rows = self.db.c.execute('SELECT dep_type, dep_id FROM json_cache_deps '
+                                 'WHERE obj_type = ? AND id = ?', key).fetchall()
+        return bytes(row["data"]), frozenset((r["dep_type"], r["dep_id"]) for r in rows)
+
+    def _store(self, items):
+        """Store list of (key, data, deps) tuples in the DB"""
+        if not items:
+            return
+        with self.db.transaction():
+            self.db.c.executemany('INSERT OR REPLACE INTO json_cache (obj_type, id, data) '
+                                  'VALUES (?, ?, ?)', [(*key, data) for key, data, _ in items])
+            self.db.c.executemany('INSERT OR IGNORE INTO json_cache_deps '
+                                  '(dep_type, dep_id, obj_type, id) VALUES (?, ?, ?, ?)',
+                                  [(*dep, *key) for key, _, deps in items for dep in deps])
+
+    def _invalidate_stored(self, key):
+        with self.db.transaction():
+            rows = self.db.c.execute('SELECT obj_type, id FROM json_cache_deps '
+                                     'WHERE dep_type = ? AND dep_id = ?', key).fetchall()
+            keys = {(row["obj_type"], row["id"]) for row in rows} | {key}
+            self.db.c.executemany('DELETE FROM json_cache WHERE obj_type = ? AND id = ?', keys)
+            self.db.c.executemany('DELETE FROM json_cache_deps WHERE obj_type = ? AND id = ?',
+                                  keys)
@@ -0,0 +1,134 @@
+import threading
+from collections.abc import MutableSet
+
+
+class LazyLoader(object):
+    """Loads a collection (e.g. contents) of a group of sibling entries constructed together,
+    like those returned by a single DBEntry.from_db_many() call.
+
+    Each entry gets a LazySet by new_set(). Nothing is loaded until one of the sets is accessed;
+    then the rows of all the sets of the group not loaded yet are selected with a single query.
+    Objects are built from the rows only when items of a set are accessed, again for all the
+    sets at once, so entries iterated over together cost a fixed number of queries.
+    """
+    def __init__(self, db, query, key_column, build, item_key):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler.
+        :param query: A string. Query passed to DBHandler.select_in() selecting rows of the
+            collection by parent ids. The first column must be the parent id.
+        :param key_column: A string. Column of the rows with ids of the items.
+        :param build: A callable build(db, rows) returning list of items built from the rows,
+            one per row. None items are skipped.
+        :param item_key: A callable returning id of an item, i.e. key_column of its row.
+        """
+        self.db = db
+        self.query = query
+        self.key_column = key_column
+        self.build = build
+        self.item_key = item_key
+        self._sets = []
+        self._lock = threading.RLock()
+
+    def new_set(self, parent_id):
+        """Return LazySet of the collection of the parent entry"""
+        lazy_set = LazySet(self, parent_id)
+        self._sets.append(lazy_set)
+        return lazy_set
+
+    def load_rows(self):
+        """Load rows of all the sets that don't have them yet"""
+        with self._lock:
+            pending = [s for s in self._sets if s._rows is None]
+            if not pending:
+                return
+            rows = {s.parent_id: [] for s in pending}
+            for row in self.db.select_in(self.query, list(rows)):
+                rows[row[0]].append(row)
+            for s in pending:
+                s._rows = rows[s.parent_id]
+
+    def load_items(self):
+        """Build items of all the sets that don't have them yet"""
+        with self._lock:
+            self.load_rows()
+            pending = [s for s in self._sets if s._items is None]
+            rows = [row for s in pending for row in s._rows]
+            items = iter(self.build(self.db, rows))
+            for s in pending:
+                s._items = {item for _, item in zip(s._rows, items) if item is not None}
+            # Sets with items need the loader no more
+            self._sets = [s for s in self._sets if s._items is None]
+
+
+def entries_builder(cls, column):
+    """Return LazyLoader build function making entries of the DBEntry subclass with ids in
+    the column of the rows.
+    """
+    def build(db, rows):
+        entries = cls.from_db_many(db, {row[column] for row in rows})
+        return [entries.get(row[column]) for row in rows]
+    return build
+
+
+class LazySet(MutableSet):
+    """Set of entries associated with a parent entry (e.g. meals of a user) loaded from DB on
+    first access by its LazyLoader. ids() gives ids of the items without building them.
+
+    The rows the set was loaded from are kept as the state of the collection in DB, 'modified'
+    tells whether items were added or removed since. Results of set operations (e.g. "-" or
+    "|") are plain sets.
+    """
+    def __init__(self, loader, parent_id):
+        self.loader = loader
+        self.parent_id = parent_id
+        self.modified = False
+        self._rows = None
+        self._items = None
+
+    @classmethod
+    def _from_iterable(cls, it):
+        return set(it)
+
+    def rows(self):
+        """Return list of rows the set was loaded from. Loaded on first call."""
+        if self._rows is None:
+            self.loader.load_rows()
+        return self._rows
+
+    def ids(self):
+        """Return set of ids of the items. Items are not built if not yet."""
+        if self.modified:
+            return {self.loader.item_key(item) for item in self._items}
+        return {row[self.loader.key_column] for row in self.rows()}
+
+    def _get_items(self):
+        if self._items is None:
+            self.loader.load_items()
+        return self._items
+
+    def __contains__(self, item):
+        return item in self._get_items()
+
+    def __iter__(self):
+        return iter(self._get_items())
+
+    def __len__(self):
+        if self._items is not None:
+            return len(self._items)
+        return len(self.rows())
+
+    def add(self, item):
+        self._get_items().add(item)
+        self.modified = True
+
+    def discard(self, item):
+        self._get_items().discard(item)
+        self.modified = True
+
+    def __repr__(self):
+        state = repr(self._items) if self._items is not None else "not loaded"
+        return "{}({})".format(self.__class__.__name__, state)
+
+    def toJSONifiable(self):
+        return list(self._get_items())
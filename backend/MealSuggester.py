@@ -0,0 +1,116 @@
+import random
+import threading
+from array import array
+
+from backend.EntityCache import LRUCache
+
+# Changes to entries in these tables may change which recipes are suitable for users
+CATALOG_TABLES = {"allergies", "ingredient_categories", "ingredients", "recipes"}
+FEISTEL_ROUNDS = 4
+
+
+class MealSuggester(object):
+    """Suggests random recipes suitable for users without repeating them until all suitable
+    recipes were suggested, like dealing cards from a shuffled deck.
+
+    Users with the same allergies share a pool - an array of suitable recipe ids. Each user has
+    a Deck that deals the pool in a pseudo-random order of its own. A deck is reshuffled when it
+    is exhausted and dropped when the user's allergies or the catalog change.
+    """
+    def __init__(self, db, max_decks=10000, max_pools=64):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler. The suggester subscribes to its changes.
+        :param max_decks: An integer. Max number of users' decks kept.
+        :param max_pools: An integer. Max number of pools of suitable recipes kept.
+        """
+        self.db = db
+        self.version = 0
+        self._decks = LRUCache(max_decks)
+        self._pools = LRUCache(max_pools)
+        self._lock = threading.Lock()
+        db.add_listener(self.on_change)
+
+    def on_change(self, obj, action):
+        """DBHandler listener. Invalidate pools and decks after the catalog changes"""
+        if obj.table_main in CATALOG_TABLES:
+            # Listeners run in the request threads, concurrent bumps must not be lost
+            with self._lock:
+                self.version += 1
+
+    def get_pool(self, user):
+        """Return tuple of the key and the array of ids of recipes suitable for the user"""
+        key = (frozenset(user.allergy_ids), self.version)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = array("q", user.get_valid_recipes_id())
+            self._pools.set(key, pool)
+        return key, pool
+
+    def suggest(self, user, n=1, exclude=()):
+        """Return list of up to n ids of recipes suitable for the user. Recipes in user's meals
+        (as stored in DB) and excluded ones are skipped. Fewer ids are returned only if there are
+        not enough suitable recipes left.
+
+        :param user: A User or a Principal.
+        :param n: An integer. Number of suggestions.
+        :param exclude: An iterable of recipe ids not to be suggested.
+        """
+        pool_key, pool = self.get_pool(user)
+        rows = self.db.c.execute('SELECT recipe_id FROM user_meals WHERE user_id = ?',
+                                 (user.id,)).fetchall()
+        exclude = set(exclude) | {row["recipe_id"] for row in rows}
+
+        with self._lock:
+            deck = self._decks.get(user.id)
+            if deck is None or deck.pool_key != pool_key:
+                deck = Deck(pool_key, len(pool))
+                self._decks.set(user.id, deck)
+
+            return [pool[i] for i in deck.deal(n, lambda i: pool[i] not in exclude)]
+
+
+class Deck(object):
+    """Pseudo-random order of indexes of a pool dealt one by one. The order is a permutation of
+    range(size) computed on the fly by a keyed Feistel network, so a deck takes constant memory
+    regardless of the pool size.
+    """
+    def __init__(self, pool_key, size):
+        self.pool_key = pool_key
+        self.size = size
+        self.position = 0
+        self.shuffle()
+
+    def shuffle(self):
+        """Start dealing from the beginning of a new random order"""
+        self.keys = [random.getrandbits(32) for _ in range(FEISTEL_ROUNDS)]
+        self.position = 0
+
+    def deal(self, n, accept):
+        """Return list of up to n next distinct indexes accepted by the accept(index) predicate.
+        Deck is reshuffled when exhausted. At most 'size' indexes are checked per call.
+        """
+        dealt = []
+        for _ in range(self.size):
+            if len(dealt) == n:
+                break
+            if self.position == self.size:
+                self.shuffle()
+            index = self.permute(self.position)
+            self.position += 1
+            if accept(index) and index not in dealt:
+                dealt.append(index)
+        return dealt
+
+    def permute(self, index):
+        """Return element at the index of the deck's permutation of range(size)"""
+        half = max((self.size - 1).bit_length() + 1, 2) // 2
+        mask = (1 << half) - 1
+        # Cycle walking: re-encrypt until the result falls back into range(size)
+        while True:
+            left, right = index >> half, index & mask
+            for key in self.keys:
+                left, right = right, left ^ (((right * 0x9E3779B1) ^ key) >> 7 & mask)
+            index = (left << half) | right
+            if index < self.size:
+                return index
@@ -0,0 +1,151 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left, insort
+
+
+class PantryIndex(object):
+    """In-memory inverted index from ingredients to recipes used to find recipes that can be
+    cooked mostly from a given set of ingredients (e.g. those a user has at home).
+
+    Every ingredient used in recipes has a posting: a compact sorted array of ids of the recipes
+    containing it. Ranking a set of ingredients walks only their postings, so its cost depends
+    on the number of recipes sharing those ingredients rather than on the total number of
+    recipes.
+
+    Ranking takes no lock. Updates are made in place under the lock, touching only the postings
+    of the changed recipe (posting arrays themselves are replaced, never modified), and bump a
+    sequence number before and after, which is odd while an update is in progress. A ranking
+    that overlapped an update is computed again, so it never mixes states of the index.
+
+    The index is loaded on first use and kept up to date incrementally by on_change(), which is
+    registered as a DBHandler listener. Changes made by other processes require refresh().
+    """
+    def __init__(self, db):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler. Used to load recipes' contents.
+        """
+        self.db = db
+        self.version = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = {} # ingredient id -> sorted array of recipe ids
+        self._contents = {} # recipe id -> tuple of ingredient ids
+        self._seq = 0 # odd while the index is being updated
+
+    def refresh(self):
+        """(Re)load the whole index from DB"""
+        # Aggregating ids in SQL saves materializing a row object per content
+        rows = self.db.c.execute(
+            'SELECT ingredient_id, group_concat(recipe_id) FROM recipe_contents '
+            'GROUP BY ingredient_id'
+        ).fetchall()
+        postings = {row[0]: array("q", sorted(map(int, row[1].split(",")))) for row in rows}
+        rows = self.db.c.execute(
+            'SELECT recipe_id, group_concat(ingredient_id) FROM recipe_contents '
+            'GROUP BY recipe_id'
+        ).fetchall()
+        contents = {row[0]: tuple(map(int, row[1].split(","))) for row in rows}
+
+        with self._lock:
+            self._seq += 1
+            self._postings = postings
+            self._contents = contents
+            self._seq += 1
+            self._loaded = True
+            self.version += 1
+
+    def rank(self, ingredient_ids, k=20, valid_ids=None):
+        """Return list of up to k recipes containing at least one of the ingredients, best
+        covered first, as dictionaries:
+        id: recipe id.
+        coverage: share of the recipe's ingredients that are among the given ones.
+        matched: number of the recipe's ingredients that are among the given ones.
+        missing: list of ids of the recipe's ingredients that are not among the given ones.
+        Ties are broken by the number of matched ingredients, then by recipe id.
+
+        :param ingredient_ids: An iterable of ids of available ingredients.
+        :param k: An integer. Max number of recipes.
+        :param valid_ids: A set-like object. If given, only recipes with ids in it are ranked,
+            e.g. User.get_valid_recipes_id() to exclude recipes causing user's allergies.
+        """
+        self._ensure_loaded()
+        ingredient_ids = set(ingredient_ids)
+        while True:
+            seq = self._seq
+            if seq % 2:
+                # Wait for the update in progress to release the lock
+                with self._lock:
+                    pass
+                continue
+            try:
+                result = self._rank(ingredient_ids, k, valid_ids)
+            except KeyError:
+                # A recipe removed meanwhile, unless the index is broken
+                if self._seq == seq:
+                    raise
+                continue
+            if self._seq == seq:
+                return result
+
+    def _rank(self, ingredient_ids, k, valid_ids):
+        postings, contents = self._postings, self._contents
+        matched = {}
+        for ingredient_id in ingredient_ids:
+            for recipe_id in postings.get(ingredient_id, ()):
+                matched[recipe_id] = matched.get(recipe_id, 0) + 1
+
+        candidates = matched.items()
+        if valid_ids is not None:
+            candidates = [(id, n) for id, n in candidates if id in valid_ids]
+        best = heapq.nlargest(
+            k, candidates, key=lambda item: (item[1] / len(contents[item[0]]), item[1], -item[0])
+        )
+
+        return [{"id": id,
+                 "coverage": n / len(contents[id]),
+                 "matched": n,
+                 "missing": [i for i in contents[id] if i not in ingredient_ids]}
+                for id, n in best]
+
+    def update_recipe(self, recipe_id):
+        """Reload contents of the recipe from DB"""
+        if not self._loaded:
+            return
+        rows = self.db.c.execute('SELECT ingredient_id FROM recipe_contents WHERE recipe_id = ?',
+                                 (recipe_id,)).fetchall()
+        new = {row["ingredient_id"] for row in rows}
+
+        with self._lock:
+            self._seq += 1
+            try:
+                postings, contents = self._postings, self._contents
+                old = set(contents.pop(recipe_id, ()))
+                for ingredient_id in old - new:
+                    posting = array("q", postings[ingredient_id])
+                    del posting[bisect_left(posting, recipe_id)]
+                    if posting:
+                        postings[ingredient_id] = posting
+                    else:
+                        del postings[ingredient_id]
+                for ingredient_id in new - old:
+                    posting = array("q", postings.get(ingredient_id, ()))
+                    insort(posting, recipe_id)
+                    postings[ingredient_id] = posting
+                if new:
+                    contents[recipe_id] = tuple(sorted(new))
+            finally:
+                self._seq += 1
+            self.version += 1
+
+    def on_change(self, obj, action):
+        """DBHandler listener. Update index after a recipe changes in DB"""
+        if obj.table_main == "recipes":
+            self.update_recipe(obj.id)
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.refresh()
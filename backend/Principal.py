@@ -0,0 +1,123 @@
+from backend.Allergy import Allergy
+from backend.Recipe import Recipe
+
+
+class Principal(object):
+    """A lightweight representation of the logged in user for authenticated routes.
+
+    Holds only the user's id, name, admin flag and allergy ids, which are loaded by a single
+    indexed query. Allergies and meals are loaded from DB only when accessed. Use User for
+    anything involving credentials or editing the user as a whole.
+
+    :param id: An integer. Id of the user.
+    :param name: A string. Name of the user.
+    :param is_admin: A boolean. Whether user has access to admin functional.
+    :param allergy_ids: An iterable of ids of user's allergies.
+    :param db: A DBHandler. DB the user is stored in.
+    """
+    # Listeners of DB changes tell entries apart by their table
+    table_main = "users"
+
+    def __init__(self, id, name, is_admin=False, allergy_ids=(), db=None):
+        self.id = id
+        self.name = name
+        self.is_admin = bool(is_admin)
+        self.allergy_ids = frozenset(allergy_ids)
+        self.db = db
+        self._allergies = None
+        self._meal_ids = None
+        self._meals = None
+
+    @classmethod
+    def from_db(cls, db, id):
+        """Load user by id. Return Principal or None if there is no such user"""
+        row = db.c.execute(
+            'SELECT users.id, users.name, users.is_admin, '
+            '       group_concat(user_allergies.allergy_id) AS allergy_ids '
+            'FROM users LEFT JOIN user_allergies ON user_allergies.user_id = users.id '
+            'WHERE users.id = ? GROUP BY users.id', (id,)
+        ).fetchone()
+        if not row:
+            return None
+        allergy_ids = map(int, row["allergy_ids"].split(",")) if row["allergy_ids"] else ()
+        return cls(row["id"], row["name"], row["is_admin"], allergy_ids, db)
+
+    @property
+    def allergies(self):
+        """Get set of user's Allergy objects. Loaded on first access."""
+        if self._allergies is None:
+            self._allergies = set(Allergy.from_db_many(self.db, self.allergy_ids).values())
+        return self._allergies
+
+    @property
+    def meal_ids(self):
+        """Get set of ids of recipes in user's meal plan. Loaded on first access."""
+        if self._meal_ids is None:
+            rows = self.db.c.execute('SELECT recipe_id FROM user_meals WHERE user_id = ?',
+                                     (self.id,)).fetchall()
+            self._meal_ids = {row["recipe_id"] for row in rows}
+        return self._meal_ids
+
+    @property
+    def meals(self):
+        """Get set of Recipe objects in user's meal plan. Loaded on first access."""
+        if self._meals is None:
+            self._meals = set(Recipe.from_db_many(self.db, self.meal_ids).values())
+        return self._meals
+
+    def add_meal(self, id):
+        """Add a meal to user by recipe id. Commit changes to DB. Ids of missing recipes are
+        ignored.
+        """
+        self.db.c.execute('INSERT OR IGNORE INTO user_meals (user_id, recipe_id) '
+                          'SELECT ?, id FROM recipes WHERE id = ?', (self.id, id))
+        added = self.db.c.rowcount > 0
+        self.db.commit()
+        if added:
+            self._forget_meals()
+            self.db.notify_change(self, "write")
+
+    def remove_meal(self, id):
+        """Remove a meal from user by recipe id. Commit changes to DB"""
+        self.db.c.execute('DELETE FROM user_meals WHERE user_id = ? AND recipe_id = ?',
+                          (self.id, id))
+        removed = self.db.c.rowcount > 0
+        self.db.commit()
+        if removed:
+            self._forget_meals()
+            self.db.notify_change(self, "write")
+
+    def get_valid_recipes_id(self):
+        """Get set of ids of the recipes from DB that suit user preferences. See
+        User.get_valid_recipes_id().
+        """
+        if self.db.use_allergen_index:
+            return self.db.allergen_index.valid_recipe_ids(self.allergy_ids)
+        return Recipe.get_valid_ids(self.db, self.allergy_ids)
+
+    def _forget_meals(self):
+        self._meal_ids = None
+        self._meals = None
+
+
+class PrincipalStore(object):
+    """Loads principals of logged in users for authenticated requests.
+
+    The principal is read from the DB on every request. Caching it (e.g. in the session) would
+    only be invalidated by changes made by the same process: with several workers, revoked admin
+    rights or changed allergies would go unnoticed by the others. Loading it is a single indexed
+    query, which is as cheap as checking a stored version would be.
+    """
+    def __init__(self, db):
+        """Constructor. Returns functional object.
+
+        :param db: A DBHandler. DB users are loaded from.
+        """
+        self.db = db
+
+    def get(self, session):
+        """Return Principal of the user logged in the session or None if the user doesn't exist"""
+        user_id = session.get("user_id")
+        if user_id is None:
+            return None
+        return Principal.from_db(self.db, user_id)
@@ -1,7 +1,12 @@
 from collections import namedtuple
 
-from backend.DBEntry import DBEntry, to_db_obj_name
+from backend import search
+from backend.DBEntry import DBEntry, SummaryColumn, SummaryList, TrackedCollection
 from backend.Ingredient import Ingredient
+from backend.LazySet import LazyLoader
+
+# Main table columns indexed for full-text search along with ingredient names
+SEARCH_COLUMNS = {"name", "instructions"}
 
 
 class Recipe(DBEntry):
@@ -9,7 +14,30 @@ class Recipe(DBEntry):
     table_main = "recipes"
     associations = [
         ("user_meals","recipe_id", False),
-        ("recipe_contents","recipe_id", True)
+        ("recipe_contents","recipe_id", True),
+        ("recipe_allergens","recipe_id", True)
+    ]
+    embeds = (Ingredient,)
+    json_fields = ("name", "id", "instructions", "contents")
+    summary_columns = [
+        SummaryColumn("id", "id"),
+        SummaryColumn("name", "name"),
+        SummaryColumn("instructions", "instructions"),
+    ]
+    summary_lists = [
+        SummaryList("contents", "recipe_contents",
+                    "json_object('ingredient', ingredients.name, "
+                    "            'amount', recipe_contents.amount, "
+                    "            'units', recipe_contents.units)",
+                    join='LEFT JOIN ingredients ON recipe_contents.ingredient_id = ingredients.id',
+                    sort_by="ingredient"),
+        SummaryList("allergens", "recipe_allergens", "allergies.name",
+                    join='LEFT JOIN allergies ON recipe_allergens.allergy_id = allergies.id'),
+    ]
+    tracked_collections = [
+        TrackedCollection("contents", "recipe_contents", "recipe_id", "ingredient_id",
+                          values=("amount", "units"),
+                          to_row=lambda c: (c.ingredient.id, c.amount, c.units)),
     ]
 
     def __init__(self, name, instructions="", contents=set(), db=None, id=None):
@@ -27,213 +55,65 @@ class Recipe(DBEntry):
         self.contents = contents
 
     @classmethod
-    def from_db(cls, db, id=None, name=None):
-        """Search db for recipe entry by id or name (in that priority) and return constructed
-        object. Returns None if id is not found.
+    def from_db_attrs(cls, db, attrs_list):
+        """Construct recipes from a list of dictionaries returned by get_db_attrs() and return
+        them as a dictionary keyed by id. Contents are LazySets loaded for all the recipes at
+        once on first access.
         """
-        recipe = super().from_db(db=db, id=id, name=name)
-
-        if not recipe:
-            return None
-        id = recipe.id
-
-        # Constructing contents set
-        needle = (id,)
-        db.c.execute(
-            'SELECT ingredient_id, amount, units FROM recipe_contents '
-            'WHERE recipe_id = ?',
-            needle
-        )
-        rows = db.c.fetchall()
-        contents = set()
-        for row in rows:
-            ingredient = Ingredient.from_db(db, row["ingredient_id"])
-            content = Content(ingredient, row["amount"], row["units"])
-            contents.add(content)
-
-        recipe.contents = contents
-        return recipe
-
-    def new_to_db(self):
-        """Write a new recipe entry to the DB. Return id assigned by the DB."""
-        table_main = to_db_obj_name(self.table_main)
-
-        # Inserting values to the main table
-        recipe = (self.name, self.instructions)
-        self.db.c.execute(f'INSERT INTO "{table_main}" (name, instructions) VALUES (?, ?)',
-                          recipe)
-
-        # Remembering id assigned by the DB
-        new_row_id = (self.db.c.lastrowid,)
-        self.db.c.execute(f'SELECT id FROM "{table_main}" WHERE rowid = ?', new_row_id)
-        row = self.db.c.fetchone()
-        id = row["id"]
-
-        # inserting contents to the associative table
-        contents = {(id, c.ingredient.id, c.amount, c.units) for c in self.contents}
-        self.db.c.executemany(
-            'INSERT INTO recipe_contents (recipe_id, ingredient_id, amount, units) '
-            '  VALUES (?, ?, ?, ?)',
-            contents
+        loader = LazyLoader(
+            db,
+            'SELECT recipe_id, ingredient_id, amount, units FROM recipe_contents '
+            'WHERE recipe_id IN ({})',
+            "ingredient_id", build_contents, lambda content: content.ingredient.id
         )
+        return {attrs["id"]: cls(db=db, contents=loader.new_set(attrs["id"]), **attrs)
+                for attrs in attrs_list}
 
-        return id
-
-    def edit_in_db(self):
-        """Edit existing DB recipe to match current object state. Return number of
-        affected rows.
+    @classmethod
+    def after_write(cls, db, entries, changes):
+        """Reindex written recipes for search, unless only amounts or units of their contents
+        changed, which are not indexed
         """
-        table_main = to_db_obj_name(self.table_main)
-        rows_affected = 0
-
-        # Updating values to the main table
-        recipe = (self.name, self.instructions, self.id)
-        self.db.c.execute(f'UPDATE "{table_main}" SET name = ?, instructions = ? WHERE id = ?',
-                          recipe)
-        rows_affected += self.db.c.rowcount
-
-
-        # Constructing sets of the recipe's old and new contents' ingredient ids
-        new_ingredient_ids = {c.ingredient.id for c in self.contents}
-        needle = (self.id,)
-        old_contents = self.db.c.execute('SELECT ingredient_id as id FROM recipe_contents WHERE '
-                                         'recipe_id = ?', needle).fetchall()
-        old_ingredient_ids = {c["id"] for c in old_contents}
-
-        # Removing contents missing in the new set
-        to_remove = {(self.id, i_id) for i_id in old_ingredient_ids - new_ingredient_ids}
-        self.db.c.executemany('DELETE FROM recipe_contents WHERE recipe_id = ? AND ingredient_id = ?',
-                              to_remove)
-        rows_affected += self.db.c.rowcount
-
-        # Adding contents missing in the old set
-        new_contents = {c for c in self.contents
-                        if c.ingredient.id in new_ingredient_ids - old_ingredient_ids}
-        to_add = {(self.id, c.ingredient.id, c.amount, c.units) for c in new_contents}
-        self.db.c.executemany(
-            'INSERT INTO recipe_contents (recipe_id, ingredient_id, amount, units) '
-            '  VALUES (?, ?, ?, ?)',
-            to_add
-        )
-        rows_affected += self.db.c.rowcount
+        ids = [entry.id for entry, columns in zip(entries, changes)
+               if columns is None or SEARCH_COLUMNS & columns.keys() or entry.ingredients_changed()]
+        if ids:
+            search.index_recipes(db, ids)
+
+    def ingredients_changed(self):
+        """Return True if the set of the recipe's ingredients changed since it was loaded or last
+        written
+        """
+        states = self.get_collection_states(self.tracked_collections[0])
+        return bool(states) and states[0].keys() != states[1].keys()
 
-        # Updating contents present in both the old and the new sets
-        updated_contents = self.contents - new_contents
-        to_update = {(c.amount, c.units, self.id, c.ingredient.id) for c in updated_contents}
-        self.db.c.executemany(
-            'UPDATE recipe_contents SET amount = ?, units = ? '
-            '  WHERE recipe_id = ? AND ingredient_id = ?',
-            to_update
-        )
+    def db_columns(self):
+        """Return dictionary of values of the recipe's main table columns keyed by column name"""
+        return {"name": self.name, "instructions": self.instructions}
 
-        return rows_affected
+    def remove_from_db(self):
+        """Remove recipe from DB along with its full-text search index entry"""
+        # Dependencies are checked after the index entry is removed, a failure restores it
+        with self.db.transaction():
+            search.unindex_recipes(self.db, [self.id])
+            super().remove_from_db()
 
     @classmethod
-    def get_summary(cls, db, name_sort=False):
-        """"Return summary table for Recipe objects in DB as dictionary list.
-        id: recipe db_id.
-        name: recipe name.
-        instructions: instructions on how to prepare the dish.
-        contents: list of contents (ingredient name, amount, units).
-        dependents: number of other class entries referencing this id as a foreign key.
+    def get_valid_ids(cls, db, allergy_ids):
+        """Return frozenset of ids of recipes with contents that cause none of the allergies.
+        A single anti-join against the recipe_allergens table.
 
-        param name_sort: A boolean. If True, summary will be recursively sorted by
-            object name ascending.
+        :param allergy_ids: An iterable of allergy ids.
         """
-        summary = []
-
-        # Get main table data
-        db.c.execute('SELECT id, name, instructions '
-                     'FROM recipes '
-                     'ORDER BY id ASC'
-        )
-        for db_row in db.c.fetchall():
-            row = {x: y for x, y in zip(db_row.keys(), db_row)}
-            summary.append(row)
-
+        allergy_ids = tuple(allergy_ids)
+        query = ('SELECT id FROM recipes '
+                 'WHERE EXISTS (SELECT 1 FROM recipe_contents WHERE recipe_id = recipes.id)')
+        if allergy_ids:
+            query += (' AND NOT EXISTS (SELECT 1 FROM recipe_allergens '
+                      '                 WHERE recipe_id = recipes.id AND allergy_id IN ({}))'
+                      ).format(", ".join("?" * len(allergy_ids)))
+        rows = db.c.execute(query, allergy_ids).fetchall()
 
-        # Get content lists
-        db.c.execute(
-            'SELECT recipe_contents.recipe_id, ingredients.name as ingredient, '
-            '  recipe_contents.amount, recipe_contents.units '
-            'FROM recipe_contents '
-            'LEFT JOIN ingredients ON recipe_contents.ingredient_id = ingredients.id '
-            'ORDER BY recipe_id ASC'
-        )
-        db_rows = db.c.fetchall()
-        if db_rows:
-            it_summary = iter(summary)
-            s_row = next(it_summary)
-            for db_row in db_rows:
-                while not db_row["recipe_id"] == s_row["id"]:
-                    # Ensure at least an empty 'cell' exists for this recipe before moving to next
-                    try:
-                        s_row["contents"]
-                    except KeyError:
-                        s_row["contents"] = []
-                    s_row = next(it_summary)
-
-                content = {
-                    "ingredient": db_row["ingredient"],
-                    "amount"    : db_row["amount"],
-                    "units"     : db_row["units"],
-                }
-                try:
-                    s_row["contents"].append(content)
-                except KeyError:
-                    s_row["contents"] = [content]
-
-            # Fill remaining rows with empty content lists
-            finished = False
-            while not finished:
-                try:
-                    s_row = next(it_summary)
-                    s_row["contents"] = []
-                except StopIteration:
-                    finished = True
-
-
-        # Get dependents
-        db.c.execute(
-            'SELECT recipe_id, COUNT(user_id) as dependents FROM user_meals '
-            'GROUP BY recipe_id '
-            'ORDER BY recipe_id ASC'
-        )
-        db_rows = db.c.fetchall()
-        if db_rows:
-            it_summary = iter(summary)
-            s_row = next(it_summary)
-            for db_row in db_rows:
-                while not db_row["recipe_id"] == s_row["id"]:
-                    # Set dependents = 0 for ingredients that don't exist in recipe_contents table
-                    try:
-                        s_row["dependents"]
-                    except KeyError:
-                        s_row["dependents"] = 0
-
-                    s_row = next(it_summary)
-
-                s_row["dependents"] = db_row["dependents"]
-
-            # Fill remaining rows with dependents = 0
-            finished = False
-            while not finished:
-                try:
-                    s_row = next(it_summary)
-                    s_row["dependents"] = 0
-                except StopIteration:
-                    finished = True
-
-        if name_sort:
-            summary.sort(key=lambda x: x["name"].lower())
-            for row in summary:
-                try:
-                    row["contents"].sort(key=lambda x: x["ingredient"].lower())
-                except KeyError:
-                    pass
-
-
-        return summary
+        return frozenset(row["id"] for row in rows)
 
     def toJSONifiable(self):
         dct = super().toJSONifiable()
@@ -242,6 +122,14 @@ class Recipe(DBEntry):
         return dct
 
 
+def build_contents(db, rows):
+    """LazyLoader build function making Content tuples from recipe_contents rows"""
+    ingredients = Ingredient.from_db_many(db, {row["ingredient_id"] for row in rows})
+    return [Content(ingredients[row["ingredient_id"]], row["amount"], row["units"])
+            if row["ingredient_id"] in ingredients else None
+            for row in rows]
+
+
 # constructor validation from kindall"s answer at
 # https://stackoverflow.com/a/42146452
 ContentTuple = namedtuple("ContentTuple", "ingredient amount units")
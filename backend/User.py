@@ -1,8 +1,9 @@
 from collections import namedtuple
 
-from backend.DBEntry import DBEntry, to_db_obj_name
+from backend.DBEntry import DBEntry, SummaryColumn, SummaryList, TrackedCollection
 from backend.Allergy import Allergy
 from backend.Recipe import Recipe
+from backend.LazySet import LazySet, LazyLoader, entries_builder
 
 class User(DBEntry):
     """An end-user representation that contains individual settings.
@@ -22,6 +23,27 @@ class User(DBEntry):
         ("user_meals","user_id", True),
         ("user_allergies","user_id", True)
     ]
+    embeds = (Allergy, Recipe)
+    # users hold credentials and change often, each request loads them anew
+    cacheable = False
+    # password_hash is never serialized
+    json_fields = ("name", "id", "is_admin", "meals", "allergies")
+    # password_hash is omitted
+    summary_columns = [
+        SummaryColumn("id", "id"),
+        SummaryColumn("name", "name"),
+        SummaryColumn("is_admin", "is_admin", convert=bool),
+    ]
+    summary_lists = [
+        SummaryList("allergies", "user_allergies", "allergies.name",
+                    join='LEFT JOIN allergies ON user_allergies.allergy_id = allergies.id'),
+        SummaryList("meals", "user_meals", "recipes.name",
+                    join='LEFT JOIN recipes ON user_meals.recipe_id = recipes.id'),
+    ]
+    tracked_collections = [
+        TrackedCollection("allergies", "user_allergies", "user_id", "allergy_id"),
+        TrackedCollection("meals", "user_meals", "user_id", "recipe_id"),
+    ]
 
     # meals are not called recipes because it is planned for meals to eventually have extended
     # functional like multiple helpings per recipe, etc.
@@ -34,289 +56,73 @@ class User(DBEntry):
         self.allergies = allergies
 
     @classmethod
-    def from_db(cls, db, id=None, name=None):
-        """Search db for user entry by id or name (in that priorty) and return constructed object.
-        Returns None if id is not found.
+    def from_db_attrs(cls, db, attrs_list):
+        """Construct users from a list of dictionaries returned by get_db_attrs() and return
+        them as a dictionary keyed by id. Allergies and meals are LazySets loaded for all the
+        users at once on first access.
         """
-        user = super().from_db(db=db, id=id, name=name)
-
-        if not user:
-            return None
-        id = user.id
-
-        # Constructing allergies set
-        needle = (id,)
-        db.c.execute('SELECT allergy_id as id FROM user_allergies WHERE user_id = ?', needle)
-        rows = db.c.fetchall()
-        allergies = {Allergy.from_db(db, row["id"]) for row in rows}
-
-        # Constructing meals set
-        needle = (id,)
-        db.c.execute('SELECT recipe_id as id FROM user_meals WHERE user_id = ?', needle)
-        rows = db.c.fetchall()
-        meals = {Recipe.from_db(db, row["id"]) for row in rows}
-
-        user.allergies = allergies
-        user.meals = meals
-
-        return user
-
-    def new_to_db(self):
-        """Write a new user to the DB. Return id assigned by the DB."""
-        table_main = to_db_obj_name(self.table_main)
-
-        # Inserting values to the main table
-        user = (self.name, self.password_hash, self.is_admin)
-        self.db.c.execute(f'INSERT INTO "{table_main}" (name, password_hash, is_admin) '
-                           'VALUES (?, ?, ?)', user)
-
-        # Remembering id assigned by the DB
-        new_row_id = (self.db.c.lastrowid,)
-        self.db.c.execute(f'SELECT id FROM "{table_main}" WHERE rowid = ?', new_row_id)
-        row = self.db.c.fetchone()
-        id = row["id"]
-
-        # inserting allergies to the associative table
-        allergies = {(id, a.id) for a in self.allergies}
-        self.db.c.executemany('INSERT INTO user_allergies (user_id, allergy_id) VALUES (?, ?)',
-                              allergies)
-
-        # inserting meals to the associative table
-        meals = {(id, m.id) for m in self.meals}
-        self.db.c.executemany('INSERT INTO user_meals (user_id, recipe_id) VALUES (?, ?)', meals)
-
-        return id
-
-    def edit_in_db(self):
-        """Edit existing DB user to match current object state. Return number of affected rows."""
-        table_main = to_db_obj_name(self.table_main)
-        rows_affected = 0
-
-        # Updating values to the main table
-        user = (self.name, self.password_hash, self.is_admin, self.id)
-        self.db.c.execute(f'UPDATE "{table_main}" SET name = ?, password_hash = ?, is_admin = ? '
-                           'WHERE id = ?', user)
-        rows_affected += self.db.c.rowcount
-
-        # Allergies block
-        # Constructing sets of the users's old and new allergies' ids
-        new_allergy_ids = {a.id for a in self.allergies}
-        needle = (self.id,)
-        old_allergies = self.db.c.execute('SELECT allergy_id as id FROM user_allergies WHERE '
-                                          'user_id = ?', needle).fetchall()
-        old_allergy_ids = {a["id"] for a in old_allergies}
-
-        # Removing allergies missing in the new set
-        to_remove = {(self.id, a_id) for a_id in old_allergy_ids - new_allergy_ids}
-        self.db.c.executemany(
-            'DELETE FROM user_allergies WHERE user_id = ? AND allergy_id = ?', to_remove)
-        rows_affected += self.db.c.rowcount
-
-        # Adding allergies missing in the old set
-        to_add = {(self.id, a_id) for a_id in new_allergy_ids - old_allergy_ids}
-        self.db.c.executemany(
-            'INSERT INTO user_allergies (user_id, allergy_id) VALUES (?, ?)',
-            to_add
+        allergies = LazyLoader(
+            db,
+            'SELECT user_id, allergy_id FROM user_allergies WHERE user_id IN ({})',
+            "allergy_id", entries_builder(Allergy, "allergy_id"), lambda allergy: allergy.id
         )
-        rows_affected += self.db.c.rowcount
-
-        # Meals block
-        # Constructing sets of the users's old and new recipes' ids
-        new_recipe_ids = {r.id for r in self.meals}
-        needle = (self.id,)
-        old_recipes = self.db.c.execute('SELECT recipe_id as id FROM user_meals WHERE '
-                                          'user_id = ?', needle).fetchall()
-        old_recipe_ids = {r["id"] for r in old_recipes}
-
-        # Removing recipes missing in the new set
-        to_remove = {(self.id, r_id) for r_id in old_recipe_ids - new_recipe_ids}
-        self.db.c.executemany(
-            'DELETE FROM user_meals WHERE user_id = ? AND recipe_id = ?', to_remove)
-        rows_affected += self.db.c.rowcount
-
-        # Adding recipes missing in the old set
-        to_add = {(self.id, r_id) for r_id in new_recipe_ids - old_recipe_ids}
-        self.db.c.executemany(
-            'INSERT INTO user_meals (user_id, recipe_id) VALUES (?, ?)',
-            to_add
+        meals = LazyLoader(
+            db,
+            'SELECT user_id, recipe_id FROM user_meals WHERE user_id IN ({})',
+            "recipe_id", entries_builder(Recipe, "recipe_id"), lambda recipe: recipe.id
         )
-        rows_affected += self.db.c.rowcount
 
-        return rows_affected
+        return {attrs["id"]: cls(db=db, allergies=allergies.new_set(attrs["id"]),
+                                 meals=meals.new_set(attrs["id"]), **attrs)
+                for attrs in attrs_list}
+
+    def db_columns(self):
+        """Return dictionary of values of the user's main table columns keyed by column name"""
+        return {"name": self.name, "password_hash": self.password_hash,
+                "is_admin": self.is_admin}
 
     def add_meal(self, id):
         """Add a meal to user by recipe id. Commit changes to DB"""
-        present_ids = {m.id for m in self.meals}
-        if not (id in present_ids):
+        if not (id in self.meal_ids):
             meal = Recipe.from_db(db=self.db, id=id)
-            self.meals.add(meal)
-
-            t = (self.id, id)
-            self.db.c.execute('INSERT INTO user_meals (user_id, recipe_id) VALUES (?, ?)', t)
-            self.db.conn.commit()
+            if meal:
+                self.meals.add(meal)
+                self.write_to_db()
 
     def remove_meal(self, id):
         """Remove a meal from user by recipe id. Commit changes to DB"""
-        found = False
-        it = iter(self.meals)
-        try:
-            meal = next(it)
-        except StopIteration:
-            meal = None
-        while not found and meal:
-            if meal.id == id:
-                found = True
-            else:
-                try:
-                    meal = next(it)
-                except StopIteration:
-                    meal = None
-
-        if found:
-            t = (self.id, id)
-            self.db.c.execute('DELETE FROM user_meals WHERE user_id = ? AND recipe_id = ?', t)
-            self.db.conn.commit()
-
-
-    @classmethod
-    def get_summary(cls, db, name_sort=False):
-        """"Return summary table for all user objects in DB as dictionary list.
-        id: user id.
-        name: user name.
-        allergies: list of allergies.
-        meals: list of meals.
-        dependents: number of other class entries referencing this id as a foreign key.
-            Currently none but might change in the future.
-
-        param name_sort: A boolean. If True, summary will be recursively sorted by
-            object name ascending.
-        """
-        summary = []
-
-        # Get main table data omitting the password_hash
-        db.c.execute('SELECT id, name, is_admin '
-                     'FROM users '
-                     'ORDER BY id ASC'
-        )
-        for db_row in db.c.fetchall():
-            row = {x: y for x, y in zip(db_row.keys(), db_row)}
-            row["is_admin"] = bool(row["is_admin"])
-            summary.append(row)
-
-
-        # Allergies block
-        # Get allergy lists
-        db.c.execute(
-            'SELECT user_allergies.user_id, allergies.name as allergy_name '
-            'FROM user_allergies '
-            'LEFT JOIN allergies ON user_allergies.allergy_id = allergies.id '
-            'ORDER BY user_allergies.user_id ASC'
-        )
-        db_rows = db.c.fetchall()
-        if db_rows:
-            it_summary = iter(summary)
-            s_row = next(it_summary)
-            for db_row in db_rows:
-                while not db_row["user_id"] == s_row["id"]:
-                    # Ensure at least an empty 'cell' exists for this ingredient before moving to next
-                    try:
-                        s_row["allergies"]
-                    except KeyError:
-                        s_row["allergies"] = []
-                    s_row = next(it_summary)
-
-                try:
-                    s_row["allergies"].append(db_row["allergy_name"])
-                except KeyError:
-                    s_row["allergies"] = [db_row["allergy_name"]]
-
-            # Fill remaining rows with empty allergy lists
-            finished = False
-            while not finished:
-                try:
-                    s_row = next(it_summary)
-                    s_row["allergies"] = []
-                except StopIteration:
-                    finished = True
-
-        # Meals block
-        # Get allergy lists
-        db.c.execute(
-            'SELECT user_meals.user_id, recipes.name as meal_name '
-            'FROM user_meals '
-            'LEFT JOIN recipes ON user_meals.recipe_id = recipes.id '
-            'ORDER BY user_meals.user_id ASC'
-        )
-        db_rows = db.c.fetchall()
-        if db_rows:
-            it_summary = iter(summary)
-            s_row = next(it_summary)
-            for db_row in db_rows:
-                while not db_row["user_id"] == s_row["id"]:
-                    # Ensure at least an empty 'cell' exists for this ingredient before moving to next
-                    try:
-                        s_row["meals"]
-                    except KeyError:
-                        s_row["meals"] = []
-                    s_row = next(it_summary)
-
-                try:
-                    s_row["meals"].append(db_row["meal_name"])
-                except KeyError:
-                    s_row["meals"] = [db_row["meal_name"]]
-
-            # Fill remaining rows with empty allergy lists
-            finished = False
-            while not finished:
-                try:
-                    s_row = next(it_summary)
-                    s_row["meals"] = []
-                except StopIteration:
-                    finished = True
-
-
-        # dependents currently non-existent
-
-        if name_sort:
-            summary.sort(key=lambda x: x["name"].lower())
-            for row in summary:
-                row["allergies"].sort(key=str.lower)
-                row["meals"].sort(key=str.lower)
-
-
-        return summary
+        if id in self.meal_ids:
+            self.meals -= {meal for meal in self.meals if meal.id == id}
+            self.write_to_db()
 
     def get_valid_recipes_id(self):
         """Get set of ids of the recipes from DB that suit user preferences (including those that
         might already be in meals).
 
         Currently that is all recipes that have no allergens to trigger user's alelrgies. Recipes
-        with empty contents are not included.
+        with empty contents are not included. Returns an immutable set-like object.
         """
         if not self.db:
             raise RuntimeError("User must have db assigned")
 
-        # Get unsuitable ingredients' ids
-        user_allergy_ids = {a.id for a in self.allergies}
-        needle = tuple(user_allergy_ids)
-        query = 'SELECT ingredient_id FROM ingredient_allergies WHERE allergy_id IN ({})'.format(
-                ("?, " * len(user_allergy_ids))[:-2])
-        rows = self.db.c.execute(query, needle).fetchall()
-        exclude_ingredients = {r["ingredient_id"] for r in rows}
+        if self.db.use_allergen_index:
+            return self.db.allergen_index.valid_recipe_ids(self.allergy_ids)
+        return Recipe.get_valid_ids(self.db, self.allergy_ids)
 
+    @property
+    def allergy_ids(self):
+        """Get set of ids of user's allergies. Allergies loaded lazily are not built."""
+        if isinstance(self.allergies, LazySet):
+            return self.allergies.ids()
+        return {a.id for a in self.allergies}
 
-        # Get suitable recipes' ids
-        needle = tuple(exclude_ingredients)
-        query = """SELECT recipe_id FROM recipe_contents
-                   EXCEPT
-                   SELECT recipe_id FROM recipe_contents WHERE ingredient_id IN ({})
-                """.format(("?, " * len(exclude_ingredients))[:-2])
-        rows = self.db.c.execute(query, needle).fetchall()
-        include_recipes = {r["recipe_id"] for r in rows}
-
-        return include_recipes
+    @property
+    def meal_ids(self):
+        """Get set of ids of recipes in user's meal plan. Meals loaded lazily are not built."""
+        if isinstance(self.meals, LazySet):
+            return self.meals.ids()
+        return {m.id for m in self.meals}
 
-    # password_hash made name mangled for JSON encoder to omit it
     @property
     def password_hash(self):
         """Get user's password_hash"""
@@ -0,0 +1,342 @@
+"""Streaming import and export of the recipe catalog: allergies, ingredient categories,
+ingredients and recipes.
+
+A catalog is a stream of records, dictionaries with a "type" key and entries referring to each
+other by name rather than id, so catalogs can be moved between DBs:
+    {"type": "allergy", "name": ...}
+    {"type": "category", "name": ...}
+    {"type": "ingredient", "name": ..., "category": ..., "allergies": [...]}
+    {"type": "recipe", "name": ..., "instructions": ...,
+     "contents": [{"ingredient": ..., "amount": ..., "units": ...}, ...]}
+A record may only refer to entries already in the DB or preceding it in the stream; exports
+list every kind of entry before the kinds referring to it.
+
+Records are stored as NDJSON (one JSON object per line) or CSV with a column per key, where
+lists are JSON-encoded. Readers and writers are generators working one record at a time, so
+catalogs of any size are processed in constant memory save for the name to id maps kept by
+import_records().
+"""
+import csv
+import json
+import time
+
+from backend import search
+from backend.DBHandler import DBError
+
+FORMATS = ("ndjson", "csv")
+KINDS = ("allergy", "category", "ingredient", "recipe") # in the order they are exported
+CSV_FIELDS = ("type", "name", "category", "allergies", "instructions", "contents")
+CSV_LIST_FIELDS = ("allergies", "contents")
+BATCH_SIZE = 10000 # records inserted by a single transaction
+
+# Main tables of the kinds and kinds whose names the records refer to
+TABLES = {
+    "allergy": "allergies",
+    "category": "ingredient_categories",
+    "ingredient": "ingredients",
+    "recipe": "recipes",
+}
+SQL_INSERT = {
+    "allergies": 'INSERT INTO allergies (id, name) VALUES (?, ?)',
+    "ingredient_categories": 'INSERT INTO ingredient_categories (id, name) VALUES (?, ?)',
+    "ingredients": 'INSERT INTO ingredients (id, name, category_id) VALUES (?, ?, ?)',
+    "ingredient_allergies":
+        'INSERT INTO ingredient_allergies (ingredient_id, allergy_id) VALUES (?, ?)',
+    "recipes": 'INSERT INTO recipes (id, name, instructions) VALUES (?, ?, ?)',
+    "recipe_contents":
+        'INSERT INTO recipe_contents (recipe_id, ingredient_id, amount, units) VALUES (?, ?, ?, ?)',
+}
+SQL_EXPORT = {
+    "allergy": 'SELECT \'allergy\' AS type, name FROM allergies ORDER BY id',
+    "category": 'SELECT \'category\' AS type, name FROM ingredient_categories ORDER BY id',
+    "ingredient": (
+        'SELECT \'ingredient\' AS type, ingredients.name, '
+        '  ingredient_categories.name AS category, '
+        '  (SELECT json_group_array(allergies.name) FROM ingredient_allergies '
+        '   JOIN allergies ON ingredient_allergies.allergy_id = allergies.id '
+        '   WHERE ingredient_allergies.ingredient_id = ingredients.id) AS allergies '
+        'FROM ingredients '
+        'JOIN ingredient_categories ON ingredients.category_id = ingredient_categories.id '
+        'ORDER BY ingredients.id'
+    ),
+    "recipe": (
+        'SELECT \'recipe\' AS type, name, instructions, '
+        '  (SELECT json_group_array(json_object(\'ingredient\', ingredients.name, '
+        '                                       \'amount\', recipe_contents.amount, '
+        '                                       \'units\', recipe_contents.units)) '
+        '   FROM recipe_contents '
+        '   JOIN ingredients ON recipe_contents.ingredient_id = ingredients.id '
+        '   WHERE recipe_contents.recipe_id = recipes.id) AS contents '
+        'FROM recipes ORDER BY id'
+    ),
+}
+EXPORT_FETCH_SIZE = 1000 # rows fetched from the export cursor at a time
+
+
+class CatalogError(ValueError):
+    """A catalog record is malformed or refers to an unknown entry"""
+    pass
+
+
+def iter_records(db, kinds=KINDS):
+    """Generate records of all entries of the kinds in the DB, kinds in the given order.
+
+    :param db: A DBHandler.
+    :param kinds: An iterable of record types, see KINDS.
+    """
+    # A cursor of its own keeps the stream going while other queries use db.c
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for kind in kinds:
+                cursor.execute(SQL_EXPORT[kind])
+                while True:
+                    rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                    if not rows:
+                        break
+                    for row in rows:
+                        record = dict(row)
+                        for field in CSV_LIST_FIELDS:
+                            if field in record:
+                                record[field] = json.loads(record[field])
+                        yield record
+        finally:
+            cursor.close()
+
+
+def read_ndjson(f):
+    """Generate records from an NDJSON text stream. Blank lines are skipped."""
+    for line_no, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as err:
+            raise CatalogError(f"line {line_no}: {err}")
+        if not isinstance(record, dict):
+            raise CatalogError(f"line {line_no}: a record must be a JSON object")
+        yield record
+
+
+def write_ndjson(records, f):
+    """Write records to a text stream as NDJSON. Return number of records written."""
+    count = 0
+    for record in records:
+        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+        f.write("\n")
+        count += 1
+    return count
+
+
+def read_csv(f):
+    """Generate records from a CSV text stream with a header row. Empty cells are omitted and
+    list columns are decoded from JSON.
+    """
+    for record in csv.DictReader(f):
+        record = {key: value for key, value in record.items() if key and value}
+        try:
+            for field in CSV_LIST_FIELDS:
+                if field in record:
+                    record[field] = json.loads(record[field])
+        except ValueError as err:
+            raise CatalogError(f"{record.get('name')!r}: bad {field} cell: {err}")
+        yield record
+
+
+def write_csv(records, f):
+    """Write records to a text stream as CSV with a header row and columns CSV_FIELDS. Return
+    number of records written.
+    """
+    writer = csv.DictWriter(f, CSV_FIELDS, extrasaction="ignore", lineterminator="\n")
+    writer.writeheader()
+    count = 0
+    for record in records:
+        row = dict(record)
+        for field in CSV_LIST_FIELDS:
+            if field in row:
+                row[field] = json.dumps(row[field], ensure_ascii=False, separators=(",", ":"))
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def read_records(f, format):
+    """Generate records from a text stream in the format, one of FORMATS"""
+    if format == "csv":
+        return read_csv(f)
+    if format == "ndjson":
+        return read_ndjson(f)
+    raise ValueError(f"unknown catalog format {format!r}")
+
+
+def write_records(records, f, format):
+    """Write records to a text stream in the format, one of FORMATS. Return number of records
+    written.
+    """
+    if format == "csv":
+        return write_csv(records, f)
+    if format == "ndjson":
+        return write_ndjson(records, f)
+    raise ValueError(f"unknown catalog format {format!r}")
+
+
+def import_records(db, records, batch_size=BATCH_SIZE, on_error=None, progress=None):
+    """Insert entries of the records into the DB. Entries with names already in the DB are
+    skipped. Return dictionary of statistics (see ImportStats).
+
+    Names are resolved to ids with maps loaded from the DB once and extended with every
+    imported entry. New entries get ids following the largest ones in the DB and are inserted
+    bypassing DBEntry with a few executemany() calls per batch of records. Each batch is a
+    transaction with foreign key checks deferred to its commit, which also indexes the batch's
+    recipes for search. Listeners of the DB are not notified: in-memory indexes of running apps
+    must be refreshed.
+
+    :param db: A DBHandler.
+    :param records: An iterable of records, e.g. returned by read_records().
+    :param batch_size: An integer. Number of records inserted by a single transaction.
+    :param on_error: A callable on_error(record, error) called with records that are skipped
+        due to a CatalogError. If None, the error is raised and the records of the current
+        batch are not inserted.
+    :param progress: A callable progress(stats) called after each committed batch.
+    """
+    importer = _Importer(db)
+    pending = 0
+    for record in records:
+        importer.stats["records"] += 1
+        try:
+            importer.add(record)
+        except CatalogError as err:
+            if on_error is None:
+                raise
+            importer.stats["errors"] += 1
+            on_error(record, err)
+        pending += 1
+        if pending >= batch_size:
+            importer.flush()
+            pending = 0
+            if progress:
+                progress(importer.stats)
+    importer.flush()
+    importer.stats["seconds"] = time.perf_counter() - importer.started
+    if progress:
+        progress(importer.stats)
+    return importer.stats
+
+
+class _Importer(object):
+    """State of an import_records() call: name to id maps, next ids and rows to be inserted"""
+    def __init__(self, db):
+        self.db = db
+        self.ids = {}      # kind -> {name: id}
+        self.next_id = {}  # table -> id of the next entry inserted
+        for kind, table in TABLES.items():
+            rows = db.c.execute(f'SELECT name, id FROM {table}').fetchall()
+            self.ids[kind] = {row[0]: row[1] for row in rows}
+            self.next_id[table] = max(self.ids[kind].values(), default=0) + 1
+        self.committed_id = dict(self.next_id)
+        self.rows = {table: [] for table in SQL_INSERT}
+        self.recipe_ids = []
+        self.started = time.perf_counter()
+        self.stats = ImportStats()
+
+    def add(self, record):
+        """Validate the record and queue rows of its entry for insertion"""
+        kind = record.get("type")
+        if kind not in TABLES:
+            raise CatalogError(f"unknown record type {kind!r}")
+        name = record.get("name")
+        if not isinstance(name, str) or not name.strip():
+            raise CatalogError(f"{kind} record without a name")
+        if name in self.ids[kind]:
+            self.stats["skipped"] += 1
+            return
+
+        # Rows are built before any of them is queued so an invalid record leaves no trace
+        table = TABLES[kind]
+        id = self.next_id[table]
+        if kind == "ingredient":
+            category_id = self.resolve("category", record.get("category"), name)
+            allergy_ids = {self.resolve("allergy", allergy, name)
+                           for allergy in self.get_list(record, "allergies")}
+            self.rows[table].append((id, name, category_id))
+            self.rows["ingredient_allergies"].extend((id, a) for a in allergy_ids)
+        elif kind == "recipe":
+            contents = {}
+            for content in self.get_list(record, "contents"):
+                if not isinstance(content, dict):
+                    raise CatalogError(f"{name!r}: contents must be objects")
+                ingredient_id = self.resolve("ingredient", content.get("ingredient"), name)
+                amount = content.get("amount", 0)
+                if isinstance(amount, bool) or not isinstance(amount, (int, float)) \
+                        or not amount >= 0:
+                    raise CatalogError(f"{name!r}: amount must be a positive number")
+                contents[ingredient_id] = (id, ingredient_id, amount, content.get("units"))
+            instructions = record.get("instructions")
+            self.rows[table].append((id, name, "" if instructions is None else instructions))
+            self.rows["recipe_contents"].extend(contents.values())
+            self.recipe_ids.append(id)
+        else:
+            self.rows[table].append((id, name))
+
+        self.ids[kind][name] = id
+        self.next_id[table] += 1
+        self.stats["inserted"] += 1
+
+    def resolve(self, kind, name, referrer):
+        """Return id of the entry of the kind by name"""
+        try:
+            return self.ids[kind][name]
+        except (KeyError, TypeError):
+            raise CatalogError(f"{referrer!r}: unknown {kind} {name!r}")
+
+    @staticmethod
+    def get_list(record, field):
+        value = record.get(field) or []
+        if not isinstance(value, list):
+            raise CatalogError(f"{record['name']!r}: {field} must be a list")
+        return value
+
+    def flush(self):
+        """Insert the queued rows in a single transaction"""
+        if not any(self.rows.values()):
+            return
+        db = self.db
+        with db.transaction():
+            db.c.execute('PRAGMA defer_foreign_keys = ON')
+            # Ids were assigned ahead of the transaction, so they must still be free
+            for table, committed_id in self.committed_id.items():
+                if self.rows[table]:
+                    query = f'SELECT coalesce(max(id), 0) + 1 FROM {table}'
+                    if db.c.execute(query).fetchone()[0] != committed_id:
+                        raise DBError(f"Table {table} was changed during the import.")
+            for table, rows in self.rows.items():
+                if rows:
+                    db.c.executemany(SQL_INSERT[table], rows)
+                    self.stats["rows"] += len(rows)
+            # Recipes of the batch have consecutive ids
+            if self.recipe_ids:
+                search.index_new_recipes(db, self.recipe_ids[0], self.recipe_ids[-1])
+        self.committed_id = dict(self.next_id)
+        self.rows = {table: [] for table in SQL_INSERT}
+        self.recipe_ids = []
+        self.stats["batches"] += 1
+        self.stats["seconds"] = time.perf_counter() - self.started
+
+
+class ImportStats(dict):
+    """Statistics of an import_records() call:
+    records: number of records read.
+    inserted: number of entries inserted.
+    skipped: number of records skipped as entries with their names already exist.
+    errors: number of invalid records skipped.
+    rows: number of table rows inserted, including collections (e.g. recipe contents).
+    batches: number of committed transactions.
+    seconds: time the import has taken so far.
+    """
+    def __init__(self):
+        super().__init__(records=0, inserted=0, skipped=0, errors=0, rows=0, batches=0,
+                         seconds=0.0)
+
+    def rate(self):
+        """Return number of records imported per second"""
+        return self["records"] / self["seconds"] if self["seconds"] else 0.0
@@ -0,0 +1,176 @@
+"""Versioned schema migrations applied by DBHandler.migrate().
+
+The version of a DB schema is tracked in SQLite's 'user_version' PRAGMA: a DB at version N has
+had every migration up to and including N applied. A DB created by DBHandler.create_schema()
+starts at version 0 and is migrated right away.
+
+New migrations must be appended to MIGRATIONS with the next consecutive version number and never
+edited once released. Statements are either SQL strings or callables accepting a cursor.
+"""
+import sqlite3
+from collections import namedtuple
+
+Migration = namedtuple("Migration", "version description statements")
+
+def create_recipe_search(c):
+    """Create and populate the recipe_search FTS5 table. Skipped if SQLite lacks FTS5."""
+    try:
+        c.execute(
+            'CREATE VIRTUAL TABLE recipe_search USING fts5('
+            '  name, instructions, ingredients, prefix=\'2 3\''
+            ')'
+        )
+    except sqlite3.OperationalError as err:
+        if "fts5" in str(err):
+            return
+        raise
+    c.execute(
+        'INSERT INTO recipe_search (rowid, name, instructions, ingredients) '
+        '  SELECT id, name, instructions, '
+        '    (SELECT group_concat(ingredients.name, \' \') FROM recipe_contents '
+        '     JOIN ingredients ON recipe_contents.ingredient_id = ingredients.id '
+        '     WHERE recipe_contents.recipe_id = recipes.id) '
+        '  FROM recipes'
+    )
+
+
+MIGRATIONS = [
+    Migration(1, "Add reverse lookup indexes to the association tables", [
+        # Composite primary keys only cover lookups by their first column
+        'CREATE INDEX IF NOT EXISTS ingredient_allergies_ingredient_idx '
+        '  ON ingredient_allergies (ingredient_id, allergy_id)',
+        'CREATE INDEX IF NOT EXISTS recipe_contents_ingredient_idx '
+        '  ON recipe_contents (ingredient_id, recipe_id)',
+        'CREATE INDEX IF NOT EXISTS user_allergies_user_idx '
+        '  ON user_allergies (user_id, allergy_id)',
+        'CREATE INDEX IF NOT EXISTS user_meals_recipe_idx '
+        '  ON user_meals (recipe_id, user_id)',
+    ]),
+    Migration(2, "Add index on the ingredients' category foreign key", [
+        'CREATE INDEX IF NOT EXISTS ingredients_category_idx '
+        '  ON ingredients (category_id, id)',
+    ]),
+    Migration(3, "Add recipe_allergens table maintained by triggers", [
+        # (recipe_id, allergy_id) pairs where the recipe contains an ingredient causing the allergy
+        'CREATE TABLE recipe_allergens('
+        '  recipe_id INTEGER NOT NULL,'
+        '  allergy_id INTEGER NOT NULL,'
+        '  PRIMARY KEY (recipe_id, allergy_id),'
+        '  FOREIGN KEY (recipe_id) REFERENCES recipes(id),'
+        '  FOREIGN KEY (allergy_id) REFERENCES allergies(id)'
+        ') WITHOUT ROWID',
+        'CREATE INDEX recipe_allergens_allergy_idx ON recipe_allergens (allergy_id, recipe_id)',
+        'INSERT OR IGNORE INTO recipe_allergens (recipe_id, allergy_id) '
+        '  SELECT recipe_contents.recipe_id, ingredient_allergies.allergy_id '
+        '  FROM recipe_contents '
+        '  JOIN ingredient_allergies '
+        '    ON recipe_contents.ingredient_id = ingredient_allergies.ingredient_id',
+
+        # A pair is added when a content or an ingredient's allergy appears...
+        'CREATE TRIGGER recipe_allergens_contents_insert AFTER INSERT ON recipe_contents '
+        'BEGIN '
+        '  INSERT OR IGNORE INTO recipe_allergens (recipe_id, allergy_id) '
+        '    SELECT NEW.recipe_id, allergy_id FROM ingredient_allergies '
+        '    WHERE ingredient_id = NEW.ingredient_id; '
+        'END',
+        'CREATE TRIGGER recipe_allergens_allergies_insert AFTER INSERT ON ingredient_allergies '
+        'BEGIN '
+        '  INSERT OR IGNORE INTO recipe_allergens (recipe_id, allergy_id) '
+        '    SELECT recipe_id, NEW.allergy_id FROM recipe_contents '
+        '    WHERE ingredient_id = NEW.ingredient_id; '
+        'END',
+        # ...and removed when no other content of the recipe causes the allergy
+        'CREATE TRIGGER recipe_allergens_contents_delete AFTER DELETE ON recipe_contents '
+        'BEGIN '
+        '  DELETE FROM recipe_allergens '
+        '    WHERE recipe_id = OLD.recipe_id '
+        '      AND allergy_id IN (SELECT allergy_id FROM ingredient_allergies '
+        '                         WHERE ingredient_id = OLD.ingredient_id) '
+        '      AND NOT EXISTS (SELECT 1 FROM recipe_contents '
+        '                      JOIN ingredient_allergies '
+        '                        ON recipe_contents.ingredient_id = ingredient_allergies.ingredient_id '
+        '                      WHERE recipe_contents.recipe_id = OLD.recipe_id '
+        '                        AND ingredient_allergies.allergy_id = recipe_allergens.allergy_id); '
+        'END',
+        'CREATE TRIGGER recipe_allergens_allergies_delete AFTER DELETE ON ingredient_allergies '
+        'BEGIN '
+        '  DELETE FROM recipe_allergens '
+        '    WHERE allergy_id = OLD.allergy_id '
+        '      AND recipe_id IN (SELECT recipe_id FROM recipe_contents '
+        '                        WHERE ingredient_id = OLD.ingredient_id) '
+        '      AND NOT EXISTS (SELECT 1 FROM recipe_contents '
+        '                      JOIN ingredient_allergies '
+        '                        ON recipe_contents.ingredient_id = ingredient_allergies.ingredient_id '
+        '                      WHERE recipe_contents.recipe_id = recipe_allergens.recipe_id '
+        '                        AND ingredient_allergies.allergy_id = OLD.allergy_id); '
+        'END',
+        # Updates of the key columns are a deletion followed by an insertion
+        'CREATE TRIGGER recipe_allergens_contents_update '
+        '  AFTER UPDATE OF recipe_id, ingredient_id ON recipe_contents '
+        'BEGIN '
+        '  DELETE FROM recipe_allergens '
+        '    WHERE recipe_id = OLD.recipe_id '
+        '      AND allergy_id IN (SELECT allergy_id FROM ingredient_allergies '
+        '                         WHERE ingredient_id = OLD.ingredient_id) '
+        '      AND NOT EXISTS (SELECT 1 FROM recipe_contents '
+        '                      JOIN ingredient_allergies '
+        '                        ON recipe_contents.ingredient_id = ingredient_allergies.ingredient_id '
+        '                      WHERE recipe_contents.recipe_id = OLD.recipe_id '
+        '                        AND ingredient_allergies.allergy_id = recipe_allergens.allergy_id); '
+        '  INSERT OR IGNORE INTO recipe_allergens (recipe_id, allergy_id) '
+        '    SELECT NEW.recipe_id, allergy_id FROM ingredient_allergies '
+        '    WHERE ingredient_id = NEW.ingredient_id; '
+        'END',
+        'CREATE TRIGGER recipe_allergens_allergies_update '
+        '  AFTER UPDATE OF ingredient_id, allergy_id ON ingredient_allergies '
+        'BEGIN '
+        '  DELETE FROM recipe_allergens '
+        '    WHERE allergy_id = OLD.allergy_id '
+        '      AND recipe_id IN (SELECT recipe_id FROM recipe_contents '
+        '                        WHERE ingredient_id = OLD.ingredient_id) '
+        '      AND NOT EXISTS (SELECT 1 FROM recipe_contents '
+        '                      JOIN ingredient_allergies '
+        '                        ON recipe_contents.ingredient_id = ingredient_allergies.ingredient_id '
+        '                      WHERE recipe_contents.recipe_id = recipe_allergens.recipe_id '
+        '                        AND ingredient_allergies.allergy_id = OLD.allergy_id); '
+        '  INSERT OR IGNORE INTO recipe_allergens (recipe_id, allergy_id) '
+        '    SELECT recipe_id, NEW.allergy_id FROM recipe_contents '
+        '    WHERE ingredient_id = NEW.ingredient_id; '
+        'END',
+    ]),
+    Migration(4, "Add case insensitive name indexes for paginated summaries", [
+        # Summaries sorted by name are paginated by (name COLLATE NOCASE, id) keys
+        'CREATE INDEX allergies_name_nocase_idx ON allergies (name COLLATE NOCASE)',
+        'CREATE INDEX ingredient_categories_name_nocase_idx '
+        '  ON ingredient_categories (name COLLATE NOCASE)',
+        'CREATE INDEX ingredients_name_nocase_idx ON ingredients (name COLLATE NOCASE)',
+        'CREATE INDEX recipes_name_nocase_idx ON recipes (name COLLATE NOCASE)',
+        'CREATE INDEX users_name_nocase_idx ON users (name COLLATE NOCASE)',
+    ]),
+    Migration(5, "Add recipe_search full-text index if FTS5 is available", [
+        create_recipe_search,
+    ]),
+    Migration(6, "Add tables of the persistent JSON cache", [
+        # JSON of objects keyed by their table and id, see JSONCache
+        'CREATE TABLE json_cache('
+        '  obj_type TEXT NOT NULL,'
+        '  id INTEGER NOT NULL,'
+        '  data BLOB NOT NULL,'
+        '  PRIMARY KEY (obj_type, id)'
+        ') WITHOUT ROWID',
+        # Entries (dep_type, dep_id) that the graph of each cached object contains
+        'CREATE TABLE json_cache_deps('
+        '  dep_type TEXT NOT NULL,'
+        '  dep_id INTEGER NOT NULL,'
+        '  obj_type TEXT NOT NULL,'
+        '  id INTEGER NOT NULL,'
+        '  PRIMARY KEY (dep_type, dep_id, obj_type, id)'
+        ') WITHOUT ROWID',
+        'CREATE INDEX json_cache_deps_entry_idx ON json_cache_deps (obj_type, id)',
+    ]),
+]
+
+
+def latest_version():
+    """Return schema version a DB has after applying all migrations"""
+    return MIGRATIONS[-1].version if MIGRATIONS else 0
@@ -0,0 +1,154 @@
+"""Full-text search of recipes.
+
+Recipes are indexed in the 'recipe_search' FTS5 table created by migration 5: one row per recipe
+with the recipe id as rowid and its name, instructions and names of its ingredients as columns.
+The table is kept in sync by Recipe and Ingredient when they are written to or removed from
+the DB. SQLite builds without FTS5 skip the migration; search then falls back to plain
+substring matching of names and instructions without ranking.
+"""
+import html
+import re
+
+from backend.DBEntry import escape_like
+
+SEARCH_TABLE = "recipe_search"
+# bm25() weights of the name, instructions and ingredients columns
+RANK_WEIGHTS = (10.0, 1.0, 4.0)
+SNIPPET_TOKENS = 16 # max number of tokens in a snippet of instructions
+
+# Matches are marked by control characters, which can't appear in the escaped HTML
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+_QUERY_TOKEN = re.compile(r"\w+")
+
+SQL_DELETE = f'DELETE FROM {SEARCH_TABLE} WHERE rowid = ?'
+SQL_INSERT = (
+    f'INSERT INTO {SEARCH_TABLE} (rowid, name, instructions, ingredients) '
+    '  SELECT id, name, instructions, '
+    '    (SELECT group_concat(ingredients.name, \' \') FROM recipe_contents '
+    '     JOIN ingredients ON recipe_contents.ingredient_id = ingredients.id '
+    '     WHERE recipe_contents.recipe_id = recipes.id) '
+    '  FROM recipes WHERE id = ?'
+)
+SQL_SEARCH = (
+    'SELECT rowid AS id, '
+    f'  highlight({SEARCH_TABLE}, 0, ?, ?) AS name, '
+    f'  snippet({SEARCH_TABLE}, 1, ?, ?, \'...\', {SNIPPET_TOKENS}) AS snippet, '
+    f'  bm25({SEARCH_TABLE}, {", ".join(map(str, RANK_WEIGHTS))}) AS rank '
+    f'FROM {SEARCH_TABLE} '
+    f'WHERE {SEARCH_TABLE} MATCH ? '
+    'ORDER BY rank'
+)
+SQL_SEARCH_FALLBACK = (
+    'SELECT id, name, NULL AS snippet, NULL AS rank FROM recipes '
+    'WHERE name LIKE ? ESCAPE \'\\\' OR instructions LIKE ? ESCAPE \'\\\' '
+    'ORDER BY name COLLATE NOCASE, id'
+)
+
+
+def is_available(db):
+    """Return True if the DB has the full-text search table"""
+    query = 'SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = ?'
+    return bool(db.c.execute(query, (SEARCH_TABLE,)).fetchone())
+
+
+def index_recipes(db, recipe_ids):
+    """(Re)index recipes in the search table. Recipes missing in DB are removed from it.
+    Does not commit.
+    """
+    if not is_available(db):
+        return
+    needles = [(id,) for id in recipe_ids]
+    db.c.executemany(SQL_DELETE, needles)
+    db.c.executemany(SQL_INSERT, needles)
+
+
+def index_new_recipes(db, first_id, last_id):
+    """Index recipes with ids from first_id to last_id inclusive, which are not indexed yet, e.g.
+    just inserted in bulk. Cheaper than index_recipes(), which deletes stale entries first.
+    Does not commit.
+    """
+    if is_available(db):
+        db.c.execute(SQL_INSERT.replace('WHERE id = ?', 'WHERE id BETWEEN ? AND ?'),
+                     (first_id, last_id))
+
+
+def rebuild_index(db):
+    """Reindex all recipes, e.g. after they were inserted bypassing Recipe. Does not commit."""
+    if is_available(db):
+        db.c.execute(f'DELETE FROM {SEARCH_TABLE}')
+        db.c.execute(SQL_INSERT.replace('WHERE id = ?', ''))
+
+
+def unindex_recipes(db, recipe_ids):
+    """Remove recipes from the search table. Does not commit."""
+    if is_available(db):
+        db.c.executemany(SQL_DELETE, [(id,) for id in recipe_ids])
+
+
+def index_ingredient_recipes(db, ingredient_id):
+    """Reindex recipes containing the ingredient. Does not commit."""
+    rows = db.c.execute('SELECT recipe_id FROM recipe_contents WHERE ingredient_id = ?',
+                        (ingredient_id,)).fetchall()
+    index_recipes(db, [row["recipe_id"] for row in rows])
+
+
+def to_match_query(text):
+    """Return FTS5 query matching documents containing words starting with each of the words of
+    the text, so that incomplete input finds results. Returns None if the text has no words.
+    """
+    tokens = _QUERY_TOKEN.findall(text)
+    if not tokens:
+        return None
+    # Quoted strings are matched literally, so FTS5 operators in the text have no effect
+    return " ".join('"{}"*'.format(t) for t in tokens)
+
+
+def search(db, text, limit=20, offset=0, valid_ids=None):
+    """Return list of recipes matching the text, most relevant first, as dictionaries:
+    id: recipe id.
+    name: HTML-escaped recipe name with matches wrapped in <mark> tags.
+    snippet: HTML-escaped fragment of instructions with matches wrapped in <mark> tags or None.
+    rank: bm25 rank, lower is more relevant. None if full-text search is unavailable.
+
+    :param text: A string. Words to search for in names, instructions and ingredients.
+    :param limit: An integer. Max number of recipes.
+    :param offset: An integer. Number of the most relevant recipes to skip.
+    :param valid_ids: A set-like object. If given, only recipes with ids in it are returned.
+    """
+    if not text.strip():
+        return []
+    if is_available(db):
+        query = to_match_query(text)
+        if not query:
+            return []
+        params = (_MATCH_START, _MATCH_END, _MATCH_START, _MATCH_END, query)
+        cursor = db.conn.cursor().execute(SQL_SEARCH, params)
+    else:
+        pattern = "%{}%".format(escape_like(text.strip()))
+        cursor = db.conn.cursor().execute(SQL_SEARCH_FALLBACK, (pattern, pattern))
+
+    # Rows are streamed, so that filtering stops as soon as the page is full
+    results = []
+    skipped = 0
+    for row in cursor:
+        if valid_ids is not None and row["id"] not in valid_ids:
+            continue
+        if skipped < offset:
+            skipped += 1
+            continue
+        results.append({
+            "id": row["id"],
+            "name": to_html(row["name"]),
+            "snippet": to_html(row["snippet"]) if row["snippet"] else None,
+            "rank": row["rank"],
+        })
+        if len(results) == limit:
+            break
+    cursor.close()
+    return results
+
+
+def to_html(s):
+    """Return HTML-escaped string with match markers replaced by <mark> tags"""
+    return html.escape(s).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
@@ -0,0 +1,133 @@
+"""Benchmark of response compression: bytes and latency saved per route.
+
+Every route of bench_scale and every static script and stylesheet is requested through the
+Flask test client logged in as the admin, once without Accept-Encoding and once per supported
+content coding. For each, the size of the response body and the median server time are reported,
+along with the time the body takes to transfer at the given bandwidth, and the latency saved
+(server time plus transfer time) compared to the uncompressed response. Static files are
+compressed ahead of time, so they are only served compressed after running compress_static.py.
+
+The benchmark logs in as the admin of a DB generated by benchmarks.generate_db, so it doesn't
+run on the app's own DB. Unless db_path is given, the DB of the preset size is generated (once,
+it is kept in the data folder, shared with bench_scale) and used.
+
+Usage (from the app's root folder):
+    $ python -m benchmarks.bench_compression [--size small] [--bandwidth 10] [--output report.json]
+    $ python -m benchmarks.bench_compression path/to/generated.db [--bandwidth 10]
+"""
+import argparse
+import itertools
+import json
+import os
+import statistics
+import sys
+
+from benchmarks import generate_db
+from benchmarks.bench_scale import (DEFAULT_BUDGET, DEFAULT_DATA_DIR, DEFAULT_REPEAT, ROUTES,
+                                    SAMPLE_SIZE, measure, sample_ids)
+
+DEFAULT_BANDWIDTH = 10.0 # Mbit/s, e.g. a mobile connection
+
+
+def static_routes(static_folder):
+    """Return list of URLs of the static scripts and stylesheets"""
+    routes = []
+    for root, _, files in os.walk(static_folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1] in (".css", ".js"):
+                path = os.path.relpath(os.path.join(root, name), static_folder)
+                routes.append("/static/" + path.replace(os.sep, "/"))
+    return routes
+
+
+def bench_route(client, route, ids, encodings, args):
+    """Return list of results of the route, one per content coding. Each content coding is
+    measured on the same sequence of ids.
+
+    :param ids: A dictionary of lists of ids keyed by the names of the route's placeholders.
+    """
+    results = []
+    for encoding in encodings:
+        cycles = {name: itertools.cycle(values) for name, values in ids.items()}
+        headers = {"Accept-Encoding": encoding} if encoding != "identity" else {}
+        sizes = []
+        served = set()
+        statuses = set()
+        def get():
+            url = route.format(**{name: next(it) for name, it in cycles.items()})
+            response = client.get(url, headers=headers)
+            sizes.append(len(response.get_data()))
+            served.add(response.headers.get("Content-Encoding", "identity"))
+            statuses.add(response.status_code)
+            response.close()
+        result = dict(name="GET " + route, encoding=encoding,
+                      **measure(get, args.repeat, args.budget))
+        # Responses smaller than the threshold are served uncompressed
+        result["served"] = sorted(served)
+        result["statuses"] = sorted(statuses)
+        result["bytes"] = int(statistics.median(sizes))
+        result["transfer_ms"] = result["bytes"] * 8 / (args.bandwidth * 1e6) * 1e3
+        baseline = results[0] if results else result
+        result["bytes_saved"] = baseline["bytes"] - result["bytes"]
+        result["ms_saved"] = (baseline["median_ms"] + baseline["transfer_ms"]
+                              - result["median_ms"] - result["transfer_ms"])
+        results.append(result)
+        print("  {:<56}{:>15}{:>12,}{:>10.2f}{:>10.2f}{:>12,}{:>10.2f}".format(
+            result["name"][:55], "/".join(result["served"]), result["bytes"], result["median_ms"],
+            result["transfer_ms"], result["bytes_saved"], result["ms_saved"]), file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", nargs="?",
+                        help="DB generated by benchmarks.generate_db (default: one of --size)")
+    parser.add_argument("--size", choices=generate_db.SIZES, default="small")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                        help="folder the generated DBs are kept in")
+    parser.add_argument("--seed", type=int, default=generate_db.DEFAULT_SEED)
+    parser.add_argument("--bandwidth", type=float, default=DEFAULT_BANDWIDTH,
+                        help="Mbit/s the transfer time is estimated at (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET)
+    parser.add_argument("--output", help="path of the JSON report")
+    args = parser.parse_args()
+
+    db_path = args.db_path
+    if not db_path:
+        db_path = os.path.join(args.data_dir, "{}-{}.db".format(args.size, args.seed))
+        if not os.path.exists(db_path):
+            os.makedirs(args.data_dir, exist_ok=True)
+            print("Generating {}...".format(db_path), file=sys.stderr)
+            generate_db.generate(db_path, seed=args.seed, **generate_db.SIZES[args.size])
+
+    # The app opens its DB on import
+    os.environ["FOOD_DB_PATH"] = db_path
+    from application import app, db
+    import compression
+
+    client = app.test_client()
+    response = client.post("/login", data={"username": generate_db.ADMIN,
+                                           "password": "password"})
+    if response.status_code != 302:
+        raise RuntimeError("Could not log in as '{}', is {} generated by "
+                           "benchmarks.generate_db?".format(generate_db.ADMIN, db_path))
+    ids = {name: list(itertools.islice(sample_ids(db, table), SAMPLE_SIZE))
+           for name, table in (("recipe_id", "recipes"), ("user_id", "users"))}
+    db.release()
+
+    encodings = ("identity",) + compression.ENCODINGS
+    print("  {:<56}{:>15}{:>12}{:>10}{:>10}{:>12}{:>10}".format(
+        "route", "served", "bytes", "server ms", "xfer ms", "bytes saved", "ms saved"),
+        file=sys.stderr)
+    results = []
+    for route in ROUTES + static_routes(app.static_folder):
+        results += bench_route(client, route, ids, encodings, args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"bandwidth_mbps": args.bandwidth, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Micro-benchmark of encoding Recipe and User object graphs as JSON.
+
+Compares the former toJSONifiable(), which walked the attributes of every object and checked
+each for name mangling, with the per-class serializers compiled from json_fields, both with the
+standard json module (indented as the app used to and compact) and with orjson if installed.
+Graphs are fully loaded before timing, so only the encoding is measured.
+
+Usage (from the app's root folder):
+    $ python -m benchmarks.bench_json [db_path] [--recipes N] [--number N] [--repeat N]
+"""
+import argparse
+import inspect
+import timeit
+
+from backend.DBHandler import DBHandler, DEFAULT_DB_PATH
+from backend.DBEntry import DBEntry, FoodEncoder, orjson
+from backend.Recipe import Recipe
+from backend.User import User
+
+
+def is_mangled(attr_name, classinfo):
+    for c in inspect.getmro(classinfo):
+        if attr_name.startswith("_" + c.__name__ + "__"):
+            return True
+    return False
+
+
+class LegacyEncoder(FoodEncoder):
+    """Reproduces the former encoding of DBEntry objects from their attributes"""
+    def default(self, obj): # pylint: disable=E0202
+        if isinstance(obj, DBEntry):
+            dct = {x.lstrip("_"): y for x, y in vars(obj).items()
+                   if not is_mangled(x, obj.__class__)}
+            dct.pop("db", None)
+            if isinstance(obj, Recipe):
+                dct["contents"] = [item._asdict() for item in obj.contents]
+            return dct
+        return super().default(obj)
+
+
+def encoders():
+    """Return list of (name, encode function) pairs of the compared encoders"""
+    result = [
+        ("legacy, indent=2", LegacyEncoder(indent=2, use_orjson=False).encode),
+        ("compiled, indent=2", FoodEncoder(indent=2, use_orjson=False).encode),
+        ("compiled, compact", FoodEncoder(separators=(",", ":"), use_orjson=False).encode),
+    ]
+    if orjson:
+        result += [
+            ("orjson, indent=2", FoodEncoder(indent=2).encode_bytes),
+            ("orjson, compact", FoodEncoder().encode_bytes),
+        ]
+    return result
+
+
+def load_graphs(db, n_recipes):
+    """Return list of (name, object) pairs of fully loaded graphs to encode"""
+    recipe_ids = [row["id"] for row in db.c.execute('SELECT id FROM recipes ORDER BY id LIMIT ?',
+                                                    (n_recipes,))]
+    recipes = list(Recipe.from_db_many(db, recipe_ids).values())
+    row = db.c.execute('SELECT user_id FROM user_meals GROUP BY user_id '
+                       'ORDER BY count(*) DESC LIMIT 1').fetchone()
+    graphs = [("recipe", recipes[0]), (f"{len(recipes)} recipes", recipes)] if recipes else []
+    if row:
+        user = User.from_db(db, row["user_id"])
+        graphs.append((f"user, {len(user.meals)} meals", user))
+    # Loading lazy collections along the way
+    for _, obj in graphs:
+        FoodEncoder(use_orjson=False).encode(obj)
+    return graphs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", nargs="?", default=DEFAULT_DB_PATH)
+    parser.add_argument("--recipes", type=int, default=100, help="size of the recipe list graph")
+    parser.add_argument("--number", type=int, default=10, help="encodings per timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    db = DBHandler(args.db_path)
+    graphs = load_graphs(db, args.recipes)
+
+    print("{:<20}{:<20}{:>12}{:>12}{:>10}".format("graph", "encoder", "time, us", "bytes",
+                                                  "speedup"))
+    for graph_name, obj in graphs:
+        baseline = None
+        for encoder_name, encode in encoders():
+            best = min(timeit.repeat(lambda: encode(obj), number=args.number, repeat=args.repeat))
+            us = best / args.number * 1e6
+            baseline = baseline or us
+            output = encode(obj)
+            size = len(output.encode() if isinstance(output, str) else output)
+            print("{:<20}{:<20}{:>12.1f}{:>12}{:>9.2f}x".format(
+                graph_name, encoder_name, us, size, baseline / us))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Micro-benchmark of loading single DBEntry objects from DB.
+
+Compares per-object cost of the legacy two round trip lookup (exists check followed by a SELECT
+with the query text rebuilt on every call) with the single cached statement used by
+DBEntry.get_db_attrs(), and reports the cost of a full from_db() for each DBEntry subclass.
+Entity caching is disabled so every load hits the DB.
+
+Usage (from the app's root folder):
+    $ python -m benchmarks.bench_load [db_path] [--repeat N]
+"""
+import argparse
+import timeit
+
+from backend.DBHandler import DBHandler, DEFAULT_DB_PATH, to_db_obj_name
+from backend.Allergy import Allergy
+from backend.IngredientCategory import IngredientCategory
+from backend.Ingredient import Ingredient
+from backend.Recipe import Recipe
+from backend.User import User
+
+CLASSES = [Allergy, IngredientCategory, Ingredient, Recipe, User]
+
+
+def legacy_get_db_attrs(cls, db, id):
+    """Reproduces the former lookup: a count(*) existence query and a SELECT, both built anew"""
+    objects = [to_db_obj_name(cls.table_main), to_db_obj_name("id")]
+    query = 'SELECT count(*) FROM "{}" WHERE "{}" = ?'
+    if not db.c.execute(query.format(*objects), (id,)).fetchone()[0]:
+        return None
+
+    table_main = to_db_obj_name(cls.table_main)
+    row = db.c.execute(f'SELECT * FROM "{table_main}" WHERE id = ?', (id,)).fetchone()
+    return {x: y for x, y in zip(row.keys(), row)}
+
+
+def per_call_us(func, ids, repeat):
+    """Return best average time of a func(id) call in microseconds"""
+    def run():
+        for id in ids:
+            func(id)
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    return best / len(ids) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path", nargs="?", default=DEFAULT_DB_PATH)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    db = DBHandler(args.db_path)
+
+    print("{:<20}{:>8}{:>16}{:>16}{:>10}{:>16}".format(
+        "class", "rows", "legacy, us", "single, us", "speedup", "from_db, us"))
+    for cls in CLASSES:
+        ids = [row["id"] for row in db.get_rows(cls.table_main)][:1000]
+        if not ids:
+            continue
+        legacy = per_call_us(lambda id: legacy_get_db_attrs(cls, db, id), ids, args.repeat)
+        single = per_call_us(lambda id: cls.get_db_attrs(db, id), ids, args.repeat)
+        full = per_call_us(lambda id: cls.from_db_attrs(db, [cls.get_db_attrs(db, id)]), ids,
+                           args.repeat)
+        print("{:<20}{:>8}{:>16.1f}{:>16.1f}{:>9.2f}x{:>16.1f}".format(
+            cls.__name__, len(ids), legacy, single, legacy / single, full))
+
+
+if __name__ == "__main__":
+    main()
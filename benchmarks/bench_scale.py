@@ -0,0 +1,218 @@
+"""Scaling benchmark of model methods and Flask routes on synthetic DBs.
+
+For each preset size a DB is generated by benchmarks.generate_db (once, it is kept in the data
+folder for later runs) and benchmarked in a separate process, so that caches don't carry over
+between sizes. Model methods are timed on a handler without the shared entity cache, routes
+through the Flask test client logged in as the admin, with the app configured as in production.
+
+Each benchmark is run 'repeat' times or until it has taken 'budget' seconds, but at least once.
+Benchmarks of lookups by id cycle through a random sample of ids.
+
+Usage (from the app's root folder):
+    $ python -m benchmarks.bench_scale [--sizes small medium] [--output report.json]
+    $ python -m benchmarks.bench_scale --db path/to/food.db [--output report.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import generate_db
+
+DEFAULT_DATA_DIR = os.path.join("benchmarks", "data")
+DEFAULT_REPEAT = 20
+DEFAULT_BUDGET = 10.0 # seconds
+SAMPLE_SIZE = 100 # number of ids cycled through by lookup benchmarks
+TABLES = ["allergies", "ingredient_categories", "ingredients", "recipes", "users", "user_meals"]
+
+ROUTES = [
+    "/",
+    "/admin/allergies",
+    "/admin/ingredient_categories",
+    "/admin/ingredients",
+    "/admin/recipes",
+    "/admin/users",
+    "/json?obj_type=recipe&id={recipe_id}",
+    "/json?obj_type=user&id={user_id}",
+    "/json?obj_type=valid_meals&id={user_id}",
+    "/json/batch?objects=recipe:{recipe_id},recipe:1,recipe:2,recipe:3,recipe:4,ingredient:1",
+    "/suggest?n=5",
+    "/search?q=simmer&valid=1",
+    "/api/recipes/by_ingredients?ingredients=1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20",
+]
+
+
+def measure(func, repeat, budget):
+    """Call func() up to repeat times or until budget seconds have passed, but at least once.
+    Return dictionary of the number of runs and their min, median and max times in ms.
+    """
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat and (not times or time.perf_counter() - start < budget):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+    return {
+        "runs": len(times),
+        "min_ms": min(times) * 1e3,
+        "median_ms": statistics.median(times) * 1e3,
+        "max_ms": max(times) * 1e3,
+    }
+
+
+def sample_ids(db, table):
+    """Return itertools.cycle over a reproducible random sample of ids of the table"""
+    ids = [row[0] for row in db.c.execute('SELECT id FROM {}'.format(table))]
+    return itertools.cycle(random.Random(0).sample(ids, min(SAMPLE_SIZE, len(ids))))
+
+
+def bench_models(db_path, repeat, budget):
+    """Return list of results of model method benchmarks"""
+    from backend.DBHandler import DBHandler
+    from backend.Allergy import Allergy
+    from backend.IngredientCategory import IngredientCategory
+    from backend.Ingredient import Ingredient
+    from backend.Recipe import Recipe
+    from backend.User import User
+    from backend.MealSuggester import MealSuggester
+
+    db = DBHandler(db_path)
+    recipe_ids = sample_ids(db, "recipes")
+    user_ids = sample_ids(db, "users")
+    users = [User.from_db(db, id=next(user_ids)) for _ in range(SAMPLE_SIZE)]
+    users = itertools.cycle([user for user in users if user])
+    suggester = MealSuggester(db)
+    # Ingredients at home for PantryIndex.rank
+    pantry = list(itertools.islice(sample_ids(db, "ingredients"), 20))
+
+    benchmarks = [(cls.__name__ + ".get_summary", lambda cls=cls: cls.get_summary(db))
+                  for cls in (Allergy, IngredientCategory, Ingredient, Recipe, User)]
+    benchmarks += [
+        ("Recipe.from_db", lambda: Recipe.from_db(db, id=next(recipe_ids))),
+        ("User.from_db", lambda: User.from_db(db, id=next(user_ids))),
+        ("AllergenIndex.refresh", db.allergen_index.refresh),
+        ("User.get_valid_recipes_id", lambda: next(users).get_valid_recipes_id()),
+        ("Recipe.get_valid_ids",
+         lambda: Recipe.get_valid_ids(db, next(users).allergy_ids)),
+        ("MealSuggester.suggest", lambda: suggester.suggest(next(users), 5)),
+        ("PantryIndex.refresh", db.pantry_index.refresh),
+        ("PantryIndex.rank", lambda: db.pantry_index.rank(
+            pantry, 20, next(users).get_valid_recipes_id())),
+    ]
+
+    results = []
+    for name, func in benchmarks:
+        results.append(dict(name=name, kind="model", **measure(func, repeat, budget)))
+        report_progress(results[-1])
+    db.close()
+    return results
+
+
+def bench_routes(db_path, repeat, budget):
+    """Return list of results of Flask route benchmarks"""
+    # The app opens its DB on import
+    os.environ["FOOD_DB_PATH"] = db_path
+    from application import app, db
+
+    client = app.test_client()
+    response = client.post("/login", data={"username": generate_db.ADMIN,
+                                           "password": "password"})
+    if response.status_code != 302:
+        raise RuntimeError("Could not log in as '{}'".format(generate_db.ADMIN))
+    ids = {"recipe_id": sample_ids(db, "recipes"), "user_id": sample_ids(db, "users")}
+    db.release()
+
+    results = []
+    for route in ROUTES:
+        statuses = set()
+        def get():
+            url = route.format(**{name: next(it) for name, it in ids.items()})
+            statuses.add(client.get(url).status_code)
+        result = dict(name="GET " + route, kind="route", **measure(get, repeat, budget))
+        result["statuses"] = sorted(statuses)
+        results.append(result)
+        report_progress(result)
+    return results
+
+
+def report_progress(result):
+    print("  {:<48}{:>6}{:>14.2f}{:>14.2f}".format(
+        result["name"], result["runs"], result["min_ms"], result["median_ms"]), file=sys.stderr)
+
+
+def bench_db(db_path, repeat, budget):
+    """Run all benchmarks on the DB. Return dictionary of the DB's row counts and results"""
+    conn = sqlite3.connect(db_path)
+    counts = {table: conn.execute('SELECT count(*) FROM {}'.format(table)).fetchone()[0]
+              for table in TABLES}
+    conn.close()
+
+    print("{} {}".format(db_path, counts), file=sys.stderr)
+    print("  {:<48}{:>6}{:>14}{:>14}".format("benchmark", "runs", "min, ms", "median, ms"),
+          file=sys.stderr)
+    results = bench_models(db_path, repeat, budget) + bench_routes(db_path, repeat, budget)
+    return {"db": db_path, "counts": counts, "results": results}
+
+
+def bench_size(size, args):
+    """Generate the DB of the preset size if missing and benchmark it in a child process"""
+    db_path = os.path.join(args.data_dir, "{}-{}.db".format(size, args.seed))
+    if not os.path.exists(db_path):
+        os.makedirs(args.data_dir, exist_ok=True)
+        print("Generating {}...".format(db_path), file=sys.stderr)
+        generate_db.generate(db_path, seed=args.seed, **generate_db.SIZES[size])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "report.json")
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_scale", "--db", db_path,
+                        "--repeat", str(args.repeat), "--budget", str(args.budget),
+                        "--output", output], check=True)
+        with open(output) as f:
+            run = json.load(f)["runs"][0]
+    run["size"] = size
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", choices=generate_db.SIZES, default=["small"])
+    parser.add_argument("--db", help="benchmark an existing DB instead of the preset sizes")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+                        help="folder the generated DBs are kept in")
+    parser.add_argument("--seed", type=int, default=generate_db.DEFAULT_SEED)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET)
+    parser.add_argument("--output", help="path of the JSON report")
+    args = parser.parse_args()
+
+    if args.db:
+        runs = [bench_db(args.db, args.repeat, args.budget)]
+    else:
+        runs = [bench_size(size, args) for size in args.sizes]
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "budget": args.budget,
+        },
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Generator of synthetic DBs for benchmarks.
+
+Builds a DB with the app's schema (all migrations applied) filled with random but reproducible
+data: the same size and seed always produce the same entries. User 1 is the admin "admin", the
+rest are "user1", "user2", ... All users have the password "password".
+
+Usage (from the app's root folder):
+    $ python -m benchmarks.generate_db path/to/new.db [--size small|medium|large] [--seed N]
+    $ python -m benchmarks.generate_db path/to/new.db --recipes 5000 --users 20000
+"""
+import argparse
+import os
+import random
+import time
+
+from backend import search
+from backend.DBHandler import DBHandler
+
+# Number of entries of each kind for the preset sizes
+SIZES = {
+    "small" : {"allergies": 14, "categories": 20, "ingredients": 1000,
+               "recipes": 1000, "users": 1000},
+    "medium": {"allergies": 24, "categories": 30, "ingredients": 5000,
+               "recipes": 10000, "users": 100000},
+    "large" : {"allergies": 32, "categories": 40, "ingredients": 10000,
+               "recipes": 100000, "users": 1000000},
+}
+DEFAULT_SIZE = "small"
+DEFAULT_SEED = 0
+
+# Ranges (inclusive) of the number of associations per entry
+CONTENTS_PER_RECIPE = (3, 15)
+ALLERGIES_PER_INGREDIENT = (0, 2)
+ALLERGIES_PER_USER = (0, 3)
+MEALS_PER_USER = (0, 10)
+# Share of ingredients causing no allergy regardless of ALLERGIES_PER_INGREDIENT
+SAFE_INGREDIENTS = 0.7
+INSTRUCTION_WORDS = (20, 200)
+
+# Hash of "password" generated by werkzeug's generate_password_hash(). A constant keeps the
+# generated DBs identical and saves hashing it for every user.
+PASSWORD_HASH = ("pbkdf2:sha256:150000$EuL9oXjA$"
+                 "aa643b766fa8afe35da5e55280d9369546d6999aad4cfc7dc8cbe56d74abd48b")
+ADMIN = "admin"
+
+UNITS = ["", "g", "kg", "ml", "l", "cup", "cups", "tsp", "Tbsp", "oz", "lb", "clove", "handful"]
+WORDS = ("add boil bowl chop cook cover cut dice drain fry heat medium mix oven pan pepper pot "
+         "preheat salt season serve simmer slice stir taste the then to until warm with").split()
+
+BATCH_SIZE = 10000 # rows passed to a single executemany() call
+
+
+def generate(db_path, allergies, categories, ingredients, recipes, users, seed=DEFAULT_SEED):
+    """Create a new DB at db_path and fill it with synthetic entries. Return dictionary of the
+    number of rows inserted into each table.
+
+    :param db_path: A string. Path to the new DB. The file must not exist.
+    :param allergies: An integer. Number of allergies.
+    :param categories: An integer. Number of ingredient categories.
+    :param ingredients: An integer. Number of ingredients.
+    :param recipes: An integer. Number of recipes.
+    :param users: An integer. Number of users including the admin.
+    :param seed: An integer. Seed of the random generator.
+    """
+    if os.path.exists(db_path):
+        raise FileExistsError("{} already exists".format(db_path))
+
+    rnd = random.Random(seed)
+    # Durability is of no concern while the DB is being generated
+    db = DBHandler(db_path, pragmas={"journal_mode": "MEMORY", "synchronous": "OFF"})
+    db.create_schema()
+    counts = {}
+
+    def insert(table, columns, rows):
+        query = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            table, ", ".join(columns), ", ".join("?" * len(columns)))
+        counts[table] = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                db.c.executemany(query, batch)
+                counts[table] += len(batch)
+                batch = []
+        db.c.executemany(query, batch)
+        counts[table] += len(batch)
+
+    def sample(population, bounds):
+        return rnd.sample(population, min(rnd.randint(*bounds), len(population)))
+
+    allergy_ids = list(range(1, allergies + 1))
+    ingredient_ids = list(range(1, ingredients + 1))
+    recipe_ids = list(range(1, recipes + 1))
+
+    insert("allergies", ("id", "name"),
+           ((id, "allergy{}".format(id)) for id in allergy_ids))
+    insert("ingredient_categories", ("id", "name"),
+           ((id, "category{}".format(id)) for id in range(1, categories + 1)))
+    insert("ingredients", ("id", "name", "category_id"),
+           ((id, "ingredient{}".format(id), rnd.randint(1, categories)) for id in ingredient_ids))
+    insert("ingredient_allergies", ("ingredient_id", "allergy_id"),
+           ((id, allergy_id) for id in ingredient_ids if rnd.random() >= SAFE_INGREDIENTS
+            for allergy_id in sample(allergy_ids, ALLERGIES_PER_INGREDIENT)))
+
+    insert("recipes", ("id", "name", "instructions"),
+           ((id, "recipe{}".format(id),
+             " ".join(rnd.choices(WORDS, k=rnd.randint(*INSTRUCTION_WORDS)))) for id in recipe_ids))
+    insert("recipe_contents", ("recipe_id", "ingredient_id", "amount", "units"),
+           ((id, ingredient_id, rnd.randint(1, 500), rnd.choice(UNITS)) for id in recipe_ids
+            for ingredient_id in sample(ingredient_ids, CONTENTS_PER_RECIPE)))
+
+    user_ids = range(1, users + 1)
+    insert("users", ("id", "name", "password_hash", "is_admin"),
+           ((id, ADMIN if id == 1 else "user{}".format(id - 1), PASSWORD_HASH, int(id == 1))
+            for id in user_ids))
+    insert("user_allergies", ("user_id", "allergy_id"),
+           ((id, allergy_id) for id in user_ids
+            for allergy_id in sample(allergy_ids, ALLERGIES_PER_USER)))
+    insert("user_meals", ("user_id", "recipe_id"),
+           ((id, recipe_id) for id in user_ids
+            for recipe_id in sample(recipe_ids, MEALS_PER_USER)))
+
+    search.rebuild_index(db)
+    db.conn.commit()
+    db.c.execute("ANALYZE;")
+    db.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path")
+    parser.add_argument("--size", choices=SIZES, default=DEFAULT_SIZE,
+                        help="preset number of entries, overridden by the options below")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    for name in SIZES[DEFAULT_SIZE]:
+        parser.add_argument("--" + name, type=int)
+    args = parser.parse_args()
+
+    sizes = dict(SIZES[args.size])
+    sizes.update({name: getattr(args, name) for name in sizes if getattr(args, name) is not None})
+
+    start = time.perf_counter()
+    try:
+        counts = generate(args.db_path, seed=args.seed, **sizes)
+    except FileExistsError as err:
+        print("{}. Operation aborted.".format(err))
+        return
+    for table, count in counts.items():
+        print("{:<24}{:>10}".format(table, count))
+    print("DB generated in {:.1f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Import or export the recipe catalog (allergies, categories, ingredients, recipes) of the DB.
+
+Usage:
+    python3 catalog_db.py export catalog.ndjson
+    python3 catalog_db.py import catalog.csv --batch-size 20000
+The format is guessed from the file extension unless --format is given; "-" stands for
+stdin/stdout. See backend/catalog.py for the record layout.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+from backend import catalog
+from backend.DBHandler import DBHandler, DBError, DEFAULT_DB_PATH
+
+MAX_REPORTED_ERRORS = 20
+
+
+def open_stream(path, mode):
+    if path == "-":
+        # Standard streams must stay open after the with block
+        return contextlib.nullcontext(sys.stdin if mode == "r" else sys.stdout)
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def guess_format(path):
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def report(stats):
+    print("{records:,} records ({inserted:,} inserted, {skipped:,} skipped, {errors:,} invalid), "
+          "{rows:,} rows in {seconds:.1f}s: ".format(**stats)
+          + "{:,.0f} records/s".format(stats.rate()), file=sys.stderr)
+
+
+def run_import(db, args):
+    errors = []
+    def on_error(record, err):
+        errors.append(err)
+        if len(errors) <= MAX_REPORTED_ERRORS:
+            print(f"Skipped: {err}", file=sys.stderr)
+
+    with open_stream(args.path, "r") as f:
+        records = catalog.read_records(f, args.format or guess_format(args.path))
+        stats = catalog.import_records(db, records, batch_size=args.batch_size,
+                                       on_error=None if args.strict else on_error,
+                                       progress=report if args.verbose else None)
+    if len(errors) > MAX_REPORTED_ERRORS:
+        print(f"... and {len(errors) - MAX_REPORTED_ERRORS} more invalid records.", file=sys.stderr)
+    report(stats)
+
+
+def run_export(db, args):
+    started = time.perf_counter()
+    with open_stream(args.path, "w") as f:
+        count = catalog.write_records(catalog.iter_records(db, args.kinds), f,
+                                      args.format or guess_format(args.path))
+    seconds = time.perf_counter() - started
+    print(f"{count:,} records exported in {seconds:.1f}s: "
+          f"{count / seconds if seconds else 0:,.0f} records/s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("path", help='catalog file, "-" for stdin/stdout')
+    parser.add_argument("--format", choices=catalog.FORMATS,
+                        help="default: csv for .csv files, ndjson otherwise")
+    parser.add_argument("--db", default=os.environ.get("FOOD_DB_PATH", DEFAULT_DB_PATH),
+                        help="path to the DB (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=catalog.BATCH_SIZE,
+                        help="records inserted per transaction (default: %(default)s)")
+    parser.add_argument("--kinds", nargs="+", choices=catalog.KINDS, default=catalog.KINDS,
+                        help="kinds of entries to export (default: all)")
+    parser.add_argument("--strict", action="store_true",
+                        help="abort the import on the first invalid record")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="report progress after every batch")
+    args = parser.parse_args()
+
+    db = DBHandler(args.db)
+    try:
+        if args.command == "import":
+            run_import(db, args)
+        else:
+            run_export(db, args)
+    except (catalog.CatalogError, DBError) as err:
+        print(f"{err} Operation aborted.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
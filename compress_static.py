@@ -0,0 +1,62 @@
+"""Compress the app's static text files (scripts, styles) ahead of time.
+
+Usage:
+    python3 compress_static.py [folder]
+Writes e.g. 'styles.css.gz' (and '.br', '.zst' variants if the brotli and zstandard packages
+are installed) next to each compressible file of at least compression.MIN_SIZE bytes, at the
+highest compression levels. The app serves a variant instead of the file to clients accepting
+its content coding as long as the variant is not older than the file, so the script must be
+rerun after static files are edited. Up to date variants are left as they are.
+"""
+import argparse
+import os
+import sys
+
+import compression
+
+DEFAULT_STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+
+def is_up_to_date(path):
+    mtime = os.path.getmtime(path)
+    return all(os.path.exists(path + compression.STATIC_SUFFIXES[encoding])
+               and os.path.getmtime(path + compression.STATIC_SUFFIXES[encoding]) >= mtime
+               for encoding in compression.ENCODINGS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("folder", nargs="?", default=DEFAULT_STATIC_FOLDER)
+    parser.add_argument("--force", action="store_true", help="recompress up to date files")
+    args = parser.parse_args()
+
+    suffixes = tuple(compression.STATIC_SUFFIXES.values())
+    total = {encoding: 0 for encoding in compression.ENCODINGS}
+    original = 0
+    for root, _, files in os.walk(args.folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith(suffixes) or (not args.force and is_up_to_date(path)):
+                continue
+            sizes = compression.compress_static_file(path)
+            if not sizes:
+                continue
+            size = os.path.getsize(path)
+            original += size
+            for encoding, compressed in sizes.items():
+                total[encoding] += compressed
+            print("{}: {:,} bytes -> {}".format(
+                os.path.relpath(path, args.folder), size,
+                ", ".join(f"{encoding} {compressed:,}" for encoding, compressed in sizes.items())),
+                file=sys.stderr)
+
+    if not original:
+        print("No files to compress.", file=sys.stderr)
+        return
+    print("Total: {:,} bytes -> {}".format(original, ", ".join(
+        f"{encoding} {size:,} ({size / original:.0%})" for encoding, size in total.items())),
+        file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
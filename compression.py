@@ -0,0 +1,194 @@
+"""HTTP response compression.
+
+Responses are compressed with the content coding the client prefers (by the Accept-Encoding
+header) among the supported ones: gzip, plus brotli ("br") and Zstandard ("zstd") if the
+'brotli' and 'zstandard' packages are installed. Small responses are sent as they are, since
+the saving would not be worth the CPU time. Streamed responses are compressed chunk by chunk.
+
+Static files are not compressed on the fly. Instead, variants compressed ahead of time (e.g.
+'styles.css.gz' next to 'styles.css', see compress_static.py) are served when the client
+accepts them and they are not older than the file itself.
+"""
+import mimetypes
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MIN_SIZE = 1024 # bytes, smaller responses are not compressed
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # 11 is the best and slowest, used for static files
+ZSTD_LEVEL = 3
+STATIC_BROTLI_QUALITY = 11
+STATIC_ZSTD_LEVEL = 19
+COMPRESSIBLE_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+# File name suffixes of static file variants compressed ahead of time
+STATIC_SUFFIXES = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+
+# Content codings supported for dynamic compression, most preferred first
+ENCODINGS = tuple(encoding for encoding, available in (("br", brotli), ("zstd", zstandard),
+                                                      ("gzip", zlib))
+                  if available)
+
+
+def negotiate(accept_encoding, encodings=ENCODINGS):
+    """Return the content coding that the client prefers according to the Accept-Encoding
+    header value among the given ones (ties are resolved by their order), or None if it accepts
+    none of them.
+    """
+    qualities = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            qualities[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = qualities.get(encoding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressor(encoding, level=None):
+    """Return tuple of compress(chunk) and finish() functions of a new streaming compressor
+    producing the content coding. Both return bytes of the compressed stream produced so far.
+
+    :param level: An integer. Compression level (quality for brotli). Defaults to the
+        module's setting for dynamic compression.
+    """
+    if encoding == "gzip":
+        c = zlib.compressobj(level or GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress, c.flush
+    if encoding == "br":
+        c = brotli.Compressor(quality=level or BROTLI_QUALITY)
+        return c.process, c.finish
+    if encoding == "zstd":
+        c = zstandard.ZstdCompressor(level=level or ZSTD_LEVEL).compressobj()
+        return c.compress, c.flush
+    raise ValueError(f"unsupported content coding {encoding!r}")
+
+
+def compress(data, encoding, level=None):
+    """Return bytes compressed with the content coding"""
+    process, finish = compressor(encoding, level)
+    return process(data) + finish()
+
+
+def compress_stream(chunks, encoding):
+    """Generate compressed chunks of an iterable of bytes"""
+    process, finish = compressor(encoding)
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def is_compressible(mimetype):
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES
+
+
+def compress_response(response, accept_encoding, min_size=MIN_SIZE):
+    """Compress the body of the Flask response in place with the content coding the client
+    prefers. Responses that are not successful, not of a textual type, already encoded, files
+    passed through or smaller than min_size bytes are left as they are.
+
+    A strong ETag of a compressed response is made weak, as the compressed bytes differ from
+    those the tag was computed for; If-None-Match is compared weakly, so the tag still matches.
+    Returns the response.
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not is_compressible(response.mimetype or "")):
+        return response
+    if not response.is_streamed and response.calculate_content_length() < min_size:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encoding)
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def static_encoding(path, accept_encoding):
+    """Return the content coding of the pre-compressed variant of the static file that the
+    client prefers, or None if there is none. Variants older than the file are ignored.
+    """
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    fresh = []
+    for encoding, suffix in STATIC_SUFFIXES.items():
+        try:
+            if os.stat(path + suffix).st_mtime >= mtime:
+                fresh.append(encoding)
+        except OSError:
+            pass
+    return negotiate(accept_encoding, fresh) if fresh else None
+
+
+def has_static_variants(path):
+    """Return True if any pre-compressed variant of the static file exists"""
+    return any(os.path.exists(path + suffix) for suffix in STATIC_SUFFIXES.values())
+
+
+def compress_static_file(path, min_size=MIN_SIZE):
+    """Write variants of the static file compressed with each supported content coding at the
+    highest level next to it, unless the file is not compressible or is smaller than min_size
+    bytes. Variants not smaller than the file are not kept. Return dictionary of the sizes of
+    the written variants keyed by content coding.
+    """
+    mimetype = mimetypes.guess_type(path)[0]
+    if not mimetype or not is_compressible(mimetype) or os.path.getsize(path) < min_size:
+        return {}
+    with open(path, "rb") as f:
+        data = f.read()
+
+    levels = {"gzip": 9, "br": STATIC_BROTLI_QUALITY, "zstd": STATIC_ZSTD_LEVEL}
+    sizes = {}
+    for encoding in ENCODINGS:
+        variant = path + STATIC_SUFFIXES[encoding]
+        compressed = compress(data, encoding, levels[encoding])
+        if len(compressed) >= len(data):
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        with open(variant, "wb") as f:
+            f.write(compressed)
+        sizes[encoding] = len(compressed)
+    return sizes
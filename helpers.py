@@ -1,16 +1,21 @@
+import base64
+import hashlib
+import json
 import os
 import urllib.request
 import locale
 import re
 
 from functools import wraps
-from flask import redirect, render_template, request, session
+from flask import current_app, redirect, render_template, request, session, url_for
 from jinja2 import evalcontextfilter, Markup, escape
 
 from backend.Recipe import Content
 
 VALID_USERNAME = "[a-zA-Z0-9_]+$"
 
+_fingerprints = {} # path of a static file -> (mtime, size, fingerprint)
+
 def apology(message, code=400):
     """Render message as an apology to user."""
     def escape(s):
@@ -49,6 +54,19 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def encode_cursor(value):
+    """Return URL-safe string encoding a JSONifiable pagination cursor (e.g. a summary key)"""
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+
+def decode_cursor(s):
+    """Return value encoded by encode_cursor() or None if the string is not a valid cursor"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(s.encode()))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
 def username_valid(s):
     """Return lowercased string if contains only chars allowed in usernames. Return None otherwise.
     """
@@ -78,6 +96,26 @@ def categories(recipe):
     return categories_sorted
 
 
+# Global for Jinja
+def static_url(filename):
+    """Return URL of the static file with a fingerprint of its contents as the 'v' parameter, so
+    that the URL changes along with the file and responses to it can be cached for good. Files
+    that don't exist (e.g. URL templates filled in by scripts) get no fingerprint.
+    """
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return url_for("static", filename=filename)
+
+    cached = _fingerprints.get(path)
+    if cached is None or cached[:2] != (stat.st_mtime_ns, stat.st_size):
+        with open(path, "rb") as f:
+            fingerprint = hashlib.sha1(f.read()).hexdigest()[:12]
+        cached = _fingerprints[path] = (stat.st_mtime_ns, stat.st_size, fingerprint)
+    return url_for("static", filename=filename, v=cached[2])
+
+
 # Filter for Jinja. Returns a string where newline chars are  replaced with <br> tags and <p> wraps
 # http://jinja.pocoo.org/docs/2.10/api/#custom-filters
 _paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
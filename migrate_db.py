@@ -0,0 +1,14 @@
+from backend.DBHandler import DBHandler, DBError
+
+db = DBHandler()
+
+try:
+    old_version = db.get_schema_version()
+    new_version = db.migrate()
+
+    if new_version == old_version:
+        print(f"The DB is already up to date (schema version {new_version}).")
+    else:
+        print(f"DB migrated from schema version {old_version} to {new_version}.")
+except DBError as err:
+    print(f"{err} Operation aborted.")
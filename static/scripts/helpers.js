@@ -6,9 +6,11 @@ function img_error(e) {
 
 // Change img src to a new file within the same directory
 function img_change_file(img, new_name, new_ext=null) {
-    var old_name = $(img).prop("src").split("/").pop();
+    // The fingerprint (?v=...) of the old file is not valid for the new one
+    var old_src = $(img).prop("src").split("?")[0];
+    var old_name = old_src.split("/").pop();
     var old_ext = "." + old_name.split(".").pop();
-    var new_src = $(img).prop("src").replace(old_name, new_name + (new_ext ? new_ext : old_ext));
+    var new_src = old_src.replace(old_name, new_name + (new_ext ? new_ext : old_ext));
 
     $(img).prop("src", new_src);
 }
@@ -7,6 +7,7 @@ const MEAL_DETAILS_CONTAINER_ID = "modal-meal-details-content";
 const ADD_CARDS_BEFORE = "meal-card-container_add"; // id of the element before which new cards should be added
 
 var action_url = window.location.origin + "/action"; // URL to send meal add/remove commands
+var suggest_url = window.location.origin + "/suggest"; // URL to get random valid recipes
 
 active_meal_ids = []; // holds ids of meals/recipes in cards
 
@@ -20,26 +21,16 @@ function recipe_to_cat_str(recipe) {
 }
 
 // Fetch a random valid recipe for a user and pass it to success callback func
-// or pass -1 if no such recipes available
-function get_random_valid_recipe(exclude_ids, data=null, success=null) {
-    if ( data ) {
-        var valid_ids = data.filter(id => exclude_ids.indexOf(id) < 0);
-        if ( valid_ids.length == 0 ) {
-            return success(-1); // if no more recipes left
-        }
-
-        var random_id = valid_ids[Math.floor(Math.random() * valid_ids.length)];
+// or pass -1 if no such recipes available. Recipes in the user's meal plan are excluded server-side
+function get_random_valid_recipe(exclude_ids, success) {
+    var params = {
+        "n": 1,
+        "exclude": exclude_ids.join(","),
+    };
 
-        fetch_object("recipe", random_id, function(data) {
-           return success(data);
-        });
-    } else {
-        fetch_object("valid_meals", null, function(data) {
-            get_random_valid_recipe(exclude_ids, data, function(data) {
-                success(data);
-            });
-        });
-    }
+    $.getJSON(suggest_url, params, function(data) {
+        return success(data.length ? data[0] : -1);
+    });
 }
 
 // Add new meal to the user and add a card container to DOM using random valid meal
@@ -60,7 +51,7 @@ function add_meal(exclude_ids, add_before_id, data=null) {
 
         $("#" + add_before_id).before(card_container);
     } else {
-        get_random_valid_recipe(exclude_ids, null, function(data) {
+        get_random_valid_recipe(exclude_ids, function(data) {
             add_meal(exclude_ids, add_before_id, data);
         });
     }
@@ -128,7 +119,7 @@ function update_card(card, recipe) {
 function reroll_meal(card, exclude_ids, allow_repeat=false){
     var card = $(card);
     var current_recipe_id = card.data("meal_id");
-    get_random_valid_recipe(exclude_ids, null, function(recipe) {
+    get_random_valid_recipe(exclude_ids, function(recipe) {
         if ( recipe != -1 ) {
             update_card(card, recipe);
 
@@ -3,6 +3,12 @@
 const ING_BADGE_ID_PREFIX = "contents-added-badge_";
 const ING_BADGE_CSS_CLASS = "badge badge-primary ml-1 mr-1";
 const BADGE_REMOVE_CHAR = "&#x274E;";
+const COMPLETE_URL = window.location.origin + "/api/ingredients/complete";
+const COMPLETE_DELAY = 200; // ms to wait after the last keystroke before fetching completions
+
+// Ingredients fetched for the ingredient input by lowercased name
+var completions = {};
+var complete_timer = null;
 
 // Array of Content objects for recipe in editing
 var form_contents = [];
@@ -15,7 +21,7 @@ form_set_new = function(form_id){
     var form_elements = $("[form="+ form_id + "]");
     set_default(form_elements.filter("[id^=form-image-current]"));
     set_default(form_elements.filter("[name=instructions]"));
-    set_default($("#contents-select-ingredient"));
+    set_default($("#contents-ingredient"));
 
     var ingredient_ids = form_contents.map(x => x["ingredient_id"]);
     for ( i of ingredient_ids ) {
@@ -53,6 +59,29 @@ form_set_edit = function(form_id, id, data=null) {
 };
 
 
+// Fetch ingredients matching the query and pass them to success callback func
+function complete_ingredient(query, success) {
+    $.getJSON(COMPLETE_URL, {"q": query}, function(data) {
+        return success(data);
+    });
+}
+
+// Offer ingredients matching the ingredient input value as its options
+function ingredient_options_update() {
+    var query = $("#contents-ingredient").val().trim();
+    if ( !query ) {
+        return;
+    }
+
+    complete_ingredient(query, function(data) {
+        var options = $("#contents-ingredient-options").empty();
+        for ( ingredient of data ) {
+            completions[ingredient["name"].toLowerCase()] = ingredient;
+            options.append($("<option>").val(ingredient["name"]));
+        }
+    });
+}
+
 // Add new content to the list and reflect that in the interface
 function content_add(list, ingredient, amount=0.0, units=null) {
     // Add ingredient badge to the ingredients list div
@@ -109,18 +138,15 @@ $(document).ready(function() {
 
     // Adds new content to contents array for the db_write form
     $("#contents-add").click(function() {
-        var ingredient = {
-            id: $("#contents-select-ingredient").val(),
-            name : $("#contents-select-ingredient option:selected").text(),
-        };
+        var ingredient = completions[$("#contents-ingredient").val().trim().toLowerCase()];
         var amount = parseFloat($("#contents-amount").val());
         var units = $("#contents-units").val();
 
 
 
         // Validate ingredient id and amount
-        if ( !ingredient["id"] ) {
-            $("#contents-select-ingredient").focus();
+        if ( !ingredient ) {
+            $("#contents-ingredient").focus();
             return;
         }
         if ( !(parseFloat(amount) >=0) ) {
@@ -133,13 +159,20 @@ $(document).ready(function() {
         content_add(form_contents, ingredient, amount, units);
 
         // Reset input field values
-        $("#contents-select-ingredient").val(0);
-        $("#contents-select-ingredient").focus();
+        $("#contents-ingredient").val("");
+        $("#contents-ingredient-options").empty();
+        $("#contents-ingredient").focus();
         $("#contents-amount").val("");
         $("#contents-units").val("");
 
     });
 
+    // Fetch ingredient options once the user stops typing
+    $("#contents-ingredient").on("input", function() {
+        clearTimeout(complete_timer);
+        complete_timer = setTimeout(ingredient_options_update, COMPLETE_DELAY);
+    });
+
     // Trigger 'Add' button press Enter key for content inputs
     $("[id|=contents]").filter("input").keyup(function(e) {
         if ( e.which == 13 ) {